@@ -0,0 +1,246 @@
+'''Time each stage of the pipeline on a synthetic corpus and write the timings as JSON.
+
+Stages whose dependencies (spaCy and its model, tomotopy, ...) are not installed are
+reported as skipped. Compare two runs with --compare to spot regressions.
+
+Example:
+    python -m benchmarks.run_benchmarks --companies 100 --quarters 8 --words 5000 --out bench.json
+    python -m benchmarks.run_benchmarks --compare base.json --out bench.json
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_data import make_corpus, write_corpus
+
+
+def time_stage(results, stage, func, repeat=1, n_items=None):
+    '''Run func repeat times and append its timings to results
+
+    ** Inputs **
+    results: list -> stage records
+    stage: str -> name of the stage
+    func: callable -> the stage, called without arguments
+    repeat: int -> number of timed runs
+    n_items: int -> number of documents/rows processed per run, for the throughput
+
+    ** Returns **
+    output: the output of the last run
+    '''
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func()
+        seconds.append(time.perf_counter() - start)
+    median = float(np.median(seconds))
+    results.append({'stage': stage,
+                    'status': 'ok',
+                    'seconds': seconds,
+                    'best': min(seconds),
+                    'median': median,
+                    'n_items': n_items,
+                    'items_per_second': n_items / median if n_items and median > 0 else None})
+    print(f'{stage}: {median:.3f}s')
+    return output
+
+def skip_stage(results, stage, reason):
+    results.append({'stage': stage, 'status': 'skipped', 'reason': reason})
+    print(f'{stage}: skipped ({reason})')
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_tokenize(results, corpus, repeat):
+    try:
+        import spacy
+        from utils.preprocesing_token import tokenize_text
+        nlp = spacy.load('en_core_web_sm')
+    except (ImportError, OSError) as e:
+        return skip_stage(results, 'tokenize_text', str(e))
+    # one row per call with the merged QnA text, as in the notebook
+    calls = corpus['transcripts'].groupby(['gvkey', 'doc_date'])['componentText'].apply(lambda x: ' '.join(x)).reset_index()
+    time_stage(results, 'tokenize_text', lambda: tokenize_text(calls, nlp, noun=True), repeat, len(calls))
+
+def bench_topics(results, corpus, repeat, rel_tol):
+    '''Train and infer the HDP models, returning them with the transcripts with topics (None if skipped)
+    '''
+    try:
+        from utils.hdp_training import train_hdp_model, get_earnings_call_w_topics
+    except ImportError as e:
+        skip_stage(results, 'train_hdp_model', str(e))
+        skip_stage(results, 'get_earnings_call_w_topics', str(e))
+        return None, None
+    df, quarter_lst = corpus['token_df'], corpus['quarter_lst']
+    hdp_model_lst = time_stage(results, 'train_hdp_model',
+                               lambda: train_hdp_model(quarter_lst, df, rel_tol=rel_tol), repeat, len(df))
+    earnings_call_qt_list = time_stage(results, 'get_earnings_call_w_topics',
+                                       lambda: get_earnings_call_w_topics(hdp_model_lst, df, quarter_lst=quarter_lst),
+                                       repeat, len(df))
+    return hdp_model_lst, earnings_call_qt_list
+
+def bench_evaluation(results, corpus, paths, earnings_call_qt_list, repeat):
+    try:
+        from utils.price_store import get_price_store
+        from utils.evaluation import (get_start_end_date, get_topic_all_tic_list, get_stock_price_from_csv,
+                                      get_group_price, get_sharpe_ratio, get_info_ratio)
+    except ImportError as e:
+        for stage in ['get_stock_price_from_csv', 'get_group_price', 'get_sharpe_ratio', 'get_info_ratio']:
+            skip_stage(results, stage, str(e))
+        return
+    if earnings_call_qt_list is None:
+        # without topic models, group the companies by sector
+        df = corpus['token_df']
+        earnings_call_qt_list = [df[df['doc_quarter'] == quarter].assign(topic_allocation=df['gsector'])
+                                 for quarter in corpus['quarter_lst']]
+
+    store_dir = os.path.join(os.path.dirname(paths['prices']), 'price_store')
+    def read_cold():
+        shutil.rmtree(store_dir, ignore_errors=True)
+        get_price_store.cache_clear()
+        return read_all()
+    def read_all():
+        return [get_stock_price_from_csv(df['tic'].unique().tolist(), *get_start_end_date(df),
+                                         csv_path=paths['prices'], store_dir=store_dir)
+                for df in earnings_call_qt_list]
+    n_quarters = len(earnings_call_qt_list)
+    time_stage(results, 'get_stock_price_from_csv (cold)', read_cold, repeat, n_quarters)
+    stock_prices = time_stage(results, 'get_stock_price_from_csv', read_all, repeat, n_quarters)
+
+    group_prices = time_stage(results, 'get_group_price',
+                              lambda: [get_group_price(get_topic_all_tic_list(df), stock_price).dropna(axis=1)
+                                       for df, stock_price in zip(earnings_call_qt_list, stock_prices)],
+                              repeat, n_quarters)
+    # equally weighted market of all the synthetic companies
+    market_returns = [stock_price.mean(axis=1).pct_change() for stock_price in stock_prices]
+    time_stage(results, 'get_sharpe_ratio',
+               lambda: [get_sharpe_ratio(group_price, 0.01) for group_price in group_prices], repeat, n_quarters)
+    time_stage(results, 'get_info_ratio',
+               lambda: [get_info_ratio(group_price, market_return)
+                        for group_price, market_return in zip(group_prices, market_returns)], repeat, n_quarters)
+
+def bench_trends(results, hdp_model_lst, quarter_lst, repeat):
+    stages = ['get_top_n_topic_wrds', 'get_word_quarter_matrix', 'get_yearly_rollup', 'get_trend_tables']
+    if hdp_model_lst is None:
+        for stage in stages:
+            skip_stage(results, stage, 'no HDP models')
+        return
+    try:
+        from utils.trend_word_change import (get_top_n_topic_wrds, get_word_quarter_matrix,
+                                             get_yearly_rollup, get_trend_tables)
+    except ImportError as e:
+        for stage in stages:
+            skip_stage(results, stage, str(e))
+        return
+    n_quarters = len(quarter_lst)
+    top_words = time_stage(results, 'get_top_n_topic_wrds', lambda: get_top_n_topic_wrds(hdp_model_lst, 10),
+                           repeat, n_quarters)
+    word_count, _ = time_stage(results, 'get_word_quarter_matrix', lambda: get_word_quarter_matrix(top_words),
+                               repeat, n_quarters)
+    time_stage(results, 'get_yearly_rollup', lambda: get_yearly_rollup(word_count, quarter_lst), repeat, n_quarters)
+    time_stage(results, 'get_trend_tables',
+               lambda: get_trend_tables(hdp_model_lst, quarter_lst, top_words=top_words), repeat, n_quarters)
+
+def run_benchmarks(n_companies=50, n_quarters=8, n_words=2000, doc_len=400, seed=1234, repeat=1,
+                   rel_tol=1e-3, data_dir=None):
+    '''Generate the synthetic corpus and time every stage
+
+    ** Inputs **
+    n_companies: int -> number of companies
+    n_quarters: int -> number of quarters
+    n_words: int -> vocabulary size
+    doc_len: int -> number of words per call
+    seed: int -> seed of the synthetic corpus
+    repeat: int -> number of timed runs per stage
+    rel_tol: float -> early stopping tolerance of the HDP training, None for the full 1000 iterations
+    data_dir: str -> directory for the synthetic files, a temporary directory if None
+
+    ** Returns **
+    report: dict -> 'meta', 'scale' and 'stages' (one record per stage)
+    '''
+    scale = {'n_companies': n_companies, 'n_quarters': n_quarters, 'n_words': n_words,
+             'doc_len': doc_len, 'seed': seed, 'repeat': repeat, 'rel_tol': rel_tol}
+    tmp_dir = tempfile.mkdtemp(prefix='hdp_bench_') if data_dir is None else None
+    try:
+        results = []
+        corpus = time_stage(results, 'make_corpus', lambda: make_corpus(n_companies, n_quarters, n_words,
+                                                                        doc_len=doc_len, seed=seed))
+        paths = write_corpus(corpus, data_dir or tmp_dir)
+
+        bench_tokenize(results, corpus, repeat)
+        hdp_model_lst, earnings_call_qt_list = bench_topics(results, corpus, repeat, rel_tol)
+        bench_evaluation(results, corpus, paths, earnings_call_qt_list, repeat)
+        bench_trends(results, hdp_model_lst, corpus['quarter_lst'], repeat)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    meta = {'timestamp': pd.Timestamp.now(tz='UTC').isoformat(),
+            'git_commit': get_git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+    return {'meta': meta, 'scale': scale, 'stages': results}
+
+def compare_reports(base, new, threshold=0.1):
+    '''Median time ratio (new / base) of the stages run in both reports
+
+    ** Inputs **
+    base: dict -> baseline report of run_benchmarks
+    new: dict -> new report of run_benchmarks
+    threshold: float -> relative slowdown flagged as a regression
+
+    ** Returns **
+    comparison: DataFrame -> one row per stage with both medians, the ratio and a regression flag
+    '''
+    def medians(report):
+        return {r['stage']: r['median'] for r in report['stages'] if r['status'] == 'ok'}
+    base_med, new_med = medians(base), medians(new)
+    rows = [{'stage': stage, 'base': base_med[stage], 'new': new_med[stage],
+             'ratio': new_med[stage] / base_med[stage] if base_med[stage] > 0 else np.nan}
+            for stage in new_med if stage in base_med]
+    comparison = pd.DataFrame(rows, columns=['stage', 'base', 'new', 'ratio'])
+    comparison['regression'] = comparison['ratio'] > 1 + threshold
+    return comparison
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on a synthetic corpus.')
+    parser.add_argument('--companies', type=int, default=50)
+    parser.add_argument('--quarters', type=int, default=8)
+    parser.add_argument('--words', type=int, default=2000, help='vocabulary size')
+    parser.add_argument('--doc-len', type=int, default=400, help='words per call')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per stage')
+    parser.add_argument('--rel-tol', type=float, default=1e-3, help='HDP early stopping tolerance')
+    parser.add_argument('--data-dir', help='keep the synthetic files in this directory')
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--compare', help='baseline report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown flagged as a regression')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.companies, args.quarters, args.words, args.doc_len, args.seed,
+                            args.repeat, args.rel_tol, args.data_dir)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.out}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            comparison = compare_reports(json.load(f), report, args.threshold)
+        print(comparison.to_string(index=False))
+        if comparison['regression'].any():
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
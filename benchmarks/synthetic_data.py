@@ -0,0 +1,169 @@
+'''Deterministic synthetic earnings call corpus with the schema of the WRDS / CRSP data,
+for benchmarking the pipeline without the restricted data.
+
+Each company belongs to a GICS sector and talks about a mix of latent topics favoured by its
+sector, so the HDP models find structure, and its daily price follows a random walk driven
+by a sector factor, so the topic groups have correlated returns.
+'''
+import os
+import numpy as np
+import pandas as pd
+
+GICS_SECTORS = [10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60]
+
+
+def make_vocab(n_words):
+    '''Synthetic vocabulary of pronounceable lowercase words, unique and stable across runs
+    '''
+    syllables = ['ka', 're', 'mi', 'to', 'nu', 'sa', 'lo', 'pe', 'di', 'va', 'go', 'be', 'zu', 'fi', 'ha', 'ro']
+    vocab = []
+    for i in range(n_words):
+        word, n = '', i + len(syllables)
+        while n:
+            n, r = divmod(n, len(syllables))
+            word += syllables[r]
+        vocab.append(word)
+    return vocab
+
+def make_companies(n_companies, rng):
+    '''Company table with the columns of data/tick_gvkey_gics.csv
+
+    ** Inputs **
+    n_companies: int -> number of companies
+    rng: np.random.Generator -> random generator
+
+    ** Returns **
+    comp_info: DataFrame -> 'conm', 'gvkey', 'tic', 'gsector', 'ggroup', 'gind'
+    '''
+    gsector = rng.choice(GICS_SECTORS, size=n_companies)
+    ggroup = gsector * 100 + 10 * rng.integers(1, 4, size=n_companies)
+    gind = ggroup * 100 + 10 * rng.integers(1, 4, size=n_companies)
+    return pd.DataFrame({'conm': [f'SYNTHETIC CO {i}' for i in range(n_companies)],
+                         'gvkey': np.arange(1000, 1000 + n_companies),
+                         'tic': [f'T{i:04d}' for i in range(n_companies)],
+                         'gsector': gsector,
+                         'ggroup': ggroup,
+                         'gind': gind})
+
+def make_transcripts(comp_info, quarter_lst, vocab, rng, n_topics=20, doc_len=400, n_components=4):
+    '''QnA transcripts of every company in every quarter, drawn from latent topics
+
+    ** Inputs **
+    comp_info: DataFrame -> output of make_companies
+    quarter_lst: list -> quarters (pd.Period) of the calls
+    vocab: list -> vocabulary
+    rng: np.random.Generator -> random generator
+    n_topics: int -> number of latent topics
+    doc_len: int -> number of words per call
+    n_components: int -> number of QnA components per call
+
+    ** Returns **
+    transcripts: DataFrame -> one row per component, with the columns of the transcript parquet
+    tokens: list -> words of each call, in (quarter, company) order
+    '''
+    topic_word = rng.dirichlet(np.full(len(vocab), 0.05), size=n_topics)
+    sector_topic = {sector: rng.dirichlet(np.full(n_topics, 0.3)) for sector in GICS_SECTORS}
+    vocab = np.asarray(vocab)
+
+    rows, tokens = [], []
+    for quarter in quarter_lst:
+        call_days = rng.integers(0, 80, size=len(comp_info))
+        for (gvkey, gsector), day in zip(comp_info[['gvkey', 'gsector']].itertuples(index=False), call_days):
+            # company topic mix around the sector's
+            theta = rng.dirichlet(50 * sector_topic[gsector] + 0.1)
+            topic_len = rng.multinomial(doc_len, theta)
+            word_ids = np.concatenate([rng.choice(len(vocab), size=n, p=topic_word[k])
+                                       for k, n in enumerate(topic_len) if n])
+            words = vocab[rng.permutation(word_ids)].tolist()
+            tokens.append(words)
+            doc_date = (quarter.start_time + pd.Timedelta(days=int(day))).strftime('%Y-%m-%d')
+            for i, part in enumerate(np.array_split(np.asarray(words), n_components)):
+                rows.append({'gvkey': f'{gvkey:06d}',
+                             'doc_date': doc_date,
+                             'transcriptComponentTypeId': 3 if i % 2 == 0 else 4,
+                             'componentText': ' '.join(part)})
+    return pd.DataFrame(rows), tokens
+
+def make_token_df(comp_info, transcripts, tokens):
+    '''Tokenized QnA transcript, as after add_tokenized_text, built from the drawn words
+    '''
+    compdesc_info = comp_info.astype(str)
+    compdesc_info['gvkey'] = compdesc_info['gvkey'].apply(lambda x: x.zfill(6))
+    calls = transcripts.drop_duplicates(['gvkey', 'doc_date'])[['gvkey', 'doc_date']].reset_index(drop=True)
+    df = calls.merge(compdesc_info, on='gvkey', how='left')
+    df['qna tokens'] = tokens
+    df['doc_date'] = pd.to_datetime(df['doc_date'])
+    df['doc_quarter'] = df['doc_date'].dt.to_period('Q')
+    return df
+
+def make_prices(comp_info, quarter_lst, rng, daily_vol=0.015, sector_vol=0.01):
+    '''Daily close prices in the long format of data/stock_price_2014_2023.csv, covering the quarter
+    after the last one for the evaluation
+
+    ** Inputs **
+    comp_info: DataFrame -> output of make_companies
+    quarter_lst: list -> quarters (pd.Period) of the calls
+    rng: np.random.Generator -> random generator
+    daily_vol: float -> idiosyncratic daily volatility
+    sector_vol: float -> daily volatility of the sector factor
+
+    ** Returns **
+    prices: DataFrame -> 'DlyCalDt', 'Ticker', 'DlyClose'
+    '''
+    dates = pd.bdate_range(min(quarter_lst).start_time, (max(quarter_lst) + 1).end_time.normalize())
+    sectors = comp_info['gsector'].to_numpy()
+    sector_returns = {sector: rng.normal(0.0003, sector_vol, size=len(dates)) for sector in GICS_SECTORS}
+    returns = (np.stack([sector_returns[sector] for sector in sectors], axis=1)
+               + rng.normal(0, daily_vol, size=(len(dates), len(comp_info))))
+    close = rng.uniform(20, 300, size=len(comp_info)) * np.exp(np.cumsum(returns, axis=0))
+    return pd.DataFrame({'DlyCalDt': np.repeat(dates.strftime('%Y-%m-%d'), len(comp_info)),
+                         'Ticker': np.tile(comp_info['tic'].to_numpy(), len(dates)),
+                         'DlyClose': close.ravel().round(4)})
+
+def make_corpus(n_companies=50, n_quarters=8, n_words=2000, doc_len=400, n_topics=20,
+                start_quarter='2014Q1', seed=1234):
+    '''Generate the whole synthetic corpus; the same arguments always give the same data
+
+    ** Inputs **
+    n_companies: int -> number of companies
+    n_quarters: int -> number of quarters of calls
+    n_words: int -> vocabulary size
+    doc_len: int -> number of words per call
+    n_topics: int -> number of latent topics
+    start_quarter: str -> first quarter
+    seed: int -> random seed
+
+    ** Returns **
+    corpus: dict -> 'comp_info', 'transcripts', 'tokens', 'token_df', 'prices' and 'quarter_lst'
+    '''
+    rng = np.random.default_rng(seed)
+    quarter_lst = list(pd.period_range(start_quarter, periods=n_quarters, freq='Q'))
+    vocab = make_vocab(n_words)
+    comp_info = make_companies(n_companies, rng)
+    transcripts, tokens = make_transcripts(comp_info, quarter_lst, vocab, rng, n_topics=n_topics, doc_len=doc_len)
+    return {'comp_info': comp_info,
+            'transcripts': transcripts,
+            'tokens': tokens,
+            'token_df': make_token_df(comp_info, transcripts, tokens),
+            'prices': make_prices(comp_info, quarter_lst, rng),
+            'quarter_lst': quarter_lst}
+
+def write_corpus(corpus, out_dir):
+    '''Write the corpus with the file names and formats of the data directory
+
+    ** Inputs **
+    corpus: dict -> output of make_corpus
+    out_dir: str -> directory to write to
+
+    ** Returns **
+    paths: dict -> 'comp_info', 'transcripts' and 'prices' file paths
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {'comp_info': os.path.join(out_dir, 'tick_gvkey_gics.csv'),
+             'transcripts': os.path.join(out_dir, 'sp500_cc_transcripts.parquet'),
+             'prices': os.path.join(out_dir, 'stock_price.csv')}
+    corpus['comp_info'].to_csv(paths['comp_info'], index=False)
+    corpus['transcripts'].to_parquet(paths['transcripts'], engine='pyarrow', index=False)
+    # the price csv has a leading index column, as read by utils.price_store.build_price_store
+    corpus['prices'].to_csv(paths['prices'])
+    return paths
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils.evaluation as evaluation
+
+
+def test_get_stock_price_downloads_tickers_missing_from_cache(tmp_path, monkeypatch):
+    dates = pd.bdate_range('2020-01-01', '2020-03-31')
+    cache_path = str(tmp_path / 'reference_prices.parquet')
+    pd.DataFrame({'^GSPC': np.linspace(3000, 3100, len(dates)), 'AAA': np.linspace(10, 11, len(dates))},
+                 index=dates).to_parquet(cache_path)
+
+    downloaded = []
+    def fake_download(tic, start, end, progress=False):
+        downloaded.append(tic)
+        return pd.DataFrame({'Close': np.linspace(50, 55, len(dates))}, index=dates)
+    monkeypatch.setattr(evaluation.yf, 'download', fake_download)
+
+    stock_price = evaluation.get_stock_price(['AAA', 'BBB'], '2020-01-01', '2020-04-01', cache_path=cache_path)
+
+    # AAA is read from the cache, only BBB goes to yahoo finance
+    assert downloaded == ['BBB']
+    assert list(stock_price.columns) == ['AAA', 'BBB']
+    assert len(stock_price) == len(dates)
+    assert stock_price['AAA'].iloc[0] == 10
+
+def test_get_stock_price_without_cache_downloads_all(tmp_path, monkeypatch):
+    dates = pd.bdate_range('2020-01-01', '2020-01-31')
+    monkeypatch.setattr(evaluation.yf, 'download',
+                        lambda tic, start, end, progress=False: pd.DataFrame({'Close': np.ones(len(dates))}, index=dates))
+
+    stock_price = evaluation.get_stock_price(['AAA', 'BBB'], '2020-01-01', '2020-02-01',
+                                             cache_path=str(tmp_path / 'missing.parquet'))
+
+    assert list(stock_price.columns) == ['AAA', 'BBB']
+
+def test_offline_does_not_download(tmp_path, monkeypatch):
+    dates = pd.bdate_range('2020-01-01', '2020-03-31')
+    cache_path = str(tmp_path / 'reference_prices.parquet')
+    pd.DataFrame({'AAA': np.linspace(10, 11, len(dates))}, index=dates).to_parquet(cache_path)
+    def fail_download(*args, **kwargs):
+        raise AssertionError('offline evaluation went to the network')
+    monkeypatch.setattr(evaluation.yf, 'download', fail_download)
+
+    stock_price = evaluation.get_stock_price(['AAA'], '2020-01-01', '2020-04-01', cache_path=cache_path, offline=True)
+    assert list(stock_price.columns) == ['AAA']
+    with pytest.raises(KeyError):
+        evaluation.get_stock_price(['AAA', 'BBB'], '2020-01-01', '2020-04-01', cache_path=cache_path, offline=True)
+    with pytest.raises(FileNotFoundError):
+        evaluation.get_mktrf_rf('2020-01-01', '2020-04-01', cache_path=str(tmp_path / 'missing.parquet'), offline=True)
+
+def _stock_price_with_gaps():
+    dates = pd.bdate_range('2020-01-01', periods=5)
+    return pd.DataFrame({'AAA': [10.0, np.nan, 12.0, 13.0, np.nan],
+                         'BBB': [20.0, 21.0, np.nan, 23.0, np.nan],
+                         'CCC': [30.0, 31.0, 32.0, np.nan, np.nan]}, index=dates)
+
+def test_group_price_renormalizes_missing_prices():
+    stock_price = _stock_price_with_gaps()
+    # 'ZZZ' has no price and is left out of its group
+    groups = [['AAA', 'BBB'], ['BBB', 'CCC', 'ZZZ'], ['AAA']]
+
+    group_price = evaluation.get_group_price(groups, stock_price)
+
+    # each day is the mean over the members with a price, NaN when none has one
+    expected = pd.concat([stock_price[['AAA', 'BBB']].mean(axis=1), stock_price[['BBB', 'CCC']].mean(axis=1),
+                          stock_price['AAA']], axis=1, keys=['group_0', 'group_1', 'group_2'])
+    pd.testing.assert_frame_equal(group_price, expected, check_freq=False)
+    assert groups[1] == ['BBB', 'CCC', 'ZZZ']
+
+def test_topic_membership_matches_group_lists():
+    stock_price = _stock_price_with_gaps()
+    df = pd.DataFrame({'tic': ['AAA', 'BBB', 'BBB', 'CCC', 'ZZZ'], 'topic_allocation': [3, 3, 3, 7, 7]})
+
+    membership, topics = evaluation.get_topic_membership(df, stock_price.columns)
+
+    assert list(topics) == [3, 7]
+    expected = evaluation.get_membership_matrix(evaluation.get_topic_all_tic_list(df), stock_price.columns)
+    assert (membership != expected).nnz == 0
+    assert membership.toarray().tolist() == [[1, 0], [1, 0], [0, 1]]
@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+import pytest
+
+tp = pytest.importorskip('tomotopy')
+
+from utils.hdp_training import make_hdp_model, make_warm_hdp_model, split_cores, train_until_converged
+
+
+def _trained_model():
+    rng = np.random.default_rng(0)
+    groups = [[f'alpha{i}' for i in range(30)], [f'beta{i}' for i in range(30)]]
+    hdp = make_hdp_model(initial_k=2)
+    for d in range(80):
+        hdp.add_doc(list(rng.choice(groups[d % 2], size=50)))
+    hdp.train(200, workers=1)
+    return hdp
+
+def test_warm_start_sets_word_priors():
+    prev_hdp = _trained_model()
+    live_topics = [k for k in range(prev_hdp.k) if prev_hdp.is_live_topic(k)]
+
+    hdp = make_warm_hdp_model(prev_hdp, top_n=5, prior_strength=2.0)
+
+    assert hdp.k == len(live_topics)
+    for j, k in enumerate(live_topics):
+        for word, prob in prev_hdp.get_topic_words(k, top_n=5):
+            prior = np.asarray(hdp.get_word_prior(word))
+            assert len(prior) == hdp.k
+            assert prior[j] >= prev_hdp.eta + 2.0 * prob - 1e-6
+
+
+def test_split_cores_uses_every_core():
+    assert split_cores(8, 3) == (3, [3, 3, 2])
+    assert split_cores(8, 8) == (8, [1] * 8)
+    assert split_cores(4, 8) == (4, [1] * 8)
+    assert split_cores(8, 3, workers_per_quarter=2) == (3, [2, 2, 2])
+
+class _FakeHDP:
+    # stands in for a model resumed from a checkpoint, with a flat log-likelihood
+    def __init__(self, global_step):
+        self.global_step, self.ll_per_word, self.live_k = global_step, -8.0, 5
+
+    def train(self, iterations, workers=1, parallel=None):
+        self.global_step += iterations
+
+def _write_trace(path, records):
+    with open(path, 'w') as f:
+        f.writelines(json.dumps(record) + '\n' for record in records)
+
+def test_resume_restores_convergence_state(tmp_path):
+    trace_path = str(tmp_path / 'trace.jsonl')
+    records = [{'iteration': it, 'll_per_word': -8.0, 'live_k': 5, 'stable': stable, 'converged': False}
+               for it, stable in [(100, 0), (200, 1), (300, 2), (400, 0)]]
+    # the record past the checkpoint's iteration was written before the crash saved the checkpoint
+    _write_trace(trace_path, records)
+    hdp = _FakeHDP(global_step=300)
+
+    trace = train_until_converged(hdp, rel_tol=1e-3, patience=3, trace_path=trace_path)
+
+    # two stable chunks were already seen, one more reaches the patience
+    assert [record['iteration'] for record in trace] == [400]
+    assert trace[-1]['converged']
+    with open(trace_path) as f:
+        assert [json.loads(line)['iteration'] for line in f] == [100, 200, 300, 400]
+
+def test_resume_of_converged_model_does_not_train(tmp_path):
+    trace_path = str(tmp_path / 'trace.jsonl')
+    _write_trace(trace_path, [{'iteration': 100, 'll_per_word': -8.0, 'live_k': 5, 'stable': 3, 'converged': True}])
+    hdp = _FakeHDP(global_step=100)
+
+    assert train_until_converged(hdp, rel_tol=1e-3, patience=3, trace_path=trace_path) == []
+    assert hdp.global_step == 100
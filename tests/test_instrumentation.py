@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import utils.instrumentation as instrumentation
+from utils.instrumentation import enable, stage, get_records, summarize
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    # every test starts disabled, without records, and the module state is restored afterwards
+    for key, value in [('enabled', False), ('profile', False), ('trace_memory', False), ('path', None),
+                       ('records', []), ('stack', [])]:
+        monkeypatch.setitem(instrumentation._state, key, value)
+
+def test_disabled_stage_records_nothing():
+    with stage('noop') as s:
+        assert not s.enabled
+    assert get_records() == []
+
+def test_nested_stages_keep_the_enclosing_peak():
+    enable(trace_memory=True)
+    with stage('outer', quarter='2020Q1') as outer:
+        big = np.ones(2_000_000)
+        del big
+        with stage('inner') as inner:
+            small = np.ones(100_000)
+            inner.add(n_docs=10, n_tokens=1000)
+            del small
+        outer.add(n_docs=10)
+
+    inner_record, outer_record = get_records()
+    assert (inner_record['stage'], inner_record['depth'], inner_record['parent']) == ('inner', 1, 'outer')
+    assert (outer_record['stage'], outer_record['depth'], outer_record['parent']) == ('outer', 0, None)
+    assert outer_record['quarter'] == '2020Q1'
+    # the 16 MB array was freed before the inner stage reset the peak, the outer stage still reports it
+    assert outer_record['tracemalloc_peak_mb'] >= 15
+    assert inner_record['tracemalloc_peak_mb'] < 15
+    assert inner_record['tokens_per_second'] > 0
+    assert instrumentation._state['stack'] == []
+
+def test_shares_are_relative_to_top_level_time():
+    records = [{'stage': 'run', 'depth': 0, 'wall_time': 8.0, 'cpu_time': 8.0},
+               {'stage': 'train', 'depth': 1, 'wall_time': 6.0, 'cpu_time': 6.0},
+               {'stage': 'train.chunk', 'depth': 2, 'wall_time': 5.0, 'cpu_time': 5.0},
+               {'stage': 'report', 'depth': 0, 'wall_time': 2.0, 'cpu_time': 2.0}]
+
+    summary = summarize(records)
+
+    np.testing.assert_allclose(summary.loc[['run', 'train', 'train.chunk', 'report'], 'share'],
+                               [0.8, 0.6, 0.5, 0.2])
+    assert summary.loc['train.chunk', 'depth'] == 2
+
+def test_stage_records_errors():
+    enable()
+    with pytest.raises(ValueError):
+        with stage('failing'):
+            raise ValueError
+    assert get_records()[0]['error'] == 'ValueError'
@@ -0,0 +1,53 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('tomotopy')
+
+import utils.model_registry as model_registry
+from utils.hdp_training import make_hdp_model, save_hdp_model, get_hdp_topics
+from utils.model_paths import get_model_path, get_index_path
+
+QUARTER = pd.Period('2020Q1', freq='Q')
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    groups = [[f'alpha{i}' for i in range(30)], [f'beta{i}' for i in range(30)]]
+    hdp = make_hdp_model(initial_k=2)
+    for d in range(60):
+        hdp.add_doc(list(rng.choice(groups[d % 2], size=40)))
+    hdp.train(100, workers=1)
+    save_hdp_model(hdp, QUARTER, str(tmp_path))
+    return str(tmp_path)
+
+def test_topic_queries_read_the_index_without_the_model(model_dir, monkeypatch):
+    hdp = model_registry.get_model(QUARTER, model_dir)
+    expected = {k: word_prob for k, word_prob in get_hdp_topics(hdp, top_n=5).items()}
+    live_mask = np.array([hdp.is_live_topic(k) for k in range(hdp.k)])
+    def fail_load(*args):
+        raise AssertionError('the model was loaded')
+    monkeypatch.setattr(model_registry, '_load_model', fail_load)
+
+    assert model_registry.list_model_quarters(model_dir) == [QUARTER]
+    assert model_registry.get_model_topics(QUARTER, top_n=5, model_dir=model_dir) == expected
+    np.testing.assert_array_equal(model_registry.get_model_live_mask(QUARTER, model_dir), live_mask)
+
+def test_replaced_model_invalidates_the_index(model_dir):
+    model_path = get_model_path(QUARTER, model_dir)
+    os.utime(model_path, ns=(os.stat(model_path).st_atime_ns, os.stat(model_path).st_mtime_ns + 10**9))
+
+    index = model_registry.get_model_index(QUARTER, model_dir)
+
+    assert index['model_mtime_ns'] == os.stat(model_path).st_mtime_ns
+    with open(get_index_path(QUARTER, model_dir)) as f:
+        assert json.load(f)['model_mtime_ns'] == index['model_mtime_ns']
+
+def test_loaded_models_are_reused(model_dir):
+    assert model_registry.get_model(QUARTER, model_dir) is model_registry.get_model(QUARTER, model_dir)
+    assert [hdp.k for hdp in model_registry.iter_models([QUARTER], model_dir)] == \
+        [model_registry.get_model(QUARTER, model_dir).k]
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('tomotopy')
+
+import utils.pipeline as pipeline
+from utils.pipeline import hash_key, hash_quarter_tokens, get_required_stages, select_quarters
+
+
+def _token_df():
+    return pd.DataFrame({'gvkey': ['000001', '000002', '000001'],
+                         'tic': ['AAA', 'BBB', 'AAA'],
+                         'doc_quarter': pd.PeriodIndex(['2020Q1', '2020Q1', '2020Q2'], freq='Q'),
+                         'qna tokens': [['revenue', 'growth'], ['margin'], ['guidance']]})
+
+def test_hash_key_changes_with_every_input(monkeypatch):
+    key = hash_key('train', 'quarter-key', 1e-3)
+
+    assert hash_key('train', 'quarter-key', 1e-3) == key
+    assert hash_key('train', 'other-key', 1e-3) != key
+    assert hash_key('train', 'quarter-key', None) != key
+    assert hash_key('train', 1e-3, 'quarter-key') != key
+    assert hash_key('infer', 'quarter-key', 1e-3) != key
+    # bumping the stage version invalidates its artifacts
+    monkeypatch.setitem(pipeline.STAGE_VERSIONS, 'train', pipeline.STAGE_VERSIONS['train'] + 1)
+    assert hash_key('train', 'quarter-key', 1e-3) != key
+
+def test_quarter_hash_only_changes_with_its_quarter():
+    df = _token_df()
+    q1, q2 = pd.Period('2020Q1', freq='Q'), pd.Period('2020Q2', freq='Q')
+    changed = df.copy()
+    changed.at[2, 'qna tokens'] = ['guidance', 'capex']
+
+    assert hash_quarter_tokens(changed, q1) == hash_quarter_tokens(df, q1)
+    assert hash_quarter_tokens(changed, q2) != hash_quarter_tokens(df, q2)
+    # a ticker change of a call changes the key as well
+    assert hash_quarter_tokens(df.assign(tic=['AAA', 'CCC', 'AAA']), q1) != hash_quarter_tokens(df, q1)
+
+def test_required_stages_in_dependency_order():
+    assert get_required_stages(['tokenize']) == ['load', 'tokenize']
+    assert get_required_stages(['evaluate', 'trends']) == ['load', 'tokenize', 'phrases', 'train',
+                                                           'infer', 'evaluate', 'trends']
+
+def test_select_quarters():
+    quarter_lst = list(pd.period_range('2022Q1', '2023Q4', freq='Q'))
+
+    assert select_quarters(quarter_lst, start='2023Q3') == quarter_lst[-2:]
+    assert select_quarters(quarter_lst, start='2022Q2', end='2022Q3') == quarter_lst[1:3]
+    assert select_quarters(quarter_lst, quarters=['2023Q4', '2021Q1']) == quarter_lst[-1:]
@@ -0,0 +1,120 @@
+import pickle
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('spacy')
+pytest.importorskip('gensim')
+
+import utils.preprocesing_token as preprocesing_token
+
+
+class _FakeNLP:
+    meta = {'lang': 'en', 'name': 'fake', 'version': '0.0'}
+    pipe_names = []
+
+@pytest.fixture
+def tokenized(monkeypatch):
+    # texts sent to spacy, the fake tokenizer splits on whitespace
+    texts = []
+    def fake_iter_doc_tokens(text_data, nlp, noun=True, n_process=1, batch_size=1000):
+        for text in text_data:
+            texts.append(text)
+            yield text.split()
+    monkeypatch.setattr(preprocesing_token, 'iter_doc_tokens', fake_iter_doc_tokens)
+    return texts
+
+def _df(texts):
+    return pd.DataFrame({'gvkey': [f'{i:06d}' for i in range(len(texts))],
+                         'doc_date': '2020-01-15',
+                         'componentText': texts})
+
+def test_only_misses_are_tokenized(tmp_path, tokenized):
+    cache_dir = str(tmp_path)
+    df = _df(['revenue growth', 'margin guidance', 'capex plan'])
+    assert preprocesing_token.get_cached_tokens(df, _FakeNLP(), cache_dir) == [text.split() for text in df['componentText']]
+    assert len(tokenized) == 3
+
+    # a changed text and a new call in between the cached ones
+    tokenized.clear()
+    new_df = pd.concat([df.iloc[:1], _df(['x', 'y', 'z', 'new call']).iloc[[3]], df.iloc[1:]], ignore_index=True)
+    new_df.loc[3, 'componentText'] = 'capex plan revised'
+
+    tokens = preprocesing_token.get_cached_tokens(new_df, _FakeNLP(), cache_dir)
+
+    assert tokenized == ['new call', 'capex plan revised']
+    assert tokens == [text.split() for text in new_df['componentText']]
+
+def test_tokenization_mode_is_part_of_the_key(tmp_path, tokenized):
+    df = _df(['revenue growth'])
+    preprocesing_token.get_cached_tokens(df, _FakeNLP(), str(tmp_path), noun=True)
+    preprocesing_token.get_cached_tokens(df, _FakeNLP(), str(tmp_path), noun=False)
+
+    assert tokenized == ['revenue growth', 'revenue growth']
+
+class _Token:
+    def __init__(self, lemma_, pos_, is_stop=False, is_alpha=True):
+        self.lemma_, self.pos_, self.is_stop, self.is_alpha = lemma_, pos_, is_stop, is_alpha
+
+class _PipeNLP(_FakeNLP):
+    # records the nlp.pipe arguments, each text is a list of _Token
+    pipe_names = ['tagger', 'parser', 'lemmatizer']
+
+    def pipe(self, texts, n_process=1, batch_size=1000, disable=()):
+        self.calls = {'n_process': n_process, 'batch_size': batch_size, 'disable': disable}
+        return iter(texts)
+
+def test_iter_doc_tokens_disables_unused_pipes():
+    nlp = _PipeNLP()
+    doc = [_Token('Revenue', 'NOUN'), _Token('grow', 'VERB'), _Token('the', 'DET', is_stop=True),
+           _Token('2020', 'NOUN', is_alpha=False)]
+
+    assert list(preprocesing_token.iter_doc_tokens([doc], nlp, noun=True, n_process=4, batch_size=50)) == [['revenue']]
+    assert list(preprocesing_token.iter_doc_tokens([doc], nlp, noun=False)) == [['revenue', 'grow']]
+    # 'ner' is not in the pipeline and is not passed
+    assert nlp.calls['disable'] == ['parser']
+
+def test_tokenize_to_disk_in_chunks(tmp_path, tokenized):
+    df = _df(['a b', 'c', 'd e f', 'g', 'h'])
+
+    chunk_paths = preprocesing_token.tokenize_text_to_disk(df, _FakeNLP(), str(tmp_path), chunk_size=2)
+
+    assert len(chunk_paths) == 3
+    chunks = list(preprocesing_token.iter_token_chunks(chunk_paths))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [doc for chunk in chunks for doc in chunk] == [text.split() for text in df['componentText']]
+
+def _phrase_corpus():
+    return [['interest', 'rate', 'increase'], ['interest', 'rate', 'cut'], ['supply', 'chain', 'interest', 'rate'],
+            ['supply', 'chain', 'issue'], ['margin'], ['interest', 'rate', 'supply', 'chain']] * 5
+
+def test_streamed_phrases_match_a_single_pass(tmp_path):
+    docs = _phrase_corpus()
+    path = str(tmp_path / 'phrases.model')
+
+    streamed = preprocesing_token.learn_phrases([docs[:7], docs[7:20], docs[20:]], path=path,
+                                                min_count=2, scoring='npmi', threshold=0.7)
+    single = preprocesing_token.learn_phrases([docs], min_count=2, scoring='npmi', threshold=0.7)
+    loaded = preprocesing_token.load_phrases(path)
+
+    phrased = list(preprocesing_token.apply_phrases(streamed, docs))
+    assert phrased == list(preprocesing_token.apply_phrases(single, docs))
+    assert phrased == list(preprocesing_token.apply_phrases(loaded, docs))
+    assert phrased[0] == ['interest_rate', 'increase']
+
+def test_apply_phrases_to_chunks(tmp_path):
+    docs = _phrase_corpus()
+    phrases_path = str(tmp_path / 'phrases.model')
+    bigram = preprocesing_token.learn_phrases([docs], path=phrases_path, min_count=2, scoring='npmi',
+                                              threshold=0.7)
+    chunk_paths = []
+    for i, chunk in enumerate([docs[:10], docs[10:]]):
+        chunk_paths.append(str(tmp_path / f'tokens_{i:05d}.pkl'))
+        with open(chunk_paths[-1], 'wb') as f:
+            pickle.dump(chunk, f)
+
+    out_paths = preprocesing_token.apply_phrases_to_chunks(phrases_path, chunk_paths, str(tmp_path / 'phrased'),
+                                                           n_process=1)
+
+    phrased = [doc for chunk in preprocesing_token.iter_token_chunks(out_paths) for doc in chunk]
+    assert phrased == list(preprocesing_token.apply_phrases(bigram, docs))
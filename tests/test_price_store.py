@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.price_store import build_price_store, load_price_store, get_price_store, get_prices
+
+
+def _write_csv(path, tickers=('AAA', 'BBB', 'CCC')):
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2020-01-01', '2020-03-31').strftime('%Y-%m-%d')
+    prices = pd.DataFrame({'DlyCalDt': np.repeat(dates, len(tickers)),
+                           'Ticker': np.tile(tickers, len(dates)),
+                           'DlyClose': rng.uniform(10, 100, len(dates) * len(tickers)).round(4)})
+    # 'CCC' is not traded on the first days, the csv has a leading index column
+    prices = prices[~((prices['Ticker'] == 'CCC') & (prices['DlyCalDt'] < '2020-01-08'))]
+    prices.sample(frac=1, random_state=0).to_csv(path)
+    return prices
+
+def test_round_trip_matches_the_pivot(tmp_path):
+    csv_path = str(tmp_path / 'prices.csv')
+    prices = _write_csv(csv_path)
+
+    store = build_price_store(csv_path, str(tmp_path / 'store'))
+    stock_price = get_prices(store, ['CCC', 'AAA', 'ZZZ'], '2020-01-06', '2020-02-14')
+
+    expected = prices.pivot_table(index='DlyCalDt', columns='Ticker', values='DlyClose', aggfunc='first')
+    expected.index = pd.to_datetime(expected.index)
+    expected = expected.loc['2020-01-06':'2020-02-14', ['CCC', 'AAA']]
+    # unknown tickers are left out, the window includes both ends, missing prices are NaN
+    assert list(stock_price.columns) == ['CCC', 'AAA']
+    assert stock_price.index[0] == pd.Timestamp('2020-01-06') and stock_price.index[-1] == pd.Timestamp('2020-02-14')
+    assert stock_price['CCC'].iloc[:2].isna().all()
+    np.testing.assert_array_equal(stock_price.to_numpy(), expected.to_numpy())
+
+def test_load_and_rebuild_when_the_csv_changes(tmp_path):
+    csv_path, store_dir = str(tmp_path / 'prices.csv'), str(tmp_path / 'store')
+    _write_csv(csv_path)
+    build_price_store(csv_path, store_dir)
+
+    store = load_price_store(store_dir, mmap=False)
+    assert store.tickers == ['AAA', 'BBB', 'CCC']
+    assert store.prices.shape == (len(store.dates), 3)
+    assert not any(name.endswith('.tmp') for name in os.listdir(store_dir))
+
+    _write_csv(csv_path, tickers=('AAA', 'DDD'))
+    prices_file = os.path.join(store_dir, 'prices.npy')
+    os.utime(csv_path, (os.path.getmtime(prices_file) + 10,) * 2)
+    get_price_store.cache_clear()
+    assert get_price_store(csv_path, store_dir).tickers == ['AAA', 'DDD']
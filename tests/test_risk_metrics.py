@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from utils.evaluation import get_sharpe_ratio, get_info_ratio
+from utils.risk_metrics import evaluate_returns, stack_returns
+
+
+def _quarter(seed, n_days, n_groups):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2020-01-01', periods=n_days)
+    group_price = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.01, (n_days, n_groups)), axis=0)),
+                               index=dates, columns=[f'group_{i}' for i in range(n_groups)])
+    # the market misses a day of the groups and has one more, the returns are aligned on the union
+    market_dates = dates[:3].append(dates[4:]).append(pd.bdate_range(dates[-1], periods=2)[1:])
+    market_return = pd.Series(rng.normal(0, 0.01, len(market_dates)), index=market_dates)
+    return group_price, market_return
+
+def test_metrics_match_the_pandas_loops():
+    quarters = [_quarter(0, 60, 3), _quarter(1, 45, 5)]
+    risk_free_rates = [0.001, 0.002]
+    alpha = 0.05
+
+    group_metrics, quarter_metrics = evaluate_returns([group_price.pct_change() for group_price, _ in quarters],
+                                                      [market_return for _, market_return in quarters],
+                                                      risk_free_rates, quarters=['q0', 'q1'], alpha=alpha)
+
+    for q, ((group_price, market_return), risk_free_rate) in enumerate(zip(quarters, risk_free_rates)):
+        metrics = group_metrics[group_metrics['quarter'] == f'q{q}'].set_index('group').loc[group_price.columns]
+        np.testing.assert_allclose(metrics['sharpe_ratio'], get_sharpe_ratio(group_price, risk_free_rate))
+        np.testing.assert_allclose(metrics['info_ratio'], get_info_ratio(group_price, market_return))
+
+        returns = group_price.pct_change()
+        var = returns.quantile(alpha)
+        cvar = [returns[group][returns[group] <= var[group]].mean() for group in returns.columns]
+        np.testing.assert_allclose(metrics['var'], var)
+        np.testing.assert_allclose(metrics['cvar'], cvar)
+
+        market = quarter_metrics.set_index('quarter').loc[f'q{q}']
+        np.testing.assert_allclose(market['market_sharpe_ratio'],
+                                   (market_return.mean() - risk_free_rate) / market_return.std())
+        np.testing.assert_allclose(market['market_var'], market_return.quantile(alpha))
+        assert market['n_groups'] == group_price.shape[1]
+
+def test_stack_returns_pads_quarters():
+    (price0, market0), (price1, market1) = _quarter(0, 20, 2), _quarter(1, 10, 4)
+
+    returns, market_returns, group_names = stack_returns([price0.pct_change(), price1.pct_change()], [market0, market1])
+
+    assert returns.shape == (2, 21, 4)
+    assert np.isnan(returns[0, :, 2:]).all()
+    assert np.isnan(returns[1, 11:]).all()
+    assert group_names == [list(price0.columns), list(price1.columns)]
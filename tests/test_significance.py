@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+import utils.significance as significance
+
+
+def _quarter_df():
+    tickers = [f'T{i}' for i in range(8)]
+    return pd.DataFrame({'tic': tickers,
+                         'doc_quarter': pd.Period('2020Q1', freq='Q'),
+                         'topic_allocation': [0, 0, 1, 1, 2, 2, 3, 3],
+                         'gsector': ['10', '10', '10', '20', '20', '20', '45', '45']})
+
+def _fake_prices(monkeypatch, tickers):
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2020-04-01', '2020-06-30')
+    prices = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.01, (len(dates), len(tickers))), axis=0)),
+                          index=dates, columns=tickers)
+    market = pd.Series(rng.normal(0, 0.01, len(dates)), index=dates)
+    monkeypatch.setattr(significance, 'get_stock_price_from_csv', lambda tic_lst, start, end: prices[tic_lst])
+    monkeypatch.setattr(significance, 'get_mktrf_rf', lambda start, end: (market, 0.001))
+
+def test_significance_with_gics_benchmark(monkeypatch):
+    df = _quarter_df()
+    _fake_prices(monkeypatch, df['tic'].tolist())
+
+    result, null_stats = significance.significance_test_quarter(df, n_draws=20, benchmark_col='gsector')
+
+    assert set(result['grouping']) == {'topic_allocation', 'gsector'}
+    assert set(null_stats) == {'topic_allocation', 'gsector'}
+    assert (result['n_draws'] <= 20).all()
+
+def test_significance_with_custom_group_col(monkeypatch):
+    df = _quarter_df().assign(custom=[1, 1, 1, 1, 2, 2, 2, 2])
+    _fake_prices(monkeypatch, df['tic'].tolist())
+
+    result, _ = significance.significance_test_quarter(df, n_draws=10, group_col='custom', benchmark_col=None)
+
+    assert set(result['grouping']) == {'custom'}
+
+def test_observed_uses_every_call_membership(monkeypatch):
+    # T0 has a second call allocated to another topic, it is a member of both groups
+    df = pd.concat([_quarter_df(), _quarter_df().iloc[[0]].assign(topic_allocation=1)], ignore_index=True)
+    _fake_prices(monkeypatch, df['tic'].unique().tolist())
+
+    result, _ = significance.significance_test_quarter(df, n_draws=10, benchmark_col=None)
+
+    stock_price = significance.get_stock_price_from_csv(df['tic'].unique().tolist(), None, None)
+    market_return, risk_free_rate = significance.get_mktrf_rf(None, None)
+    membership, _ = significance.get_topic_membership(df, stock_price.columns)
+    group_prices = significance.get_group_price_from_membership(membership, stock_price).to_numpy()
+    dates = stock_price.index.union(market_return.index)
+    expected = significance._observed_statistics(group_prices, stock_price.index, dates,
+                                                 market_return.reindex(dates).to_numpy(), risk_free_rate,
+                                                 0.05, 0.03)
+    for stat, observed in zip(result['statistic'], result['observed']):
+        np.testing.assert_allclose(observed, expected[stat])
+
+def test_null_draws_differ_across_quarters(monkeypatch):
+    df = _quarter_df()
+    _fake_prices(monkeypatch, df['tic'].tolist())
+
+    _, null_q1 = significance.significance_test_quarter(df, n_draws=20, benchmark_col=None)
+    _, null_q2 = significance.significance_test_quarter(df.assign(doc_quarter=pd.Period('2020Q2', freq='Q')),
+                                                        n_draws=20, benchmark_col=None)
+
+    assert not np.array_equal(null_q1['topic_allocation']['mean_sharpe_ratio'],
+                              null_q2['topic_allocation']['mean_sharpe_ratio'])
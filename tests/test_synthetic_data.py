@@ -0,0 +1,38 @@
+import pandas as pd
+
+from benchmarks.synthetic_data import make_corpus, make_vocab, write_corpus
+
+
+def test_corpus_is_deterministic_with_the_data_schema():
+    corpus = make_corpus(n_companies=6, n_quarters=3, n_words=200, doc_len=40, seed=7)
+    again = make_corpus(n_companies=6, n_quarters=3, n_words=200, doc_len=40, seed=7)
+
+    pd.testing.assert_frame_equal(corpus['transcripts'], again['transcripts'])
+    pd.testing.assert_frame_equal(corpus['prices'], again['prices'])
+    assert corpus['tokens'] == again['tokens']
+    assert not corpus['transcripts'].equals(make_corpus(n_companies=6, n_quarters=3, n_words=200,
+                                                        doc_len=40, seed=8)['transcripts'])
+
+    assert list(corpus['comp_info'].columns) == ['conm', 'gvkey', 'tic', 'gsector', 'ggroup', 'gind']
+    assert set(corpus['transcripts'].columns) == {'gvkey', 'doc_date', 'transcriptComponentTypeId', 'componentText'}
+    token_df = corpus['token_df']
+    assert len(token_df) == 6 * 3
+    assert token_df.groupby('doc_quarter').size().tolist() == [6, 6, 6]
+    assert all(len(tokens) == 40 for tokens in token_df['qna tokens'])
+    # the prices cover the evaluation window of the last quarter
+    assert pd.Timestamp(corpus['prices']['DlyCalDt'].max()) >= (corpus['quarter_lst'][-1] + 1).start_time
+
+def test_vocab_is_unique():
+    vocab = make_vocab(500)
+    assert len(set(vocab)) == 500
+    assert vocab == make_vocab(500)
+
+def test_write_corpus(tmp_path):
+    corpus = make_corpus(n_companies=4, n_quarters=2, n_words=100, doc_len=20)
+
+    paths = write_corpus(corpus, str(tmp_path))
+
+    prices = pd.read_csv(paths['prices'], index_col=0)
+    assert list(prices.columns) == ['DlyCalDt', 'Ticker', 'DlyClose']
+    assert len(pd.read_parquet(paths['transcripts'])) == len(corpus['transcripts'])
+    assert len(pd.read_csv(paths['comp_info'])) == 4
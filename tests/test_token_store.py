@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from utils.token_store import (build_token_store, load_token_store, get_doc_ids, iter_docs, get_num_docs,
+                               get_doc_lengths)
+
+DOCS = [['revenue', 'growth', 'revenue'], [], ['margin'], ['growth', 'margin', 'guidance', 'revenue']]
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip_ragged_docs(tmp_path, mmap):
+    build_token_store(iter(DOCS), str(tmp_path))
+
+    store = load_token_store(str(tmp_path), mmap=mmap)
+
+    assert get_num_docs(store) == len(DOCS)
+    assert store.offsets.tolist() == [0, 3, 3, 4, 8]
+    assert get_doc_lengths(store).tolist() == [len(doc) for doc in DOCS]
+    assert list(iter_docs(store)) == DOCS
+    assert list(iter_docs(store, [3, 1])) == [DOCS[3], DOCS[1]]
+    # ids follow the order of first appearance
+    assert get_doc_ids(store, 0).tolist() == [0, 1, 0]
+    assert store.ids.dtype == np.uint32
+
+def test_extend_vocabulary(tmp_path):
+    base = build_token_store(DOCS, str(tmp_path / 'base'))
+
+    store = build_token_store([['guidance', 'capex']], str(tmp_path / 'new'), vocab=list(base.vocab))
+
+    assert list(store.vocab[:len(base.vocab)]) == list(base.vocab)
+    assert get_doc_ids(store, 0).tolist() == [list(base.vocab).index('guidance'), len(base.vocab)]
+
+def test_empty_corpus(tmp_path):
+    store = build_token_store([[], []], str(tmp_path))
+
+    assert get_num_docs(store) == 2
+    assert list(iter_docs(store)) == [[], []]
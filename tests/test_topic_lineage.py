@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from utils.topic_lineage import build_topic_lineage, add_topic_lineage
+
+
+class _FakeHDP:
+    # the parts of tomotopy.HDPModel read by the lineage, topics given as word -> weight
+    def __init__(self, topics, dead=()):
+        self.used_vocabs = sorted({word for topic in topics for word in topic})
+        self.k = len(topics) + len(dead)
+        self._live = [k for k in range(self.k) if k not in dead]
+        self._topics = dict(zip(self._live, topics))
+
+    def is_live_topic(self, k):
+        return k in self._topics
+
+    def get_topic_word_dist(self, k):
+        dist = np.array([self._topics[k].get(word, 0.0) for word in self.used_vocabs])
+        return dist / dist.sum()
+
+RATES = {'rate': 5, 'inflation': 3, 'fed': 2}
+CHIPS = {'chip': 5, 'supply': 3, 'wafer': 2}
+CLOUD = {'cloud': 5, 'software': 3, 'subscription': 2}
+
+def test_lineages_follow_reordered_topics():
+    quarter_lst = list(pd.period_range('2020Q1', periods=3, freq='Q'))
+    # topic 1 of the first quarter is dead, the second quarter reorders the topics and adds one,
+    # the third keeps only the rates topic
+    hdp_model_lst = [_FakeHDP([RATES, CHIPS], dead=(1,)),
+                     _FakeHDP([CLOUD, dict(CHIPS, wafer=3), dict(RATES, fed=1)]),
+                     _FakeHDP([RATES])]
+
+    lineage_df, events_df = build_topic_lineage(hdp_model_lst, quarter_lst)
+
+    lookup = {(q, t): l for q, t, l in zip(lineage_df['quarter'], lineage_df['topic_id'], lineage_df['lineage_id'])}
+    q1, q2, q3 = quarter_lst
+    assert lookup[(q1, 0)] == lookup[(q2, 2)] == lookup[(q3, 0)]
+    assert lookup[(q1, 2)] == lookup[(q2, 1)]
+    assert lookup[(q2, 0)] not in {lookup[(q1, 0)], lookup[(q1, 2)]}
+    events = {(q, e, t) for q, e, t in zip(events_df['quarter'], events_df['event'], events_df['topic_id'])}
+    assert (q2, 'birth', 0) in events
+    assert (q3, 'death', 1) in events and (q3, 'death', 0) in events
+    assert (q3, 'continuation', 0) in events
+
+def test_add_topic_lineage_uses_the_live_index():
+    quarter_lst = list(pd.period_range('2020Q1', periods=2, freq='Q'))
+    lineage_df, _ = build_topic_lineage([_FakeHDP([RATES, CHIPS]), _FakeHDP([CHIPS, RATES])], quarter_lst)
+    earnings_call_qt_list = [pd.DataFrame({'doc_quarter': [q] * 2, 'topic_allocation': [0, 1]}) for q in quarter_lst]
+
+    earnings_call_qt_list = add_topic_lineage(earnings_call_qt_list, lineage_df)
+
+    assert earnings_call_qt_list[0]['topic_lineage'].tolist() == earnings_call_qt_list[1]['topic_lineage'].tolist()[::-1]
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('tomotopy')
+
+from utils.trend_word_change import get_trend_tables, get_word_quarter_matrix
+
+
+def _top_words(quarter_lst, seed=0):
+    # per quarter, topics with their top words drawn from a small vocabulary, repeats across topics
+    rng = np.random.default_rng(seed)
+    vocab = [f'word{i}' for i in range(30)]
+    return [{k: [(word, rng.random()) for word in rng.choice(vocab, size=5, replace=False)]
+             for k in range(rng.integers(2, 6))} for _ in quarter_lst]
+
+def _old_word_count_df(top_words, quarter_lst):
+    # the list-counting construction the sparse matrix replaced
+    total_top_wrds_by_qt = [[wrd for word_scr_lst in topics.values() for wrd, _ in word_scr_lst]
+                            for topics in top_words]
+    total_top_words = list({wrd for topics in top_words for value in topics.values() for wrd, _ in value})
+    word_count_df = pd.DataFrame({quarter: [qt_wrds.count(word) for word in total_top_words]
+                                  for quarter, qt_wrds in zip(quarter_lst, total_top_wrds_by_qt)},
+                                 index=total_top_words)
+    return word_count_df
+
+def test_trend_tables_match_the_list_counting():
+    quarter_lst = list(pd.period_range('2014Q1', periods=16, freq='Q'))
+    top_words = _top_words(quarter_lst)
+    min_quarters, min_years = 6, 2
+
+    quarterly, yearly = get_trend_tables(None, quarter_lst, min_quarters=min_quarters, min_years=min_years,
+                                         top_words=top_words)
+
+    word_count_df = _old_word_count_df(top_words, quarter_lst)
+    expected_quarterly = word_count_df.loc[(word_count_df != 0).sum(axis=1) > min_quarters]
+    yrly_word_count_df = word_count_df.copy()
+    yrly_word_count_df.columns = pd.PeriodIndex(word_count_df.columns).to_timestamp().to_period('Y')
+    yrly_word_count_df = yrly_word_count_df.transpose().groupby(level=0).sum().transpose()
+    expected_yearly = yrly_word_count_df.loc[(yrly_word_count_df != 0).sum(axis=1) > min_years]
+
+    assert len(expected_quarterly) > 0
+    pd.testing.assert_frame_equal(quarterly.sort_index(), expected_quarterly.sort_index(),
+                                  check_dtype=False, check_column_type=False)
+    pd.testing.assert_frame_equal(yearly.sort_index(), expected_yearly.sort_index(),
+                                  check_dtype=False, check_column_type=False)
+
+def test_weighted_matrix_sums_the_probabilities():
+    top_words = [{0: [('a', 0.5), ('b', 0.25)], 1: [('a', 0.125)]}, {0: [('b', 1.0)]}]
+
+    word_count, vocab = get_word_quarter_matrix(top_words, weighted=True)
+
+    assert vocab == ['a', 'b']
+    np.testing.assert_allclose(word_count.toarray(), [[0.625, 0.0], [0.25, 1.0]])
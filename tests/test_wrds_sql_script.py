@@ -0,0 +1,79 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from utils.wrds_sql_script import build_transcript_query, extract_transcripts, write_parquet_partition
+
+
+@pytest.fixture
+def con():
+    # local stand-in of the WRDS schemas
+    con = sqlite3.connect(':memory:')
+    for schema in ('crsp', 'ciq', 'ciq_common'):
+        con.execute(f"ATTACH DATABASE ':memory:' AS {schema}")
+    con.executescript('''
+        CREATE TABLE crsp.dsp500list (permno INTEGER, start TEXT, ending TEXT);
+        CREATE TABLE crsp.ccmxpf_lnkhist (gvkey TEXT, lpermno INTEGER, linkdt TEXT, linkenddt TEXT,
+                                          linktype TEXT, linkprim TEXT);
+        CREATE TABLE ciq.wrds_transcript_detail (companyid INTEGER, transcriptid INTEGER, keydeveventtypeid INTEGER,
+                                                 transcriptpresentationtypeid INTEGER, mostimportantdateutc TEXT);
+        CREATE TABLE ciq.wrds_transcript_person (transcriptid INTEGER, transcriptcomponentid INTEGER,
+                                                 transcriptcomponenttypeid INTEGER);
+        CREATE TABLE ciq.ciqtranscriptcomponent (transcriptid INTEGER, transcriptcomponenttypeid INTEGER,
+                                                 componenttext TEXT);
+        CREATE TABLE ciq_common.wrds_gvkey (companyid INTEGER, gvkey TEXT);
+
+        INSERT INTO crsp.dsp500list VALUES (1, '2000-01-01', '2030-12-31'), (2, '2000-01-01', '2030-12-31');
+        INSERT INTO crsp.ccmxpf_lnkhist VALUES ('001000', 1, '2000-01-01', NULL, 'LU', 'P'),
+                                               ('002000', 2, '2000-01-01', '2030-12-31', 'LC', 'C');
+        INSERT INTO ciq_common.wrds_gvkey VALUES (10, '001000'), (20, '002000');
+
+        -- company 10: a call on the last day of 2020Q1, its duplicate transcript and a call in 2020Q2
+        -- company 20: a call on the first day of 2020Q1
+        INSERT INTO ciq.wrds_transcript_detail VALUES (10, 102, 48, 5, '2020-03-31'),
+                                                      (10, 101, 48, 5, '2020-03-31'),
+                                                      (10, 103, 48, 5, '2020-04-01'),
+                                                      (20, 201, 48, 5, '2020-01-01'),
+                                                      (20, 202, 48, 4, '2020-01-02');
+        -- inserted out of order, the merge must follow the transcript/component ids
+        INSERT INTO ciq.wrds_transcript_person VALUES (101, 2, 4), (101, 1, 3), (102, 2, 4), (102, 1, 3),
+                                                      (103, 1, 3), (201, 1, 3), (201, 2, 2), (202, 1, 3);
+        INSERT INTO ciq.ciqtranscriptcomponent VALUES (101, 4, 'answer'), (101, 3, 'question'),
+                                                      (102, 4, 'answer'), (102, 3, 'question'),
+                                                      (103, 3, 'next quarter'), (201, 3, 'first day'),
+                                                      (201, 2, 'presentation'), (202, 3, 'not a call');
+    ''')
+    yield con
+    con.close()
+
+def test_query_deduplicates_and_merges_in_order(con):
+    df = pd.read_sql_query(build_transcript_query(2020, 1, dialect='sqlite'), con)
+
+    assert list(df.columns) == ['gvkey', 'mostimportantdateutc', 'componenttext']
+    assert df.values.tolist() == [['001000', '2020-03-31', 'question answer'],
+                                  ['002000', '2020-01-01', 'first day']]
+
+def test_query_quarter_bounds(con):
+    df = pd.read_sql_query(build_transcript_query(2020, 2, dialect='sqlite'), con)
+
+    assert df.values.tolist() == [['001000', '2020-04-01', 'next quarter']]
+
+def test_extract_transcripts_writes_partitions(con, tmp_path):
+    n_rows = extract_transcripts(con, [2020], str(tmp_path), dialect='sqlite', chunksize=1)
+
+    assert n_rows == {(2020, 1): 2, (2020, 2): 1, (2020, 3): 0, (2020, 4): 0}
+    df = pd.read_parquet(tmp_path / 'year=2020' / 'quarter=1' / 'part-0.parquet')
+    assert df['componenttext'].tolist() == ['question answer', 'first day']
+    assert not (tmp_path / 'year=2020' / 'quarter=3' / 'part-0.parquet').exists()
+
+def test_empty_quarter_removes_stale_partition(tmp_path):
+    path = tmp_path / 'year=2020' / 'quarter=1' / 'part-0.parquet'
+    path.parent.mkdir(parents=True)
+    pd.DataFrame({'gvkey': ['001000'], 'mostimportantdateutc': [pd.Timestamp('2020-01-01')],
+                  'componenttext': ['stale']}).to_parquet(path)
+
+    n_rows = write_parquet_partition(iter([]), str(tmp_path), 2020, 1)
+
+    assert n_rows == 0
+    assert not path.exists()
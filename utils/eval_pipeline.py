@@ -0,0 +1,154 @@
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from utils.evaluation import (get_start_end_date, get_stock_price_from_csv, get_topic_membership,
+                              get_group_price_from_membership, get_mktrf_rf)
+from utils.model_paths import get_model_path
+from utils.price_store import PRICE_CSV, PRICE_STORE_DIR, get_price_store
+from utils.reference_data import REFERENCE_PATH
+from utils.risk_metrics import stack_returns, compute_risk_metrics
+
+EVAL_CACHE_DIR = 'data/eval_cache'
+# columns of the earnings call dataframe needed for the evaluation
+EVAL_COLUMNS = ['tic', 'topic_allocation', 'doc_quarter']
+
+
+def fingerprint_file(path):
+    '''Content hash of a file, None if it does not exist
+    '''
+    if path is None or not os.path.exists(path):
+        return None
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def fingerprint_allocation(earnings_call_df):
+    '''Content hash of the topic allocation of the tickers of a quarter
+    '''
+    hashed = pd.util.hash_pandas_object(earnings_call_df[['tic', 'topic_allocation']], index=False)
+    return hashlib.sha1(hashed.to_numpy().tobytes()).hexdigest()
+
+def fingerprint_price_data(csv_path=PRICE_CSV, reference_path=REFERENCE_PATH):
+    '''Content hash of the price csv and the reference data cache. Without the reference cache
+    the market data comes from yahoo finance and is assumed unchanged for a past window.
+    '''
+    return '|'.join([str(fingerprint_file(csv_path)), str(fingerprint_file(reference_path) or 'yfinance')])
+
+def evaluate_quarter(earnings_call_df, model_path=None, cache_dir=EVAL_CACHE_DIR, csv_path=PRICE_CSV,
+                     store_dir=PRICE_STORE_DIR, reference_path=REFERENCE_PATH, data_fingerprint=None,
+                     offline=False, **metric_kwargs):
+    '''Evaluate the topic groups of one quarter on the next quarter's prices.
+    The result is cached on disk, keyed by the fingerprint of the model, the topic allocation
+    and the price files, so an unchanged quarter is read back without loading any prices.
+
+    ** Inputs **
+    earnings_call_df: DataFrame -> QnA transcript of a quarter with 'tic', 'topic_allocation' and 'doc_quarter'
+    model_path: str -> saved HDP model of the quarter, part of the cache key
+    cache_dir: str -> directory of the cached results
+    csv_path: str -> daily price csv
+    store_dir: str -> directory of the price store
+    reference_path: str -> reference data cache of the market and risk free rate
+    data_fingerprint: str -> precomputed fingerprint_price_data(csv_path, reference_path)
+    offline: bool -> raise instead of downloading the market data when the reference cache is missing
+    metric_kwargs: keyword arguments of compute_risk_metrics
+
+    ** Returns **
+    result: DataFrame -> one row per group with its metrics and the market baselines of the quarter
+    '''
+    quarter = str(earnings_call_df['doc_quarter'].iloc[0])
+    start_date, end_date = get_start_end_date(earnings_call_df)
+    if data_fingerprint is None:
+        data_fingerprint = fingerprint_price_data(csv_path, reference_path)
+
+    key = hashlib.sha1('|'.join([str(fingerprint_file(model_path)),
+                                 fingerprint_allocation(earnings_call_df),
+                                 data_fingerprint,
+                                 repr(sorted(metric_kwargs.items()))]).encode('utf-8')).hexdigest()
+    cache_path = os.path.join(cache_dir, f'eval_{quarter}_{key[:16]}.parquet')
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+
+    tic_list = earnings_call_df['tic'].unique().tolist()
+    stock_price = get_stock_price_from_csv(tic_list, start_date, end_date, csv_path, store_dir)
+    market_return, risk_free_rate = get_mktrf_rf(start_date, end_date + pd.DateOffset(days=1), reference_path,
+                                                 offline=offline)
+
+    membership, topics = get_topic_membership(earnings_call_df, stock_price.columns)
+    group_names = [f'group_{i}' for i in range(len(topics))]
+    group_price = get_group_price_from_membership(membership, stock_price, group_names)
+    group_price = group_price.dropna(axis=1)
+    group_returns = group_price.pct_change()
+
+    returns, market_returns, names = stack_returns([group_returns], [market_return])
+    group_metrics, quarter_metrics = compute_risk_metrics(returns, market_returns, [risk_free_rate],
+                                                          quarters=[quarter], group_names=names,
+                                                          **metric_kwargs)
+
+    group_topic = dict(zip(group_names, topics))
+    group_size = dict(zip(group_names, np.asarray(membership.sum(axis=0)).ravel()))
+    group_metrics.insert(2, 'topic', [group_topic[g] for g in group_metrics['group']])
+    group_metrics.insert(3, 'n_members', [int(group_size[g]) for g in group_metrics['group']])
+    result = group_metrics.merge(quarter_metrics, on='quarter', how='left')
+    result['start_date'] = pd.Timestamp(start_date)
+    result['end_date'] = pd.Timestamp(end_date)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    result.to_parquet(cache_path + '.tmp', index=False)
+    os.replace(cache_path + '.tmp', cache_path)
+    return result
+
+def _evaluate_quarter_task(args):
+    earnings_call_df, model_path, kwargs = args
+    return evaluate_quarter(earnings_call_df, model_path, **kwargs)
+
+def run_evaluation_pipeline(earnings_call_qt_list, model_dir='hdp_models', cache_dir=EVAL_CACHE_DIR,
+                            n_jobs=None, skip_last=True, csv_path=PRICE_CSV, store_dir=PRICE_STORE_DIR,
+                            reference_path=REFERENCE_PATH, offline=False, **metric_kwargs):
+    '''Evaluate all quarters independently on a process pool, reusing the cached quarters
+    whose model, topic allocation and prices are unchanged
+
+    ** Inputs **
+    earnings_call_qt_list: list -> list of QnA transcript with inferred topics, one per quarter
+    model_dir: str -> directory of the saved HDP models, part of the cache key
+    cache_dir: str -> directory of the cached results
+    n_jobs: int -> number of worker processes, all cores if None, 1 to run in this process
+    skip_last: bool -> skip the last quarter, whose next-quarter prices are not in the sample
+    csv_path: str -> daily price csv
+    store_dir: str -> directory of the price store
+    reference_path: str -> reference data cache of the market and risk free rate
+    offline: bool -> raise instead of downloading the market data when the reference cache is missing
+    metric_kwargs: keyword arguments of compute_risk_metrics
+
+    ** Returns **
+    results: DataFrame -> one row per (quarter, group) with the metrics and the market baselines
+    '''
+    if skip_last:
+        earnings_call_qt_list = earnings_call_qt_list[:-1]
+    # build the price store once here, instead of every worker pivoting the csv on a cold cache,
+    # and hash the price files once for all quarters
+    get_price_store(csv_path, store_dir)
+    kwargs = dict(cache_dir=cache_dir, csv_path=csv_path, store_dir=store_dir, reference_path=reference_path,
+                  data_fingerprint=fingerprint_price_data(csv_path, reference_path), offline=offline,
+                  **metric_kwargs)
+    tasks = []
+    for earnings_call_df in earnings_call_qt_list:
+        if len(earnings_call_df) == 0:
+            continue
+        quarter = earnings_call_df['doc_quarter'].iloc[0]
+        tasks.append((earnings_call_df[EVAL_COLUMNS], get_model_path(quarter, model_dir), kwargs))
+
+    if n_jobs == 1:
+        results = [_evaluate_quarter_task(task) for task in tqdm(tasks)]
+    else:
+        with ProcessPoolExecutor(n_jobs) as executor:
+            results = list(tqdm(executor.map(_evaluate_quarter_task, tasks), total=len(tasks)))
+
+    if not results:
+        return pd.DataFrame()
+    return pd.concat(results, ignore_index=True)
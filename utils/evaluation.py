@@ -6,6 +6,7 @@ import seaborn as sns
 import pickle
 from tqdm import tqdm
 import datetime
+from scipy import sparse
 
 import logging
 logging.getLogger('yfinance').setLevel(logging.CRITICAL)
@@ -15,6 +16,10 @@ warnings.simplefilter(action="ignore", category=[SettingWithCopyWarning, Depreca
 
 import yfinance as yf
 
+from utils.price_store import PRICE_CSV, PRICE_STORE_DIR, get_price_store, get_prices
+from utils.reference_data import REFERENCE_PATH, has_reference_cache, load_reference_cache, get_reference_prices
+from utils.instrumentation import stage
+
 
 def get_topic_all_tic_list(df):
     '''Wrapper function to get the list of 'tic' with the same topic allocation
@@ -23,23 +28,54 @@ def get_topic_all_tic_list(df):
     ** Returns **
     same_topic_tic_lst: list -> list of 'tic' with the same topic allocation
     '''
-    same_topic_tic_lst = []
-    for i in df['topic_allocation'].unique():
-        same_topic_tic = df[df['topic_allocation'] == i]['tic'].unique().tolist()
-        same_topic_tic_lst.append(same_topic_tic)
+    same_topic_tic = df.groupby('topic_allocation', sort=False)['tic'].unique()
+    same_topic_tic_lst = [tics.tolist() for tics in same_topic_tic]
     return same_topic_tic_lst
 
-# get the stock price for the given 'doc_quarter' for the given 'tic's
-def get_stock_price(tic_lst, start, end):
-    '''Function to get the stock price for the given 'doc_quarter' for the given 'tic's
-    
+def get_membership_matrix(same_topic_tic_lst, tickers):
+    '''Function to get the ticker-by-group membership matrix of the groups
+
     ** Inputs **
-    tic_lst: list -> list of 'tic's
-    quarter: str -> quarter in 'YYYY-Qn' format
-    
+    same_topic_tic_lst: list -> list of 'tic's with the same topic allocation
+    tickers: list -> tickers of the rows, e.g. the columns of the stock price, other 'tic's are ignored
+
     ** Returns **
-    stock_price: DataFrame -> dataframe with stock price for the given 'tic's
+    membership: scipy.sparse.csr_matrix -> (n_tickers, n_groups) with 1 where the ticker is in the group
+    '''
+    ticker_index = {tic: i for i, tic in enumerate(tickers)}
+    rows, cols = [], []
+    for j, groups in enumerate(same_topic_tic_lst):
+        for tic in dict.fromkeys(groups):
+            if tic in ticker_index:
+                rows.append(ticker_index[tic])
+                cols.append(j)
+    membership = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                   shape=(len(ticker_index), len(same_topic_tic_lst)))
+    return membership
+
+def get_topic_membership(df, tickers):
+    '''Function to get the ticker-by-topic membership matrix directly from the topic allocation
+
+    ** Inputs **
+    df: dataframe -> dataframe with 'tic' and 'topic_allocation' columns
+    tickers: list -> tickers of the rows, e.g. the columns of the stock price, other 'tic's are ignored
+
+    ** Returns **
+    membership: scipy.sparse.csr_matrix -> (n_tickers, n_topics) with 1 where the ticker is in the topic
+    topics: np.ndarray -> topic of each column, in the order of get_topic_all_tic_list
     '''
+    topics = df['topic_allocation'].unique()
+    pairs = df[['tic', 'topic_allocation']].drop_duplicates()
+    rows = pd.Index(tickers).get_indexer(pairs['tic'])
+    cols = pd.Index(topics).get_indexer(pairs['topic_allocation'])
+    keep = rows >= 0
+    membership = sparse.csr_matrix((np.ones(keep.sum()), (rows[keep], cols[keep])),
+                                   shape=(len(tickers), len(topics)))
+    return membership, topics
+
+# get the stock price for the given 'doc_quarter' for the given 'tic's
+def _download_stock_price(tic_lst, start, end):
+    # per-ticker yahoo finance download, tickers that fail are left out
     stock_price = pd.DataFrame()
     for tic in tic_lst:
         try:
@@ -50,26 +86,60 @@ def get_stock_price(tic_lst, start, end):
             continue
     return stock_price
 
-## need to use 'stock_price_2014_2023.csv' instead of downloading from yahoo finance
-def get_stock_price_from_csv(tic_lst, start, end):
+def get_stock_price(tic_lst, start, end, cache_path=REFERENCE_PATH, offline=False):
     '''Function to get the stock price for the given 'doc_quarter' for the given 'tic's
+    The prices are read from the reference data cache when it exists (see utils.reference_data),
+    the tickers that are not in the cache are downloaded from yahoo finance unless offline.
+    
+    ** Inputs **
+    tic_lst: list -> list of 'tic's
+    start: datetime -> start date
+    end: datetime -> end date (exclusive)
+    cache_path: str -> reference data cache
+    offline: bool -> raise a KeyError for the tickers missing from the cache instead of downloading them
+    
+    ** Returns **
+    stock_price: DataFrame -> dataframe with stock price for the given 'tic's
+    '''
+    cached_tic, missing_tic = [], list(tic_lst)
+    if has_reference_cache(cache_path):
+        cached_columns = load_reference_cache(cache_path).columns
+        cached_tic = [tic for tic in tic_lst if tic in cached_columns]
+        missing_tic = [tic for tic in tic_lst if tic not in cached_columns]
+
+    if missing_tic and offline:
+        raise KeyError(f'{missing_tic} not in the reference data cache {cache_path}, '
+                       'add them with build_reference_cache or run with offline=False')
+
+    stock_price = pd.DataFrame()
+    if cached_tic:
+        with stage('get_stock_price.cache', n_tickers=len(cached_tic)):
+            stock_price = get_reference_prices(cached_tic, start, end, cache_path)
+    if missing_tic:
+        with stage('get_stock_price.yfinance', n_tickers=len(missing_tic)):
+            downloaded = _download_stock_price(missing_tic, start, end)
+        stock_price = pd.concat([stock_price, downloaded], axis=1) if cached_tic else downloaded
+    return stock_price
+
+def get_stock_price_from_csv(tic_lst, start, end, csv_path=PRICE_CSV, store_dir=PRICE_STORE_DIR):
+    '''Function to get the stock price for the given 'doc_quarter' for the given 'tic's
+    The csv is converted once into a date-by-ticker price store (see utils.price_store),
+    so each call is a slice of the stored array instead of a csv read and pivot.
     
     ** Inputs **
     tic_lst: list -> list of 'tic's
     start: datetime -> start date
     end: datetime -> end date
+    csv_path: str -> daily price csv
+    store_dir: str -> directory of the price store built from csv_path
     
     ** Returns **
     stock_price: DataFrame -> dataframe with stock price for the given 'tic's
     '''
-    stock_price = pd.read_csv('data/stock_price_2014_2023.csv', index_col=0).reset_index()
-    # set 'Dly Cal Dt' as index and 'Ticker' as columns
-    stock_price = stock_price.pivot_table(index='DlyCalDt', columns='Ticker', values='DlyClose', aggfunc='first')
-    # set index to datetime
-    stock_price.index = pd.to_datetime(stock_price.index)
-    # ignore tic in tic_list that is not in stock_price
-    tic_lst = [tic for tic in tic_lst if tic in stock_price.columns]
-    stock_price = stock_price[tic_lst].loc[start:end]
+    with stage('get_stock_price_from_csv', n_tickers=len(tic_lst)):
+        store = get_price_store(csv_path, store_dir)
+        # ignore tic in tic_list that is not in stock_price
+        stock_price = get_prices(store, tic_lst, start, end)
     return stock_price
 
 def get_start_end_date(df):
@@ -82,17 +152,18 @@ def get_start_end_date(df):
     start_date: datetime -> start date
     end_date: datetime -> end date
     '''
-    end_date = datetime.datetime.strptime(df['doc_quarter'][0].strftime('%Y-%m-%d'), '%Y-%m-%d')
+    end_date = datetime.datetime.strptime(df['doc_quarter'].iloc[0].strftime('%Y-%m-%d'), '%Y-%m-%d')
     end_date = end_date + pd.DateOffset(months=3)
     start_date = end_date - pd.DateOffset(months=2)
     start_date = start_date.replace(day=1)
     return start_date, end_date
 
 # get the stock price for the given 'doc_quarter' for the given 'tic's
-def get_ticker_list_stock_price(df):
+def get_ticker_list_stock_price(df, start_date=None, end_date=None):
     # get the stock price for the given 'tic's
     tic_list = df['tic'].unique().tolist()
-    start_date, end_date = get_start_end_date(df)
+    if start_date is None or end_date is None:
+        start_date, end_date = get_start_end_date(df)
     stock_price = get_stock_price_from_csv(tic_list, start_date, end_date)
     return stock_price
 
@@ -107,32 +178,65 @@ def get_group_price(same_topic_tic_lst, stock_price):
     ** Returns **
     group_price: DataFrame -> dataframe with equally weighted sum of stock price within the groups
     '''
-    tic_list = stock_price.columns
-    group_price = pd.DataFrame()
-    for i, groups in enumerate(same_topic_tic_lst):
-        # get equally weighted sum of stock price within the groups
-        for tic in groups:
-            if tic not in tic_list:
-                groups.remove(tic)
-        group_mean = stock_price[groups].mean(axis=1).rename(f'group_{i}')
-        group_price = pd.concat([group_price, group_mean], axis=1)
+    # 'tic's without stock price are left out of the membership
+    membership = get_membership_matrix(same_topic_tic_lst, stock_price.columns)
+    group_price = get_group_price_from_membership(membership, stock_price)
+    return group_price
+
+def get_group_price_from_membership(membership, stock_price, group_names=None):
+    '''Function to get the equally weighted mean price of all groups with one matrix product.
+    Missing prices are skipped and the weights of each day renormalized over the available members.
+
+    ** Inputs **
+    membership: scipy.sparse matrix -> (n_tickers, n_groups) membership over the columns of stock_price
+    stock_price: DataFrame -> dataframe with stock price for the given 'tic's
+    group_names: list -> column names of the groups, 'group_{i}' if None
+
+    ** Returns **
+    group_price: DataFrame -> dataframe with equally weighted sum of stock price within the groups
+    '''
+    prices = stock_price.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(prices)
+    # (n_groups, n_tickers) @ (n_tickers, n_days), transposed back to days x groups
+    price_sum = (membership.T @ np.where(valid, prices, 0.0).T).T
+    member_count = (membership.T @ valid.T.astype(np.float64)).T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        group_mean = price_sum / member_count
+
+    if group_names is None:
+        group_names = [f'group_{i}' for i in range(membership.shape[1])]
+    group_price = pd.DataFrame(group_mean, index=stock_price.index, columns=group_names)
     return group_price
 
 # get market return and quarterly risk free rate with yahoo finance
-def get_mktrf_rf(start, end):
+def get_mktrf_rf(start, end, cache_path=REFERENCE_PATH, offline=False):
     '''Function to get the market return and quarterly risk free rate with yahoo finance
+    The series are read from the reference data cache when it exists (see utils.reference_data),
+    so repeated evaluations do not touch the network.
     
     ** Inputs **
     start: datetime -> start date
-    end: datetime -> end date
+    end: datetime -> end date (exclusive)
+    cache_path: str -> reference data cache
+    offline: bool -> raise a FileNotFoundError without the cache instead of downloading the series
     
     ** Returns **
     market_return: DataFrame -> dataframe with market return
     risk_free_rate: float -> quarterly risk free rate
     '''
-    market_return = yf.download('^GSPC', start=start, end=end, progress=False)['Close']
+    if has_reference_cache(cache_path):
+        with stage('get_mktrf_rf.cache'):
+            prices = get_reference_prices(['^GSPC', '^IRX'], start, end, cache_path)
+            market_return = prices['^GSPC'].dropna().rename('Close')
+            risk_free_rate = prices['^IRX'].dropna()
+    elif offline:
+        raise FileNotFoundError(f'Reference data cache {cache_path} not found, '
+                                'build it with build_reference_cache or run with offline=False')
+    else:
+        with stage('get_mktrf_rf.yfinance'):
+            market_return = yf.download('^GSPC', start=start, end=end, progress=False)['Close']
+            risk_free_rate = yf.download('^IRX', start=start, end=end, progress=False)['Close']
     market_return = market_return.pct_change().dropna()
-    risk_free_rate = yf.download('^IRX', start=start, end=end, progress=False)['Close']
     risk_free_rate = risk_free_rate.mean() / 100
     return market_return, risk_free_rate
 
@@ -171,7 +275,18 @@ def get_info_ratio(group_price, market_return):
     return info_ratio_per_group
 
 def add_eval_res_to_list(earnings_call_qt_list):
-    '''
+    '''Function to evaluate the topic groups of each quarter on the next quarter's prices, serially
+    (see utils.eval_pipeline.run_evaluation_pipeline for the parallel, cached version)
+
+    ** Inputs **
+    earnings_call_qt_list: list -> list of QnA transcript with inferred topics, one per quarter
+
+    ** Returns **
+    returns_lst: list -> per-quarter daily group returns
+    mkt_returns_lst: list -> per-quarter daily market returns
+    sharpe_ratio_lst: list -> per-quarter sharpe ratio of each group
+    info_ratio_lst: list -> per-quarter information ratio of each group
+    market_sharpe_ratio_lst: list -> per-quarter market sharpe ratio
     '''
     returns_lst= []
     mkt_returns_lst = []
@@ -179,17 +294,20 @@ def add_eval_res_to_list(earnings_call_qt_list):
     info_ratio_lst = []
     market_sharpe_ratio_lst = []
     for earnings_call_df in tqdm(earnings_call_qt_list[:-1]):
-        same_topic_tic_lst = get_topic_all_tic_list(earnings_call_df)
-        stock_price = get_ticker_list_stock_price(earnings_call_df)
-        group_price = get_group_price(same_topic_tic_lst, stock_price)
-        group_price = group_price.dropna(axis=1)
-        returns_lst.append(group_price.pct_change())
-        
+        quarter = earnings_call_df['doc_quarter'].iloc[0]
         start_date, end_date = get_start_end_date(earnings_call_df)
+        with stage('add_eval_res_to_list.group_price', quarter=quarter):
+            same_topic_tic_lst = get_topic_all_tic_list(earnings_call_df)
+            stock_price = get_ticker_list_stock_price(earnings_call_df, start_date, end_date)
+            group_price = get_group_price(same_topic_tic_lst, stock_price)
+            group_price = group_price.dropna(axis=1)
+            returns_lst.append(group_price.pct_change())
+        
         market_return, risk_free_rate = get_mktrf_rf(start_date, end_date + pd.DateOffset(days=1))
         mkt_returns_lst.append(market_return)
-        sharpe_ratio_per_group = get_sharpe_ratio(group_price, risk_free_rate)
-        info_ratio_per_group = get_info_ratio(group_price, market_return)
+        with stage('add_eval_res_to_list.ratios', quarter=quarter, n_groups=group_price.shape[1]):
+            sharpe_ratio_per_group = get_sharpe_ratio(group_price, risk_free_rate)
+            info_ratio_per_group = get_info_ratio(group_price, market_return)
 
         market_sharpe_ratio = (market_return.mean() - risk_free_rate) / market_return.std()
         sharpe_ratio_lst.append(sharpe_ratio_per_group)
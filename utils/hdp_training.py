@@ -1,3 +1,7 @@
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
 from pandas.errors import SettingWithCopyWarning
@@ -9,42 +13,455 @@ warnings.simplefilter(action="ignore", category=[SettingWithCopyWarning, Depreca
 
 import tomotopy as tp
 
+from utils.token_store import iter_docs, get_quarter_positions, load_token_store
+from utils.instrumentation import stage
+from utils.model_paths import get_model_path, get_index_path, get_checkpoint_path, get_trace_path
 
-def train_hdp_model(quarter_lst, df):
+# number of top words per topic stored in the sidecar index of a saved model
+INDEX_TOP_N = 30
+
+
+def get_quarter_docs(df, quarter, token_store=None):
+    """
+    Get the tokens of the documents of a quarter
+    Args:
+        df (pd.DataFrame): QnA transcript of earnings call
+        quarter (pd.Period): quarter of interest
+        token_store (TokenStore): if given, read the tokens from the store built from df
+            instead of the 'qna tokens' column
+    Returns:
+        docs (iterable): list of tokens for each document of the quarter
+    """
+    if token_store is not None:
+        return iter_docs(token_store, get_quarter_positions(df, quarter))
+    return df.loc[df['doc_quarter']==quarter, 'qna tokens']
+
+def make_hdp_model(initial_k=10):
+    """
+    Create an untrained HDP model with the hyperparameters used for every quarter
+    Args:
+        initial_k (int): initial number of topics
+    Returns:
+        hdp (tomotopy.HDPModel): untrained HDP model
+    """
+    term_weight = tp.TermWeight.PMI
+    hdp = tp.HDPModel(tw=term_weight,
+                      min_cf=5,
+                      rm_top=7,
+                      gamma=1,
+                      alpha=0.1,
+                      initial_k=initial_k,
+                      seed=1234)
+    return hdp
+
+def train_until_converged(hdp, max_iter=1000, step=100, rel_tol=None, patience=3,
+                          workers=1, parallel=tp.ParallelScheme.DEFAULT,
+                          checkpoint_path=None, trace_path=None, quarter=None):
+    """
+    Train an HDP model in chunks of `step` iterations until convergence or max_iter.
+    The model is converged once the relative change of ll_per_word stays below rel_tol
+    and live_k stays unchanged for `patience` consecutive chunks.
+    Training continues from hdp.global_step, so a model loaded from a checkpoint resumes.
+    Args:
+        hdp (tomotopy.HDPModel): HDP model with the documents added
+        max_iter (int): maximum total number of iterations
+        step (int): iterations per chunk
+        rel_tol (float): relative log-likelihood tolerance, if None always run max_iter
+        patience (int): number of stable chunks needed to stop
+        workers (int): tomotopy workers
+        parallel (tomotopy.ParallelScheme): tomotopy's parallelization scheme
+        checkpoint_path (str): if given, save the model here after every chunk
+        trace_path (str): if given, write one json record per chunk to this file; a fresh model
+            (global_step 0) starts a new trace, a model resumed from a checkpoint appends to it
+            and picks up its convergence state from the last record
+        quarter (pd.Period): quarter of the model, recorded in the trace
+    Returns:
+        trace (list): per-chunk records with iteration, ll_per_word, live_k, rel_change,
+            stable, wall_time and converged
+    """
+    trace = []
+    prev_ll, prev_k = None, None
+    stable = 0
+    if trace_path is not None and hdp.global_step == 0:
+        # truncate the trace of a previous training of the quarter
+        open(trace_path, 'w').close()
+    elif trace_path is not None:
+        last = _resume_trace(trace_path, hdp.global_step)
+        if last is not None:
+            prev_ll, prev_k, stable = last['ll_per_word'], last['live_k'], last.get('stable', 0)
+            if last['converged']:
+                # converged before the interruption, the checkpoint is the final model
+                return trace
+    while hdp.global_step < max_iter:
+        start = time.perf_counter()
+        hdp.train(min(step, max_iter - hdp.global_step), workers=workers, parallel=parallel)
+        wall_time = time.perf_counter() - start
+
+        ll_per_word, live_k = hdp.ll_per_word, hdp.live_k
+        rel_change = None
+        if prev_ll is not None:
+            rel_change = abs(ll_per_word - prev_ll) / abs(prev_ll)
+            if rel_tol is not None and rel_change < rel_tol and live_k == prev_k:
+                stable += 1
+            else:
+                stable = 0
+        prev_ll, prev_k = ll_per_word, live_k
+        converged = rel_tol is not None and stable >= patience
+
+        record = {'quarter': str(quarter),
+                  'iteration': hdp.global_step,
+                  'll_per_word': ll_per_word,
+                  'live_k': live_k,
+                  'rel_change': rel_change,
+                  'stable': stable,
+                  'wall_time': wall_time,
+                  'converged': converged}
+        trace.append(record)
+        print(f'Iter: {hdp.global_step}\tLoglikelihood: {ll_per_word}\tNum. of topics: {live_k}')
+
+        if trace_path is not None:
+            with open(trace_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        if checkpoint_path is not None:
+            hdp.save(checkpoint_path + '.tmp')
+            os.replace(checkpoint_path + '.tmp', checkpoint_path)
+        if converged:
+            break
+    return trace
+
+def _resume_trace(trace_path, global_step):
+    # keep the records up to the checkpoint's iteration (the trace is written before the
+    # checkpoint, so it can be one chunk ahead) and return the last one, None if there is none
+    if not os.path.exists(trace_path):
+        return None
+    with open(trace_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records = [record for record in records if record['iteration'] <= global_step]
+    with open(trace_path, 'w') as f:
+        f.writelines(json.dumps(record) + '\n' for record in records)
+    return records[-1] if records else None
+
+def load_training_traces(trace_dir):
+    """
+    Load the training traces written by train_until_converged
+    Args:
+        trace_dir (str): directory of the trace files
+    Returns:
+        trace_df (pd.DataFrame): one row per training chunk
+    """
+    records = []
+    for name in sorted(os.listdir(trace_dir)):
+        if name.startswith('hdp_trace_') and name.endswith('.jsonl'):
+            with open(os.path.join(trace_dir, name)) as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    return pd.DataFrame.from_records(records)
+
+def train_hdp_model(quarter_lst, df, token_store=None, rel_tol=None, patience=3, trace_dir=None,
+                    checkpoint_dir=None):
     """
     Train Hierarchical Dirichlet Process (HDP) model
     Args:
         quarter_lst (list): list of quarters
         df (pd.DataFrame): QnA transcript of earnings call
+        token_store (TokenStore): optional integer-encoded tokens of df (see utils.token_store)
+        rel_tol (float): stop early once converged (see train_until_converged), None for 1000 iterations
+        patience (int): number of stable 100-iteration chunks needed to stop
+        trace_dir (str): if given, write a training trace per quarter to this directory
+        checkpoint_dir (str): if given, checkpoint each quarter here after every chunk, as
+            train_hdp_model_parallel does, and resume an interrupted quarter from its checkpoint
+            (with its convergence state if trace_dir is also given)
     Returns:
         hdp_model_lst (list): list of trained HDP models (tomotopy.HDPModel)
     """
     hdp_model_lst = []
+    if trace_dir is not None:
+        os.makedirs(trace_dir, exist_ok=True)
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
 
     for quarter in quarter_lst:
         print(quarter)
 
-        term_weight = tp.TermWeight.PMI
-        hdp = tp.HDPModel(tw=term_weight,
-                          min_cf=5,
-                          rm_top=7,
-                          gamma=1,
-                          alpha=0.1,
-                          initial_k=10,
-                          seed=1234)
-        word_list_lemmatized = df[df['doc_quarter']==quarter]
-
-        for vec in word_list_lemmatized['qna tokens']:
-            hdp.add_doc(vec)
-        
-        for i in range(0, 1000, 100):
-            hdp.train(100, workers=1)
-            print(f'Iter: {i}\tLoglikelihood: {hdp.ll_per_word}\tNum. of topics: {hdp.live_k}')
+        checkpoint_path = get_checkpoint_path(quarter, checkpoint_dir) if checkpoint_dir is not None else None
+        with stage('train_hdp_model.add_docs', quarter=quarter) as s:
+            if checkpoint_path is not None and os.path.exists(checkpoint_path):
+                # resume an interrupted quarter from its last chunk
+                hdp = tp.HDPModel.load(checkpoint_path)
+            else:
+                hdp = make_hdp_model()
+                for vec in get_quarter_docs(df, quarter, token_store):
+                    hdp.add_doc(vec)
+            if s.enabled:
+                s.add(n_docs=len(hdp.docs), n_tokens=hdp.num_words)
+
+        trace_path = get_trace_path(quarter, trace_dir) if trace_dir is not None else None
+        with stage('train_hdp_model.train', quarter=quarter) as s:
+            train_until_converged(hdp, rel_tol=rel_tol, patience=patience,
+                                  checkpoint_path=checkpoint_path,
+                                  trace_path=trace_path, quarter=quarter)
+            if s.enabled:
+                s.add(n_docs=len(hdp.docs), n_tokens=hdp.num_words, iterations=hdp.global_step)
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
         
         hdp_model_lst.append(hdp)
         print('===========================================================')
     return hdp_model_lst
 
+def split_cores(total_cores, n_quarters, workers_per_quarter=None):
+    """
+    Split the cores between the process pool (quarters) and tomotopy's workers (within a quarter)
+    Args:
+        total_cores (int): number of cores to use, all cores if None
+        n_quarters (int): number of quarters to train
+        workers_per_quarter (int): tomotopy workers per quarter, if None whole quarters
+            are parallelized first and the left-over cores go to tomotopy, the first
+            quarters getting one more worker when the cores do not divide evenly
+    Returns:
+        n_jobs (int): number of quarters trained at the same time
+        workers_lst (list): tomotopy workers of each quarter
+    """
+    total_cores = total_cores or os.cpu_count() or 1
+    if workers_per_quarter is None:
+        n_jobs = max(1, min(n_quarters, total_cores))
+        # the remainder is only non-zero when every quarter runs at once (n_jobs == n_quarters)
+        base, remainder = divmod(total_cores, n_jobs)
+        workers_lst = [max(1, base) + (1 if i < remainder else 0) for i in range(n_quarters)]
+    else:
+        n_jobs = max(1, min(n_quarters, total_cores // workers_per_quarter))
+        workers_lst = [workers_per_quarter] * n_quarters
+    return n_jobs, workers_lst
+
+def _train_quarter_model(quarter, docs, model_dir, workers, parallel, token_store_dir=None,
+                         rel_tol=None, patience=3, trace_dir=None):
+    # runs in a worker process, docs are token lists or, with token_store_dir, store positions
+    checkpoint_path = get_checkpoint_path(quarter, model_dir)
+    with stage('train_hdp_model_parallel.quarter', quarter=quarter, workers=workers) as s:
+        if os.path.exists(checkpoint_path):
+            # resume an interrupted quarter from its last chunk
+            hdp = tp.HDPModel.load(checkpoint_path)
+        else:
+            if token_store_dir is not None:
+                docs = iter_docs(load_token_store(token_store_dir), docs)
+            hdp = make_hdp_model()
+            for vec in docs:
+                hdp.add_doc(vec)
+
+        trace_path = get_trace_path(quarter, trace_dir) if trace_dir is not None else None
+        train_until_converged(hdp, rel_tol=rel_tol, patience=patience, workers=workers,
+                              parallel=parallel, checkpoint_path=checkpoint_path,
+                              trace_path=trace_path, quarter=quarter)
+        if s.enabled:
+            s.add(n_docs=len(hdp.docs), n_tokens=hdp.num_words, iterations=hdp.global_step)
+
+    save_hdp_model(hdp, quarter, model_dir)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return quarter, hdp.ll_per_word, hdp.live_k, hdp.global_step
+
+def train_hdp_model_parallel(quarter_lst, df, total_cores=None, workers_per_quarter=None,
+                             model_dir='hdp_models', token_store_dir=None,
+                             parallel=tp.ParallelScheme.DEFAULT,
+                             rel_tol=None, patience=3, trace_dir=None, return_models=True):
+    """
+    Train the quarterly HDP models on a process pool, each quarter also using tomotopy's workers.
+    Each model is saved to model_dir as soon as it finishes, and quarters whose model
+    already exists are skipped, so a crashed run resumes where it stopped; unfinished
+    quarters resume from their last checkpoint.
+    Args:
+        quarter_lst (list): list of quarters
+        df (pd.DataFrame): QnA transcript of earnings call
+        total_cores (int): number of cores to use, all cores if None
+        workers_per_quarter (int): tomotopy workers per quarter, see split_cores
+        model_dir (str): directory of the saved models
+        token_store_dir (str): if given, workers read the tokens from this token store
+            (built from df) instead of receiving the 'qna tokens' lists
+        parallel (tomotopy.ParallelScheme): tomotopy's parallelization scheme
+        rel_tol (float): stop early once converged (see train_until_converged), None for 1000 iterations
+        patience (int): number of stable 100-iteration chunks needed to stop
+        trace_dir (str): if given, write a training trace per quarter to this directory
+        return_models (bool): if False, return the model paths instead of loading every model back
+    Returns:
+        hdp_model_lst (list): list of trained HDP models (tomotopy.HDPModel), in the order of quarter_lst,
+            or their paths if not return_models
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    if trace_dir is not None:
+        os.makedirs(trace_dir, exist_ok=True)
+    todo = [quarter for quarter in quarter_lst if not os.path.exists(get_model_path(quarter, model_dir))]
+    print(f'{len(quarter_lst) - len(todo)} quarters already trained, {len(todo)} to train')
+
+    if todo:
+        n_jobs, workers_lst = split_cores(total_cores, len(todo), workers_per_quarter)
+        print(f'Training {n_jobs} quarters at a time with {min(workers_lst)}-{max(workers_lst)} workers each')
+        with ProcessPoolExecutor(n_jobs) as executor:
+            futures = []
+            for quarter, workers in zip(todo, workers_lst):
+                if token_store_dir is not None:
+                    docs = get_quarter_positions(df, quarter)
+                else:
+                    docs = df.loc[df['doc_quarter']==quarter, 'qna tokens'].tolist()
+                futures.append(executor.submit(_train_quarter_model, quarter, docs, model_dir,
+                                               workers, parallel, token_store_dir,
+                                               rel_tol, patience, trace_dir))
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                quarter, ll_per_word, live_k, n_iter = future.result()
+                print(f'{quarter}\tIter: {n_iter}\tLoglikelihood: {ll_per_word}\tNum. of topics: {live_k}')
+
+    if not return_models:
+        return [get_model_path(quarter, model_dir) for quarter in quarter_lst]
+    hdp_model_lst = [tp.HDPModel.load(get_model_path(quarter, model_dir)) for quarter in quarter_lst]
+    return hdp_model_lst
+
+def make_warm_hdp_model(prev_hdp, top_n=50, prior_strength=1.0):
+    """
+    Create an untrained HDP model warm-started from the previous quarter's topics.
+    This is a prior-only warm start: the topic assignments are not carried over. The model gets
+    one initial topic per live topic of the previous quarter, and each carried-over word gets
+    the prior eta + prior_strength * (its probability under each of those topics), so training
+    is pulled towards the previous solution.
+    Args:
+        prev_hdp (tomotopy.HDPModel): trained model of the previous quarter
+        top_n (int): number of top words per topic carried over as prior
+        prior_strength (float): weight of the previous topic-word probabilities in the prior
+    Returns:
+        hdp (tomotopy.HDPModel): untrained HDP model with the word priors set
+    """
+    live_topics = [k for k in range(prev_hdp.k) if prev_hdp.is_live_topic(k)]
+    hdp = make_hdp_model(initial_k=max(len(live_topics), 1))
+
+    # collect, for each carried-over word, its probability under each live topic
+    word_priors = {}
+    for j, k in enumerate(live_topics):
+        for word, prob in prev_hdp.get_topic_words(k, top_n=top_n):
+            word_priors.setdefault(word, np.zeros(hdp.k))[j] += prob
+    for word, prior in word_priors.items():
+        hdp.set_word_prior(word, (prev_hdp.eta + prior_strength * prior).tolist())
+    return hdp
+
+def train_hdp_model_rolling(quarter_lst, df, window=1, rel_tol=1e-3, patience=3,
+                            compare_cold=False, token_store=None, trace_dir=None):
+    """
+    Train the quarterly HDP models as a rolling sequence, each quarter warm-started from the
+    previous quarter's model and trained until convergence
+    Args:
+        quarter_lst (list): list of quarters, in chronological order
+        df (pd.DataFrame): QnA transcript of earnings call
+        window (int): number of quarters of documents in each model, 1 for the quarter only
+        rel_tol (float): relative log-likelihood tolerance (see train_until_converged)
+        patience (int): number of stable 100-iteration chunks needed to stop
+        compare_cold (bool): if True, also train each quarter from scratch to measure the savings
+        token_store (TokenStore): optional integer-encoded tokens of df (see utils.token_store)
+        trace_dir (str): if given, write a training trace per quarter to this directory
+    Returns:
+        hdp_model_lst (list): list of trained HDP models (tomotopy.HDPModel)
+        report (pd.DataFrame): iterations and training time per quarter, with the
+            cold-start numbers and savings if compare_cold
+    """
+    hdp_model_lst = []
+    records = []
+    if trace_dir is not None:
+        os.makedirs(trace_dir, exist_ok=True)
+
+    for t, quarter in enumerate(quarter_lst):
+        print(quarter)
+        docs = []
+        for window_quarter in quarter_lst[max(0, t - window + 1):t + 1]:
+            docs.extend(get_quarter_docs(df, window_quarter, token_store))
+
+        hdp = make_warm_hdp_model(hdp_model_lst[-1]) if hdp_model_lst else make_hdp_model()
+        for vec in docs:
+            hdp.add_doc(vec)
+        trace_path = get_trace_path(quarter, trace_dir) if trace_dir is not None else None
+        trace = train_until_converged(hdp, rel_tol=rel_tol, patience=patience,
+                                      trace_path=trace_path, quarter=quarter)
+        record = {'quarter': quarter,
+                  'warm_start': bool(hdp_model_lst),
+                  'iterations': hdp.global_step,
+                  'wall_time': sum(r['wall_time'] for r in trace),
+                  'll_per_word': hdp.ll_per_word,
+                  'live_k': hdp.live_k}
+
+        if compare_cold:
+            cold = make_hdp_model()
+            for vec in docs:
+                cold.add_doc(vec)
+            cold_trace = train_until_converged(cold, rel_tol=rel_tol, patience=patience, quarter=quarter)
+            record['cold_iterations'] = cold.global_step
+            record['cold_wall_time'] = sum(r['wall_time'] for r in cold_trace)
+            record['cold_ll_per_word'] = cold.ll_per_word
+            record['saved_iterations'] = record['cold_iterations'] - record['iterations']
+            record['saved_wall_time'] = record['cold_wall_time'] - record['wall_time']
+
+        records.append(record)
+        hdp_model_lst.append(hdp)
+        print('===========================================================')
+
+    report = pd.DataFrame.from_records(records)
+    if compare_cold:
+        print(f"Saved {report['saved_iterations'].sum()} iterations "
+              f"and {report['saved_wall_time'].sum():.1f}s against cold start")
+    return hdp_model_lst, report
+
+def save_hdp_model(hdp, quarter, model_dir='hdp_models', index_top_n=INDEX_TOP_N):
+    """
+    Save a quarter's HDP model with its sidecar index, so topic queries do not need to load it
+    Args:
+        hdp (tomotopy.HDPModel): trained model
+        quarter (pd.Period): quarter of the model
+        model_dir (str): directory of the saved models
+        index_top_n (int): number of top words per topic stored in the index
+    Returns:
+        model_path (str): path of the saved model
+    """
+    # write to a temporary file first so a crashed run never leaves a partial model behind
+    model_path = get_model_path(quarter, model_dir)
+    hdp.save(model_path + '.tmp')
+    os.replace(model_path + '.tmp', model_path)
+    save_model_index(hdp, quarter, model_dir, index_top_n)
+    return model_path
+
+def build_model_index(hdp, top_n=INDEX_TOP_N):
+    '''Summary of a trained HDP model answering the topic queries without the model
+
+    ** Inputs **
+    hdp: obj -> HDPModel trained model
+    top_n: int -> number of top words stored per topic
+
+    ** Returns **
+    index: dict -> 'k', 'live_k', 'live_mask', 'topic_counts', 'top_n' and 'topics',
+        a list of [topic_id, [[word, prob], ...]] in the order of get_hdp_topics
+    '''
+    topics = get_hdp_topics(hdp, top_n=top_n)
+    return {'k': hdp.k,
+            'live_k': hdp.live_k,
+            'live_mask': get_live_topic_mask(hdp).tolist(),
+            'topic_counts': [int(count) for count in hdp.get_count_by_topics()],
+            'top_n': top_n,
+            'topics': [[k, [[word, float(prob)] for word, prob in word_prob]] for k, word_prob in topics.items()]}
+
+def save_model_index(hdp, quarter, model_dir='hdp_models', top_n=INDEX_TOP_N):
+    '''Build and save the sidecar index of a quarter's saved model, stamped with the model file's
+    size and mtime so a replaced model invalidates it
+
+    ** Inputs **
+    hdp: obj -> HDPModel trained model, the one saved at get_model_path(quarter, model_dir)
+    quarter: pd.Period or str -> quarter of the model
+    model_dir: str -> directory of the saved models
+    top_n: int -> number of top words stored per topic
+
+    ** Returns **
+    index: dict -> the saved index (see build_model_index)
+    '''
+    stat = os.stat(get_model_path(quarter, model_dir))
+    index = build_model_index(hdp, top_n)
+    index.update({'model_size': stat.st_size, 'model_mtime_ns': stat.st_mtime_ns})
+    path = get_index_path(quarter, model_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(path + '.tmp', path)
+    return index
+
 def get_hdp_topics(hdp, top_n=10):
     '''Wrapper function to extract topics from trained tomotopy HDP model 
     
@@ -87,41 +504,91 @@ def get_inferred_topic(hdp, doc):
     '''
     # Get most important topics by # of times they were assigned (i.e. counts)
     doc_inst = hdp.make_doc(doc)
+    topic_dist, ll = hdp.infer(doc_inst)
     real_vecs = []
-    for k, vec_k in enumerate(hdp.infer(doc_inst)[0]):
+    for k, vec_k in enumerate(topic_dist):
         if not hdp.is_live_topic(k): continue
         real_vecs.append(vec_k)
 
-    inferred_topics = (np.array(real_vecs), hdp.infer(doc_inst)[1])
+    inferred_topics = (np.array(real_vecs), ll)
     return inferred_topics
 
-def get_earnings_call_w_topics(hdp_model_lst, df):
+def get_live_topic_mask(hdp, k=None):
+    '''Boolean mask of the live topics of a trained HDP model
+
+    ** Inputs **
+    hdp:obj -> HDPModel trained model
+    k: int -> length of the mask, hdp.k if None
+
+    ** Returns **
+    live_mask: np.ndarray -> True for the topics still assigned
+    '''
+    k = hdp.k if k is None else k
+    return np.array([hdp.is_live_topic(topic) for topic in range(k)], dtype=bool)
+
+def infer_topics_batch(hdp, docs, workers=0, live_mask=None):
+    '''Infer the topic distribution of many documents with a single tomotopy call
+
+    ** Inputs **
+    hdp:obj -> HDPModel trained model
+    docs: iterable -> list of words for each document
+    workers: int -> tomotopy inference workers, 0 for all cores
+    live_mask: np.ndarray -> precomputed live topic mask (see get_live_topic_mask)
+
+    ** Returns **
+    topic_dist: np.ndarray -> (n_docs, n_live_topics) topic distribution over the live topics
+    ll: np.ndarray -> log-likelihood of each document
+    topic_allocation: np.ndarray -> index of the most probable live topic of each document
+    '''
+    doc_insts = [hdp.make_doc(doc) for doc in docs]
+    if not doc_insts:
+        n_live = int(live_mask.sum()) if live_mask is not None else hdp.live_k
+        return np.empty((0, n_live)), np.empty(0), np.empty(0, dtype=int)
+
+    topic_dists, ll = hdp.infer(doc_insts, workers=workers)
+    topic_dist = np.asarray(topic_dists)
+    if live_mask is None:
+        live_mask = get_live_topic_mask(hdp, topic_dist.shape[1])
+    topic_dist = topic_dist[:, live_mask]
+    topic_allocation = np.argmax(topic_dist, axis=1)
+    return topic_dist, np.asarray(ll), topic_allocation
+
+def get_earnings_call_w_topics(hdp_model_lst, df, token_store=None, quarter_lst=None, workers=0,
+                               live_mask_lst=None):
     '''Wrapper function to extract inferred topic for a given document
 
     Args:
-        hdp_model_lst (list): list of trained HDP models (tomotopy.HDPModel)
+        hdp_model_lst (iterable): trained HDP models (tomotopy.HDPModel) in the order of quarter_lst,
+            a list or an iterator loading them one at a time (e.g. model_registry.iter_models)
         df (pd.DataFrame): QnA transcript of earnings call
+        token_store (TokenStore): optional integer-encoded tokens of df (see utils.token_store)
+        quarter_lst (list): quarter of each model, the unique 'doc_quarter' of df if None
+        workers (int): tomotopy inference workers, 0 for all cores
+        live_mask_lst (list): optional precomputed live topic mask of each model (see get_live_topic_mask)
     Returns:
         earnings_call_qt_list (list): list of QnA transcript with inferred topics
     '''
     earnings_call_qt_list = []
+    if quarter_lst is None:
+        quarter_lst = df['doc_quarter'].unique().tolist()
 
-    for i, hdp in tqdm(enumerate(hdp_model_lst), total=len(hdp_model_lst)):
-        topics = get_hdp_topics(hdp, top_n=30)
+    if live_mask_lst is None:
+        live_mask_lst = [None] * len(quarter_lst)
+
+    for quarter, hdp, live_mask in tqdm(zip(quarter_lst, hdp_model_lst, live_mask_lst), total=len(quarter_lst)):
         # get the word list lemmatized for the quarter, or split the entire dataframe by quarters
-        word_list_lemmatized = df[df['doc_quarter']==df[i]].reset_index(drop=True)
-
-        # get the inferred topics for each documents
-        topic_allocation = []
-        for wd_lst in range(len(word_list_lemmatized)):
-            doc = word_list_lemmatized['qna tokens'].iloc[wd_lst]
-            inferred_topics = get_inferred_topic(hdp, doc)
-            # add the index of largest index of inferred_topics[0] to topic_allocation
-            topic_allocation.append(np.argmax(inferred_topics[0]))
+        word_list_lemmatized = df[df['doc_quarter']==quarter].reset_index(drop=True)
+        docs = get_quarter_docs(df, quarter, token_store)
+
+        # get the inferred topics for all documents at once,
+        # the allocation is the index of the largest live topic probability
+        with stage('get_earnings_call_w_topics.infer', quarter=quarter) as s:
+            _, _, topic_allocation = infer_topics_batch(hdp, docs, workers=workers, live_mask=live_mask)
+            if s.enabled:
+                s.add(n_docs=len(topic_allocation))
         
         word_list_lemmatized.loc[:, 'topic_allocation'] = topic_allocation
         word_list_lemmatized = word_list_lemmatized.dropna(subset = ['tic'])
         earnings_call_qt_list.append(word_list_lemmatized)
 
-    return earnings_call_qt_list
-
+    return earnings_call_qt_list
\ No newline at end of file
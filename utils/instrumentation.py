@@ -0,0 +1,258 @@
+'''Lightweight timing and resource instrumentation of the pipeline stages.
+
+Disabled by default; when disabled, stage() returns a shared no-op context manager, so the
+instrumented code pays one function call and one attribute check per stage. Enable it with
+enable() or with the environment variable HDP_INSTRUMENT:
+
+    HDP_INSTRUMENT=1          timings, throughput and peak RSS
+    HDP_INSTRUMENT=profile    also a cProfile of each stage
+    HDP_INSTRUMENT=memory     also the tracemalloc peak of each stage
+    HDP_INSTRUMENT=profile,memory
+
+Set HDP_INSTRUMENT_PATH to append every record as a json line to a file, which also collects
+the records of worker processes.
+
+Example:
+    with stage('train_hdp_model', quarter=quarter) as s:
+        ...
+        if s.enabled:
+            s.add(n_docs=len(docs), n_tokens=sum(len(doc) for doc in docs))
+'''
+import os
+import io
+import sys
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+ENV_VAR = 'HDP_INSTRUMENT'
+PATH_ENV_VAR = 'HDP_INSTRUMENT_PATH'
+# number of functions kept from each stage's profile
+PROFILE_TOP_N = 20
+
+_modes = {mode.strip() for mode in os.environ.get(ENV_VAR, '').lower().split(',') if mode.strip()}
+_state = {'enabled': bool(_modes) and not _modes <= {'0', 'false'},
+          'profile': 'profile' in _modes,
+          'trace_memory': 'memory' in _modes,
+          'path': os.environ.get(PATH_ENV_VAR),
+          'records': [],
+          # stages currently open in this process, outermost first
+          'stack': []}
+
+
+def enable(path=None, profile=False, trace_memory=False):
+    '''Turn the instrumentation on
+
+    ** Inputs **
+    path: str -> if given, append every record as a json line to this file
+    profile: bool -> run cProfile during each stage and keep its top functions
+    trace_memory: bool -> track the peak Python allocation of each stage with tracemalloc
+    '''
+    _state.update({'enabled': True, 'profile': profile, 'trace_memory': trace_memory,
+                   'path': path if path is not None else _state['path']})
+
+def disable():
+    '''Turn the instrumentation off, the collected records are kept
+    '''
+    _state['enabled'] = False
+
+def is_enabled():
+    return _state['enabled']
+
+def get_peak_rss_mb():
+    '''Peak resident set size of the process in MB, None where the resource module is missing
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class _NullStage:
+    # returned when the instrumentation is disabled
+    enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, **counts):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    enabled = True
+
+    def __init__(self, name, quarter=None, fields=None):
+        self.record = {'stage': name, 'quarter': None if quarter is None else str(quarter)}
+        self.record.update(fields or {})
+        self.counts = {}
+        self.profiler = None
+        self.started_tracing = False
+        # highest traced memory of the stage before its nested stages reset the peak
+        self.child_peak = 0
+
+    def add(self, **counts):
+        '''Add to the stage's counters, e.g. n_docs and n_tokens for the throughput
+        '''
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def __enter__(self):
+        stack = _state['stack']
+        self.parent = stack[-1] if stack else None
+        self.record.update({'depth': len(stack), 'parent': None if self.parent is None else self.parent.record['stage']})
+        stack.append(self)
+        if _state['trace_memory']:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            if self.parent is not None:
+                # keep the enclosing stage's peak so far before resetting it for this stage
+                self.parent.child_peak = max(self.parent.child_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if _state['profile']:
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # another profiler is active (nested stage), only the outer stage is profiled
+                self.profiler = None
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall_time = time.perf_counter() - self.wall_start
+        cpu_time = time.process_time() - self.cpu_start
+        if _state['stack'] and _state['stack'][-1] is self:
+            _state['stack'].pop()
+        record = self.record
+        record.update({'wall_time': wall_time, 'cpu_time': cpu_time, 'peak_rss_mb': get_peak_rss_mb(),
+                       'pid': os.getpid(), 'timestamp': time.time(),
+                       'error': None if exc_type is None else exc_type.__name__})
+        record.update(self.counts)
+        for key in ('n_docs', 'n_tokens'):
+            if key in self.counts:
+                record[key.replace('n_', '') + '_per_second'] = self.counts[key] / wall_time if wall_time > 0 else None
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            record['profile'] = _format_profile(self.profiler)
+        if _state['trace_memory'] and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            record['tracemalloc_peak_mb'] = peak / 2**20
+            if self.parent is not None:
+                # carry the peak up, the enclosing stage's peak includes its nested stages
+                self.parent.child_peak = max(self.parent.child_peak, peak)
+            if self.started_tracing:
+                tracemalloc.stop()
+        _add_record(record)
+        return False
+
+
+def _format_profile(profiler):
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+    return stream.getvalue()
+
+def _add_record(record):
+    _state['records'].append(record)
+    if _state['path'] is not None:
+        # one line per write, so records of several processes can share the file
+        with open(_state['path'], 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+def stage(name, quarter=None, **fields):
+    '''Context manager timing a stage, a no-op when the instrumentation is disabled
+
+    ** Inputs **
+    name: str -> name of the stage
+    quarter: pd.Period or str -> quarter processed by the stage, if any
+    fields: extra values stored in the record
+
+    ** Returns **
+    stage: context manager with add(**counts) and an 'enabled' flag
+    '''
+    if not _state['enabled']:
+        return _NULL_STAGE
+    return _Stage(name, quarter, fields)
+
+def get_records():
+    '''Records collected in this process
+    '''
+    return list(_state['records'])
+
+def clear_records():
+    _state['records'].clear()
+
+def load_records(path=None):
+    '''Records of a json lines file written by the instrumentation, HDP_INSTRUMENT_PATH if None
+    '''
+    path = _state['path'] if path is None else path
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize(records=None):
+    '''Per-stage summary of the records
+
+    ** Inputs **
+    records: list -> stage records, the ones collected in this process if None
+
+    ** Returns **
+    summary: DataFrame -> per stage: nesting depth, calls, total/mean/max wall time, cpu time, share of
+        the total, docs and tokens per second and the peak RSS, sorted by total wall time.
+        The share is relative to the time of the top-level stages, so nested time is not counted twice.
+    '''
+    records = get_records() if records is None else records
+    df = pd.DataFrame.from_records(records)
+    if df.empty:
+        return pd.DataFrame()
+    for col in ('n_docs', 'n_tokens', 'peak_rss_mb'):
+        if col not in df.columns:
+            df[col] = float('nan')
+    df['depth'] = df['depth'].fillna(0) if 'depth' in df.columns else 0
+    summary = df.groupby('stage').agg(depth=('depth', 'min'),
+                                      calls=('wall_time', 'size'),
+                                      total_wall_time=('wall_time', 'sum'),
+                                      mean_wall_time=('wall_time', 'mean'),
+                                      max_wall_time=('wall_time', 'max'),
+                                      total_cpu_time=('cpu_time', 'sum'),
+                                      n_docs=('n_docs', 'sum'),
+                                      n_tokens=('n_tokens', 'sum'),
+                                      peak_rss_mb=('peak_rss_mb', 'max'))
+    summary['share'] = summary['total_wall_time'] / df.loc[df['depth'] == 0, 'wall_time'].sum()
+    summary['docs_per_second'] = summary['n_docs'] / summary['total_wall_time']
+    summary['tokens_per_second'] = summary['n_tokens'] / summary['total_wall_time']
+    return summary.sort_values('total_wall_time', ascending=False)
+
+def report(records=None):
+    '''Print the per-stage summary and the slowest quarters of each per-quarter stage
+    '''
+    records = get_records() if records is None else records
+    summary = summarize(records)
+    if summary.empty:
+        print('No instrumentation records')
+        return summary
+    print(summary.to_string(float_format=lambda x: f'{x:.3f}'))
+    df = pd.DataFrame.from_records(records)
+    if 'quarter' in df.columns and df['quarter'].notna().any():
+        slowest = (df.dropna(subset=['quarter']).sort_values('wall_time', ascending=False)
+                   .groupby('stage').head(3)[['stage', 'quarter', 'wall_time']])
+        print('\nSlowest quarters:')
+        print(slowest.to_string(index=False, float_format=lambda x: f'{x:.3f}'))
+    return summary
@@ -0,0 +1,29 @@
+'''File layout of the saved HDP models, without importing tomotopy, so that the evaluation
+and significance code can locate the models without the training dependencies.
+'''
+import os
+
+
+def get_model_path(quarter, model_dir='hdp_models'):
+    """
+    Path of the saved HDP model of a quarter
+    """
+    return os.path.join(model_dir, f'hdp_model_{quarter}.bin')
+
+def get_index_path(quarter, model_dir='hdp_models'):
+    """
+    Path of the sidecar index of a quarter's saved HDP model (see hdp_training.save_model_index)
+    """
+    return os.path.join(model_dir, f'hdp_model_{quarter}.index.json')
+
+def get_checkpoint_path(quarter, model_dir='hdp_models'):
+    """
+    Path of the training checkpoint of a quarter
+    """
+    return os.path.join(model_dir, f'hdp_model_{quarter}.ckpt')
+
+def get_trace_path(quarter, trace_dir):
+    """
+    Path of the training trace (json lines) of a quarter
+    """
+    return os.path.join(trace_dir, f'hdp_trace_{quarter}.jsonl')
@@ -0,0 +1,120 @@
+import os
+import re
+import json
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+import tomotopy as tp
+
+from utils.model_paths import get_model_path, get_index_path
+from utils.hdp_training import INDEX_TOP_N, get_hdp_topics, save_model_index
+
+# number of deserialized models kept in memory at once
+MAX_RESIDENT_MODELS = 4
+
+
+def list_model_quarters(model_dir='hdp_models'):
+    '''Quarters with a saved HDP model in model_dir, in chronological order
+
+    ** Inputs **
+    model_dir: str -> directory of the saved models
+
+    ** Returns **
+    quarter_lst: list -> quarters (pd.Period)
+    '''
+    pattern = re.compile(r'^hdp_model_(\d{4}Q[1-4])\.bin$')
+    matches = (pattern.match(name) for name in os.listdir(model_dir))
+    return sorted(pd.Period(m.group(1), freq='Q') for m in matches if m)
+
+def _model_stamp(path):
+    # size and modification time of the model file, a changed stamp invalidates the caches
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+@lru_cache(maxsize=MAX_RESIDENT_MODELS)
+def _load_model(path, size, mtime_ns):
+    return tp.HDPModel.load(path)
+
+def get_model(quarter, model_dir='hdp_models'):
+    '''Load a quarter's HDP model on demand; the last MAX_RESIDENT_MODELS models stay in memory
+
+    ** Inputs **
+    quarter: pd.Period or str -> quarter of the model
+    model_dir: str -> directory of the saved models
+
+    ** Returns **
+    hdp: obj -> HDPModel trained model
+    '''
+    path = get_model_path(quarter, model_dir)
+    return _load_model(path, *_model_stamp(path))
+
+def iter_models(quarter_lst, model_dir='hdp_models'):
+    '''Yield the HDP models of the quarters one at a time, instead of loading them all up front
+    '''
+    for quarter in quarter_lst:
+        yield get_model(quarter, model_dir)
+
+def write_model_index(quarter, model_dir='hdp_models', top_n=INDEX_TOP_N):
+    '''Build and save the sidecar index of an already saved model, e.g. one saved without
+    hdp_training.save_hdp_model
+
+    ** Inputs **
+    quarter: pd.Period or str -> quarter of the model
+    model_dir: str -> directory of the saved models
+    top_n: int -> number of top words stored per topic
+
+    ** Returns **
+    index: dict -> the saved index (see hdp_training.build_model_index)
+    '''
+    return save_model_index(get_model(quarter, model_dir), quarter, model_dir, top_n)
+
+@lru_cache(maxsize=None)
+def _load_model_index(path, size, mtime_ns):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        index = json.load(f)
+    if index.get('model_size') != size or index.get('model_mtime_ns') != mtime_ns:
+        return None
+    return index
+
+def get_model_index(quarter, model_dir='hdp_models'):
+    '''Sidecar index of a quarter's model, rebuilt if missing or older than the model
+
+    ** Inputs **
+    quarter: pd.Period or str -> quarter of the model
+    model_dir: str -> directory of the saved models
+
+    ** Returns **
+    index: dict -> see hdp_training.build_model_index
+    '''
+    stamp = _model_stamp(get_model_path(quarter, model_dir))
+    index = _load_model_index(get_index_path(quarter, model_dir), *stamp)
+    if index is None:
+        _load_model_index.cache_clear()
+        index = write_model_index(quarter, model_dir)
+    return index
+
+def get_model_topics(quarter, top_n=10, model_dir='hdp_models'):
+    '''Top words of the live topics of a quarter, as get_hdp_topics, read from the sidecar index.
+    The model is only loaded when more words are asked than the index holds.
+
+    ** Inputs **
+    quarter: pd.Period or str -> quarter of the model
+    top_n: int -> top n words in topic, None for the full vocabulary
+    model_dir: str -> directory of the saved models
+
+    ** Returns **
+    topics: dict -> per topic, a list of top words and associated frequencies
+    '''
+    index = get_model_index(quarter, model_dir)
+    if top_n is None or top_n > index['top_n']:
+        hdp = get_model(quarter, model_dir)
+        return get_hdp_topics(hdp, top_n=len(hdp.used_vocabs) if top_n is None else top_n)
+    return {k: [(word, prob) for word, prob in word_prob[:top_n]] for k, word_prob in index['topics']}
+
+def get_model_live_mask(quarter, model_dir='hdp_models'):
+    '''Live topic mask of a quarter's model, read from the sidecar index
+    '''
+    return np.array(get_model_index(quarter, model_dir)['live_mask'], dtype=bool)
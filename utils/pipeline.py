@@ -0,0 +1,332 @@
+'''Command-line runner of the earnings call pipeline.
+
+The stages form a DAG (STAGE_DEPS). Every artifact is stored under a key hashed from the content
+of its inputs and the stage parameters, so a stage whose inputs have not changed is read back
+instead of recomputed. The model stages run per quarter, so a nightly update only trains, infers
+and evaluates the quarters whose transcripts changed.
+
+Example:
+    python -m utils.pipeline --start 2022Q1 --end 2023Q4 --targets evaluate trends
+'''
+import os
+import json
+import shutil
+import pickle
+import hashlib
+import argparse
+import pandas as pd
+
+from utils.preprocesing_token import get_cached_tokens, add_tokenized_text, learn_phrases, load_phrases, apply_phrases
+from utils.model_paths import get_model_path, get_index_path, get_checkpoint_path
+from utils.hdp_training import train_hdp_model_parallel, get_earnings_call_w_topics
+from utils.model_registry import list_model_quarters, iter_models, get_model_live_mask
+from utils.eval_pipeline import evaluate_quarter, fingerprint_file, fingerprint_price_data
+from utils.price_store import PRICE_CSV
+from utils.reference_data import REFERENCE_PATH
+from utils.trend_word_change import get_trend_tables, save_trend_tables
+
+# stage -> stages whose artifacts it reads
+STAGE_DEPS = {'load': [],
+              'tokenize': ['load'],
+              'phrases': ['tokenize'],
+              'train': ['phrases'],
+              'infer': ['phrases', 'train'],
+              'evaluate': ['infer'],
+              'trends': ['train']}
+# bump a stage's version when its code changes the artifact, to invalidate the cache
+STAGE_VERSIONS = {'load': 1, 'tokenize': 2, 'phrases': 1, 'train': 1, 'infer': 1, 'evaluate': 1, 'trends': 1}
+
+DEFAULT_CONFIG = {'transcripts_path': 'data/sp500_cc_transcripts_2014_2023.parquet',
+                  'comp_info_path': 'data/tick_gvkey_gics.csv',
+                  'price_csv': PRICE_CSV,
+                  'reference_path': REFERENCE_PATH,
+                  'cache_dir': 'data/pipeline_cache',
+                  'model_dir': 'hdp_models',
+                  'token_cache_dir': 'data/token_cache',
+                  'quarterly_trends_path': 'data/quarterly_trimmed_word_count.csv',
+                  'yearly_trends_path': 'data/yearly_trimmed_word_count.csv',
+                  'phrases_path': None,
+                  'relearn_phrases': False,
+                  'spacy_model': 'en_core_web_sm',
+                  'noun': True,
+                  'rel_tol': None,
+                  'offline': False,
+                  'n_jobs': None,
+                  'force': False}
+
+
+def get_required_stages(targets):
+    '''Stages needed to produce the targets, in topological order
+    '''
+    order = []
+    def visit(stage):
+        for dep in STAGE_DEPS[stage]:
+            visit(dep)
+        if stage not in order:
+            order.append(stage)
+    for target in targets:
+        visit(target)
+    return order
+
+def hash_key(stage, *parts):
+    '''Artifact key of a stage from the keys of its inputs and its parameters
+    '''
+    h = hashlib.sha1(f'{stage}:{STAGE_VERSIONS[stage]}'.encode('utf-8'))
+    for part in parts:
+        h.update(b'\x00')
+        h.update(json.dumps(part, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+def hash_quarter_tokens(df, quarter):
+    '''Content hash of the tokens and tickers of a quarter's transcripts
+    '''
+    quarter_df = df[df['doc_quarter'] == quarter]
+    h = hashlib.sha1(str(quarter).encode('utf-8'))
+    for gvkey, tic, tokens in zip(quarter_df['gvkey'], quarter_df['tic'], quarter_df['qna tokens']):
+        h.update(f'{gvkey}|{tic}|'.encode('utf-8'))
+        h.update(' '.join(tokens).encode('utf-8'))
+        h.update(b'\x00')
+    return h.hexdigest()
+
+def artifact_path(config, stage, key, ext='pkl', quarter=None):
+    name = f'{quarter}_{key[:16]}.{ext}' if quarter is not None else f'{key[:16]}.{ext}'
+    return os.path.join(config['cache_dir'], stage, name)
+
+def cached(config, stage, key, compute, quarter=None):
+    '''Read the artifact of a stage back if it exists, otherwise compute and store it
+    '''
+    path = artifact_path(config, stage, key, quarter=quarter)
+    label = f'{stage}[{quarter}]' if quarter is not None else stage
+    if os.path.exists(path) and not config['force']:
+        print(f'{label}: up to date')
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    print(f'{label}: running')
+    value = compute()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    return value
+
+def load_transcripts(config):
+    '''Load the QnA transcripts merged with the company information (Step 1 of the notebook)
+    '''
+    comp_info = pd.read_csv(config['comp_info_path'])
+    compdesc_info = comp_info[['conm', 'gvkey', 'tic', 'gsector', 'gind', 'ggroup']]
+    compdesc_info = compdesc_info.drop_duplicates(subset='gvkey').astype(str)
+    compdesc_info['gvkey'] = compdesc_info['gvkey'].apply(lambda x: x.zfill(6))
+
+    pru_data = pd.read_parquet(config['transcripts_path'], engine='pyarrow')
+    qna_transcript = pru_data[pru_data['transcriptComponentTypeId'] != 2]
+    qna_transcript = qna_transcript.groupby(['gvkey', 'doc_date'])['componentText'].apply(lambda x: ' '.join(x)).reset_index()
+    qna_transcript = qna_transcript.merge(compdesc_info, on='gvkey', how='left')
+    return qna_transcript
+
+def tokenize_transcripts(qna_transcript, config):
+    '''Tokenize the transcripts through the token cache (Step 2 of the notebook), without the bigrams
+    '''
+    import spacy
+    nlp = spacy.load(config['spacy_model'])
+    tokens = get_cached_tokens(qna_transcript, nlp, config['token_cache_dir'], noun=config['noun'])
+    qna_transcript = add_tokenized_text(qna_transcript, tokens)
+    return qna_transcript.drop(columns=['componentText'])
+
+def phrase_transcripts(unigram_df, config):
+    '''Apply the saved phrase model to the unigram tokens
+    '''
+    bigram = load_phrases(config['phrases_path'])
+    phrased_df = unigram_df.copy()
+    phrased_df['qna tokens'] = list(apply_phrases(bigram, unigram_df['qna tokens']))
+    return phrased_df
+
+def select_quarters(quarter_lst, quarters=None, start=None, end=None):
+    '''Quarters to run, from an explicit list or an inclusive range
+    '''
+    quarter_lst = sorted(quarter_lst)
+    if quarters:
+        wanted = {pd.Period(quarter, freq='Q') for quarter in quarters}
+        return [quarter for quarter in quarter_lst if quarter in wanted]
+    if start is not None:
+        quarter_lst = [quarter for quarter in quarter_lst if quarter >= pd.Period(start, freq='Q')]
+    if end is not None:
+        quarter_lst = [quarter for quarter in quarter_lst if quarter <= pd.Period(end, freq='Q')]
+    return quarter_lst
+
+def prepare_staging(staging_dir, quarters, train_keys, force=False):
+    '''Keep the staged models and checkpoints of a previous run only for the quarters whose
+    train key is unchanged, and record the train key of each staged quarter
+    '''
+    os.makedirs(staging_dir, exist_ok=True)
+    for q in quarters:
+        key_path = os.path.join(staging_dir, f'{q}.key')
+        staged_key = None
+        if os.path.exists(key_path):
+            with open(key_path) as f:
+                staged_key = f.read().strip()
+        if force or staged_key != train_keys[q]:
+            for path in (get_model_path(q, staging_dir), get_index_path(q, staging_dir),
+                         get_checkpoint_path(q, staging_dir)):
+                if os.path.exists(path):
+                    os.remove(path)
+            with open(key_path, 'w') as f:
+                f.write(train_keys[q])
+
+def run_train(df, quarters, quarter_keys, config):
+    '''Train the quarters whose model artifact is missing, in parallel, and publish all models
+    to the model directory. Returns the quarter -> train key mapping.
+    '''
+    train_keys = {q: hash_key('train', quarter_keys[q], config['rel_tol']) for q in quarters}
+    todo = [q for q in quarters
+            if config['force'] or not os.path.exists(artifact_path(config, 'train', train_keys[q], 'bin', q))]
+    for q in quarters:
+        print(f'train[{q}]: ' + ('running' if q in todo else 'up to date'))
+
+    if todo:
+        # the staging directory survives an interrupted run, so its checkpoints resume the training
+        staging_dir = os.path.join(config['cache_dir'], 'train', 'staging')
+        prepare_staging(staging_dir, todo, train_keys, config['force'])
+        # the traces carry the convergence state of a quarter resumed from its checkpoint
+        train_hdp_model_parallel(todo, df, total_cores=config['n_jobs'], model_dir=staging_dir,
+                                 rel_tol=config['rel_tol'], trace_dir=os.path.join(staging_dir, 'traces'),
+                                 return_models=False)
+        for q in todo:
+            # the sidecar index moves with its model, os.replace keeps the mtime it is stamped with
+            if os.path.exists(get_index_path(q, staging_dir)):
+                os.replace(get_index_path(q, staging_dir), artifact_path(config, 'train', train_keys[q], 'index.json', q))
+            os.replace(get_model_path(q, staging_dir), artifact_path(config, 'train', train_keys[q], 'bin', q))
+        # every model is promoted, nothing left to resume
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    os.makedirs(config['model_dir'], exist_ok=True)
+    for q in quarters:
+        src, dst = artifact_path(config, 'train', train_keys[q], 'bin', q), get_model_path(q, config['model_dir'])
+        # copy2 keeps the mtime, so the published model keeps its registry index valid
+        if not os.path.exists(dst) or os.stat(src).st_mtime_ns != os.stat(dst).st_mtime_ns:
+            shutil.copy2(src, dst)
+            index_src = artifact_path(config, 'train', train_keys[q], 'index.json', q)
+            if os.path.exists(index_src):
+                shutil.copy2(index_src, get_index_path(q, config['model_dir']))
+    return train_keys
+
+def run_pipeline(config, targets=('evaluate', 'trends'), quarters=None, start=None, end=None):
+    '''Run the stages needed for the targets over the selected quarters
+
+    Args:
+        config (dict): paths and parameters, see DEFAULT_CONFIG; the phrase model is saved
+            in the cache directory unless phrases_path is set
+        targets (iterable): stages to produce
+        quarters (list): quarters to run, e.g. ['2023Q1']
+        start (str): first quarter of the range to run
+        end (str): last quarter of the range to run
+    Returns:
+        artifacts (dict): stage -> artifact (per-quarter stages map quarter -> artifact); the
+            trend tables are built from every model in the model directory, whatever the quarters
+    '''
+    stages = get_required_stages(targets)
+    artifacts = {}
+    if config['phrases_path'] is None:
+        config = dict(config, phrases_path=os.path.join(config['cache_dir'], 'phrases.model'))
+
+    load_key = hash_key('load', fingerprint_file(config['transcripts_path']), fingerprint_file(config['comp_info_path']))
+    tokenize_key = hash_key('tokenize', load_key, config['noun'], config['spacy_model'])
+    def load_df():
+        return cached(config, 'load', load_key, lambda: load_transcripts(config))
+    def unigram_df():
+        return cached(config, 'tokenize', tokenize_key, lambda: tokenize_transcripts(load_df(), config))
+
+    # stop after the last requested stage, e.g. --targets tokenize does not learn the phrase model
+    if 'tokenize' not in stages:
+        artifacts['load'] = load_df()
+        return artifacts
+    if 'phrases' not in stages:
+        artifacts['tokenize'] = unigram_df()
+        return artifacts
+
+    # the phrase model is learned once and reused, so adding transcripts does not change
+    # the bigrams (and the models) of the other quarters; relearn it with --relearn-phrases
+    if config['relearn_phrases'] or not os.path.exists(config['phrases_path']):
+        print('phrases: learning')
+        os.makedirs(os.path.dirname(config['phrases_path']) or '.', exist_ok=True)
+        learn_phrases([unigram_df()['qna tokens'].tolist()], path=config['phrases_path'])
+    phrases_fingerprint = fingerprint_file(config['phrases_path'])
+    phrases_key = hash_key('phrases', tokenize_key, phrases_fingerprint)
+    df = cached(config, 'phrases', phrases_key, lambda: phrase_transcripts(unigram_df(), config))
+    artifacts['phrases'] = df
+
+    quarter_lst = select_quarters(df['doc_quarter'].unique().tolist(), quarters, start, end)
+    quarter_keys = {q: hash_key('phrases', phrases_fingerprint, hash_quarter_tokens(df, q)) for q in quarter_lst}
+    if 'train' not in stages:
+        return artifacts
+    train_keys = run_train(df, quarter_lst, quarter_keys, config)
+    artifacts['train'] = {q: get_model_path(q, config['model_dir']) for q in quarter_lst}
+
+    if 'infer' in stages:
+        artifacts['infer'] = {}
+        for q in quarter_lst:
+            infer_key = hash_key('infer', train_keys[q], quarter_keys[q])
+            artifacts['infer'][q] = cached(config, 'infer', infer_key, lambda q=q: get_earnings_call_w_topics(
+                iter_models([q], config['model_dir']), df, quarter_lst=[q],
+                live_mask_lst=[get_model_live_mask(q, config['model_dir'])])[0], quarter=q)
+
+    if 'evaluate' in stages:
+        artifacts['evaluate'] = {}
+        data_fingerprint = fingerprint_price_data(config['price_csv'], config['reference_path'])
+        # the last quarter of the sample has no next-quarter prices to evaluate on
+        last_quarter = df['doc_quarter'].max()
+        for q in quarter_lst:
+            earnings_call_df = artifacts['infer'][q]
+            if q == last_quarter or len(earnings_call_df) == 0:
+                continue
+            eval_key = hash_key('evaluate', train_keys[q], quarter_keys[q], data_fingerprint)
+            artifacts['evaluate'][q] = cached(config, 'evaluate', eval_key, lambda q=q, earnings_call_df=earnings_call_df: evaluate_quarter(
+                earnings_call_df, get_model_path(q, config['model_dir']),
+                cache_dir=os.path.join(config['cache_dir'], 'eval_quarter'),
+                csv_path=config['price_csv'], reference_path=config['reference_path'],
+                data_fingerprint=data_fingerprint, offline=config['offline']), quarter=q)
+
+    if 'trends' in stages:
+        # the trend tables span every published model, not only the quarters of this run, so a
+        # run over a few quarters does not overwrite the full-sample tables with near-empty ones
+        trend_quarters = list_model_quarters(config['model_dir'])
+        model_stamps = [(str(q), os.stat(get_model_path(q, config['model_dir'])).st_size,
+                         os.stat(get_model_path(q, config['model_dir'])).st_mtime_ns) for q in trend_quarters]
+        trends_key = hash_key('trends', model_stamps)
+        artifacts['trends'] = cached(config, 'trends', trends_key, lambda: get_trend_tables(
+            None, trend_quarters, model_dir=config['model_dir']))
+        save_trend_tables(*artifacts['trends'], quarterly_path=config['quarterly_trends_path'],
+                          yearly_path=config['yearly_trends_path'])
+    return artifacts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the HDP earnings call pipeline with stage-level caching.')
+    parser.add_argument('--targets', nargs='+', default=['evaluate', 'trends'], choices=list(STAGE_DEPS),
+                        help='stages to produce, with everything they depend on')
+    parser.add_argument('--quarters', nargs='+', help='quarters to run, e.g. 2023Q1 2023Q2')
+    parser.add_argument('--start', help='first quarter of the range to run, e.g. 2020Q1')
+    parser.add_argument('--end', help='last quarter of the range to run, e.g. 2023Q4')
+    parser.add_argument('--all-pos', action='store_true', help='keep all non-removal PoS instead of nouns only')
+    parser.add_argument('--rel-tol', type=float, help='early stopping tolerance of the HDP training')
+    parser.add_argument('--n-jobs', type=int, help='number of cores for training')
+    parser.add_argument('--cache-dir', default=DEFAULT_CONFIG['cache_dir'])
+    parser.add_argument('--model-dir', default=DEFAULT_CONFIG['model_dir'])
+    parser.add_argument('--relearn-phrases', action='store_true',
+                        help='learn the phrase model again from the whole corpus, which retrains every quarter')
+    parser.add_argument('--offline', action='store_true',
+                        help='fail instead of downloading market data missing from the reference cache')
+    parser.add_argument('--force', action='store_true', help='recompute every stage')
+    args = parser.parse_args(argv)
+
+    config = dict(DEFAULT_CONFIG, noun=not args.all_pos, rel_tol=args.rel_tol, n_jobs=args.n_jobs,
+                  cache_dir=args.cache_dir, model_dir=args.model_dir,
+                  relearn_phrases=args.relearn_phrases, offline=args.offline, force=args.force)
+    artifacts = run_pipeline(config, args.targets, args.quarters, args.start, args.end)
+
+    if 'evaluate' in artifacts and artifacts['evaluate']:
+        results = pd.concat(artifacts['evaluate'].values(), ignore_index=True)
+        results.to_parquet(os.path.join(config['cache_dir'], 'evaluation_results.parquet'), index=False)
+        print(f"{len(results)} group results written to {os.path.join(config['cache_dir'], 'evaluation_results.parquet')}")
+
+
+if __name__ == '__main__':
+    main()
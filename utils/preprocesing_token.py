@@ -1,3 +1,6 @@
+import os
+import hashlib
+from multiprocessing import Pool
 import pandas as pd
 from pandas.errors import SettingWithCopyWarning
 import pickle
@@ -7,52 +10,311 @@ import warnings
 warnings.simplefilter(action="ignore", category=[SettingWithCopyWarning, DeprecationWarning])
 
 import gensim
+import spacy
 
+from utils.instrumentation import stage
 
-def tokenize_text(df, nlp, noun=True):
+
+# pipeline components whose output is never read by the token filters below
+UNUSED_PIPES = ['parser', 'ner']
+
+
+def filter_tokens(doc, noun=True):
+    """
+    Keep the lemmatized tokens of a spacy Doc used for the topic model
+    Args:
+        doc (spacy.tokens.Doc): processed QnA transcript
+        noun (bool): if True, consider only noun, else consider non-removal pos
+    Returns:
+        proj_tok (list): list of lower-cased lemmas
+    """
+    removal= ['ADV','PRON','CCONJ','PUNCT','PART','DET','ADP','SPACE', 'NUM', 'SYM']
+    consider_only = ['NOUN']
+    if noun:
+        proj_tok = [token.lemma_.lower()
+                    for token in doc
+                    if token.pos_ in consider_only 
+                    and not token.is_stop and token.is_alpha]
+    else:
+        proj_tok = [token.lemma_.lower()
+                    for token in doc
+                    if token.pos_ not in removal
+                    and not token.is_stop and token.is_alpha]
+    return proj_tok
+
+def iter_doc_tokens(text_data, nlp, noun=True, n_process=1, batch_size=1000):
+    """
+    Lazily tokenize texts with spacy, with the unused pipeline components disabled
+    Args:
+        text_data (iterable): texts to tokenize
+        nlp (spacy.lang.en.English): spacy nlp object
+        noun (bool): if True, consider only noun, else consider non-removal pos
+        n_process (int): number of processes for nlp.pipe, -1 to use all cores
+        batch_size (int): number of texts buffered per process
+    Yields:
+        proj_tok (list): list of tokens for each text
+    """
+    disable = [pipe for pipe in UNUSED_PIPES if pipe in nlp.pipe_names]
+    for doc in nlp.pipe(text_data, n_process=n_process, batch_size=batch_size, disable=disable):
+        yield filter_tokens(doc, noun)
+
+def get_model_version(nlp):
+    """
+    Identify the spacy pipeline, so cached tokens are invalidated when the model changes
+    Args:
+        nlp (spacy.lang.en.English): spacy nlp object
+    Returns:
+        model_version (str): e.g. 'en_core_web_sm-3.7.1/spacy-3.7.4'
+    """
+    meta = nlp.meta
+    return f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}/spacy-{spacy.__version__}"
+
+def token_cache_key(gvkey, doc_date, text, noun, model_version):
+    """
+    Content hash identifying the tokens of one transcript
+    Args:
+        gvkey (str): company identifier
+        doc_date (str or datetime): date of the earnings call
+        text (str): QnA text of the transcript
+        noun (bool): tokenization mode
+        model_version (str): spacy pipeline version, see get_model_version
+    Returns:
+        key (str): hex digest
+    """
+    doc_date = pd.Timestamp(doc_date).isoformat()
+    h = hashlib.sha1()
+    for part in (str(gvkey), doc_date, str(bool(noun)), model_version):
+        h.update(part.encode('utf-8'))
+        h.update(b'\x00')
+    h.update(str(text).encode('utf-8'))
+    return h.hexdigest()
+
+def _token_cache_path(cache_dir, key):
+    # shard by the first two hex characters to keep directories small
+    return os.path.join(cache_dir, key[:2], f'{key}.pkl')
+
+def get_cached_tokens(df, nlp, cache_dir, noun=True, n_process=1, batch_size=1000):
+    """
+    Get the unigram tokens of each transcript, tokenizing only the cache misses
+    Args:
+        df (pd.DataFrame): QnA transcript of earnings call with 'gvkey', 'doc_date' and 'componentText'
+        nlp (spacy.lang.en.English): spacy nlp object
+        cache_dir (str): directory of the token cache
+        noun (bool): if True, consider only noun, else consider non-removal pos
+        n_process (int): number of processes for nlp.pipe, -1 to use all cores
+        batch_size (int): number of texts buffered per process
+    Returns:
+        tokens (list): list of tokens, in the order of df
+    """
+    model_version = get_model_version(nlp)
+    keys = [token_cache_key(gvkey, doc_date, text, noun, model_version)
+            for gvkey, doc_date, text in zip(df['gvkey'], df['doc_date'], df['componentText'])]
+
+    tokens = [None] * len(keys)
+    miss_idx = []
+    for i, key in enumerate(keys):
+        path = _token_cache_path(cache_dir, key)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                tokens[i] = pickle.load(f)
+        else:
+            miss_idx.append(i)
+    print(f'Token cache: {len(keys) - len(miss_idx)} hits, {len(miss_idx)} misses')
+
+    text_data = df['componentText'].iloc[miss_idx]
+    doc_tokens = iter_doc_tokens(text_data, nlp, noun, n_process, batch_size)
+    for i, proj_tok in tqdm(zip(miss_idx, doc_tokens), total=len(miss_idx)):
+        path = _token_cache_path(cache_dir, keys[i])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so an interrupted run never leaves a partial entry
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(proj_tok, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        tokens[i] = proj_tok
+    return tokens
+
+def tokenize_text(df, nlp, noun=True, n_process=1, batch_size=1000, cache_dir=None, phrases_path=None):
     """
     Tokenize text using spacy and gensim
     Args:
         df (pd.DataFrame): QnA transcript of earnings call
         nlp (spacy.lang.en.English): spacy nlp object
         noun (bool): if True, consider only noun, else consider non-removal pos
+        n_process (int): number of processes for nlp.pipe, -1 to use all cores
+        batch_size (int): number of texts buffered per process
+        cache_dir (str): if given, reuse the cached tokens of unchanged transcripts
+        phrases_path (str): if given, reuse the phrase model saved at this path, or learn and save it there
+            if it does not exist yet, so the bigrams do not change when transcripts are added
     Returns:
         tokens (list): list of tokens
     """
-    removal= ['ADV','PRON','CCONJ','PUNCT','PART','DET','ADP','SPACE', 'NUM', 'SYM']
-    consider_only = ['NOUN']
-    text_data = df['componentText']
-    tqdm_len = len(text_data)
-    tokens = []
-
-    for qna in tqdm(nlp.pipe(text_data), total=tqdm_len):
-        if noun:
-            proj_tok = [token.lemma_.lower()
-                        for token in qna
-                        if token.pos_ in consider_only 
-                        and not token.is_stop and token.is_alpha]
+    with stage('tokenize_text.spacy', cached=cache_dir is not None) as s:
+        if cache_dir is not None:
+            tokens = get_cached_tokens(df, nlp, cache_dir, noun, n_process, batch_size)
         else:
-            proj_tok = [token.lemma_.lower()
-                        for token in qna
-                        if token.pos_ not in removal
-                        and not token.is_stop and token.is_alpha]
-        tokens.append(proj_tok)
+            text_data = df['componentText']
+            tqdm_len = len(text_data)
+            tokens = []
+
+            for proj_tok in tqdm(iter_doc_tokens(text_data, nlp, noun, n_process, batch_size), total=tqdm_len):
+                tokens.append(proj_tok)
+        if s.enabled:
+            s.add(n_docs=len(tokens), n_tokens=sum(len(doc) for doc in tokens))
 
     # make a bigram for better analysis
-    bigram = gensim.models.phrases.Phrases(tokens)
-    tokens = [bigram[line] for line in tokens]
-    tokens = [bigram[line] for line in tokens]
+    with stage('tokenize_text.phrases') as s:
+        if phrases_path is not None and os.path.exists(phrases_path):
+            bigram = load_phrases(phrases_path)
+        else:
+            bigram = learn_phrases([tokens], path=phrases_path)
+        tokens = list(apply_phrases(bigram, tokens))
+        if s.enabled:
+            s.add(n_docs=len(tokens), n_tokens=sum(len(doc) for doc in tokens))
     return tokens
 
-def add_tokenized_text(df, tokens):
+def tokenize_text_to_disk(df, nlp, out_dir, noun=True, n_process=-1, batch_size=1000, chunk_size=5000):
+    """
+    Tokenize text with multiple processes and stream the tokens to disk in chunks,
+    so memory stays flat regardless of the corpus size.
+    The bigram stage is not applied here, the chunks hold the unigram tokens.
+    Args:
+        df (pd.DataFrame): QnA transcript of earnings call
+        nlp (spacy.lang.en.English): spacy nlp object
+        out_dir (str): directory to write the token chunks
+        noun (bool): if True, consider only noun, else consider non-removal pos
+        n_process (int): number of processes for nlp.pipe, -1 to use all cores
+        batch_size (int): number of texts buffered per process
+        chunk_size (int): number of documents per chunk file
+    Returns:
+        chunk_paths (list): paths of the pickled token chunks, in document order
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    text_data = df['componentText']
+    chunk_paths = []
+    chunk = []
+
+    def _dump(chunk):
+        path = os.path.join(out_dir, f'tokens_{len(chunk_paths):05d}.pkl')
+        with open(path, 'wb') as f:
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        chunk_paths.append(path)
+
+    with stage('tokenize_text_to_disk') as s:
+        for proj_tok in tqdm(iter_doc_tokens(text_data, nlp, noun, n_process, batch_size), total=len(text_data)):
+            chunk.append(proj_tok)
+            if s.enabled:
+                s.add(n_docs=1, n_tokens=len(proj_tok))
+            if len(chunk) == chunk_size:
+                _dump(chunk)
+                chunk = []
+        if chunk:
+            _dump(chunk)
+    return chunk_paths
+
+def iter_token_chunks(chunk_paths):
+    """
+    Read back the token chunks written by tokenize_text_to_disk one at a time
+    Args:
+        chunk_paths (list): paths of the pickled token chunks
+    Yields:
+        chunk (list): list of tokens for the documents in the chunk
+    """
+    for path in chunk_paths:
+        with open(path, 'rb') as f:
+            yield pickle.load(f)
+
+def learn_phrases(token_chunks, path=None, **phrases_kwargs):
+    """
+    Learn the bigram statistics from a stream of token chunks and freeze them
+    Args:
+        token_chunks (iterable): chunks of documents, each a list of tokens (e.g. iter_token_chunks)
+        path (str): if given, save the frozen phrases to this path
+        phrases_kwargs: keyword arguments of gensim.models.phrases.Phrases (min_count, threshold, ...)
+    Returns:
+        bigram (gensim.models.phrases.FrozenPhrases): frozen phrase model
+    """
+    phrases = gensim.models.phrases.Phrases(**phrases_kwargs)
+    for chunk in token_chunks:
+        phrases.add_vocab(chunk)
+    bigram = phrases.freeze()
+    if path is not None:
+        bigram.save(path)
+    return bigram
+
+def load_phrases(path):
+    """
+    Load a frozen phrase model saved by learn_phrases
+    Args:
+        path (str): path of the saved phrase model
+    Returns:
+        bigram (gensim.models.phrases.FrozenPhrases): frozen phrase model
+    """
+    return gensim.models.phrases.FrozenPhrases.load(path)
+
+def apply_phrases(bigram, tokens, passes=2):
+    """
+    Lazily apply the phrase model to each document
+    Args:
+        bigram (gensim.models.phrases.FrozenPhrases): frozen phrase model
+        tokens (iterable): list of tokens for each document
+        passes (int): number of times the phrases are applied, 2 also joins bigrams into longer phrases
+    Yields:
+        line (list): phrased tokens of each document
+    """
+    for line in tokens:
+        for _ in range(passes):
+            line = bigram[line]
+        yield line
+
+_worker_bigram = None
+
+def _init_phrases_worker(phrases_path):
+    global _worker_bigram
+    _worker_bigram = load_phrases(phrases_path)
+
+def _apply_phrases_to_chunk(args):
+    chunk_path, out_path, passes = args
+    with open(chunk_path, 'rb') as f:
+        chunk = pickle.load(f)
+    chunk = list(apply_phrases(_worker_bigram, chunk, passes))
+    with open(out_path, 'wb') as f:
+        pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return out_path
+
+def apply_phrases_to_chunks(phrases_path, chunk_paths, out_dir, passes=2, n_process=None):
+    """
+    Apply a saved phrase model to token chunks in parallel, one chunk per task
+    Args:
+        phrases_path (str): path of the saved phrase model (see learn_phrases)
+        chunk_paths (list): paths of the pickled token chunks (see tokenize_text_to_disk)
+        out_dir (str): directory to write the phrased chunks
+        passes (int): number of times the phrases are applied
+        n_process (int): number of worker processes, None to use all cores
+    Returns:
+        out_paths (list): paths of the phrased chunks, in the order of chunk_paths
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(path, os.path.join(out_dir, os.path.basename(path)), passes) for path in chunk_paths]
+    with stage('apply_phrases_to_chunks', n_chunks=len(tasks)), \
+            Pool(n_process, initializer=_init_phrases_worker, initargs=(phrases_path,)) as pool:
+        out_paths = list(tqdm(pool.imap(_apply_phrases_to_chunk, tasks), total=len(tasks)))
+    return out_paths
+
+def add_tokenized_text(df, tokens=None, nlp=None, noun=True, cache_dir=None, phrases_path=None):
     """
     Add tokenized text to the dataframe
     Args:
         df (pd.DataFrame): QnA transcript of earnings call
-        tokens (list): list of tokens
+        tokens (list): list of tokens, if None the text is tokenized with nlp
+        nlp (spacy.lang.en.English): spacy nlp object, used when tokens is None
+        noun (bool): tokenization mode, used when tokens is None
+        cache_dir (str): token cache directory, used when tokens is None
+        phrases_path (str): saved phrase model (see tokenize_text), used when tokens is None
     Returns:
         df (pd.DataFrame): QnA transcript of earnings call with tokenized text
     """
+    if tokens is None:
+        tokens = tokenize_text(df, nlp, noun=noun, cache_dir=cache_dir, phrases_path=phrases_path)
     df['qna tokens'] = tokens
 
     # get the quarter of the transcript
@@ -0,0 +1,110 @@
+import os
+import json
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# date-by-ticker daily close prices:
+# dates (np.ndarray of datetime64[ns]): sorted trading dates, the rows of prices
+# tickers (list): tickers, the columns of prices
+# prices (np.ndarray of float64): (n_dates, n_tickers) close prices, NaN if missing
+# ticker_index (dict): ticker -> column of prices
+PriceStore = namedtuple('PriceStore', ['dates', 'tickers', 'prices', 'ticker_index'])
+
+PRICE_CSV = 'data/stock_price_2014_2023.csv'
+PRICE_STORE_DIR = 'data/price_store'
+
+
+def build_price_store(csv_path=PRICE_CSV, store_dir=PRICE_STORE_DIR):
+    '''Convert the daily price csv once into a date-by-ticker array on disk
+
+    ** Inputs **
+    csv_path: str -> csv with 'DlyCalDt', 'Ticker' and 'DlyClose' columns
+    store_dir: str -> directory to write the price store
+
+    ** Returns **
+    store: PriceStore -> the memory-mapped price store
+    '''
+    stock_price = pd.read_csv(csv_path, index_col=0).reset_index()
+    # set 'Dly Cal Dt' as index and 'Ticker' as columns
+    stock_price = stock_price.pivot_table(index='DlyCalDt', columns='Ticker', values='DlyClose', aggfunc='first')
+    stock_price.index = pd.to_datetime(stock_price.index)
+    stock_price = stock_price.sort_index()
+
+    os.makedirs(store_dir, exist_ok=True)
+    # write to temporary files and move them into place, prices.npy last as it marks the store
+    # as fresh (see _is_stale), so concurrent readers never see a partially written store
+    _atomic_write(os.path.join(store_dir, 'dates.npy'),
+                  lambda f: np.save(f, stock_price.index.to_numpy(dtype='datetime64[ns]')))
+    _atomic_write(os.path.join(store_dir, 'tickers.json'),
+                  lambda f: f.write(json.dumps([str(tic) for tic in stock_price.columns]).encode('utf-8')))
+    _atomic_write(os.path.join(store_dir, 'prices.npy'),
+                  lambda f: np.save(f, stock_price.to_numpy(dtype=np.float64)))
+    return load_price_store(store_dir)
+
+def _atomic_write(path, write):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def load_price_store(store_dir=PRICE_STORE_DIR, mmap=True):
+    '''Load a price store written by build_price_store
+
+    ** Inputs **
+    store_dir: str -> directory of the price store
+    mmap: bool -> if True, memory-map the price array
+
+    ** Returns **
+    store: PriceStore -> the price store
+    '''
+    prices = np.load(os.path.join(store_dir, 'prices.npy'), mmap_mode='r' if mmap else None)
+    dates = np.load(os.path.join(store_dir, 'dates.npy'))
+    with open(os.path.join(store_dir, 'tickers.json')) as f:
+        tickers = json.load(f)
+    ticker_index = {tic: i for i, tic in enumerate(tickers)}
+    return PriceStore(dates, tickers, prices, ticker_index)
+
+def _is_stale(csv_path, store_dir):
+    store_file = os.path.join(store_dir, 'prices.npy')
+    if not os.path.exists(store_file):
+        return True
+    return os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(store_file)
+
+@lru_cache(maxsize=None)
+def get_price_store(csv_path=PRICE_CSV, store_dir=PRICE_STORE_DIR):
+    '''Get the price store, building it from the csv if it is missing or older than the csv.
+    The store is loaded once per process.
+
+    ** Inputs **
+    csv_path: str -> csv with 'DlyCalDt', 'Ticker' and 'DlyClose' columns
+    store_dir: str -> directory of the price store
+
+    ** Returns **
+    store: PriceStore -> the memory-mapped price store
+    '''
+    if _is_stale(csv_path, store_dir):
+        return build_price_store(csv_path, store_dir)
+    return load_price_store(store_dir)
+
+def get_prices(store, tic_lst, start, end):
+    '''Slice the prices of the given tickers between start and end (both inclusive)
+
+    ** Inputs **
+    store: PriceStore -> the price store
+    tic_lst: list -> list of 'tic's, tickers not in the store are ignored
+    start: datetime -> start date
+    end: datetime -> end date
+
+    ** Returns **
+    stock_price: DataFrame -> dataframe with stock price for the given 'tic's
+    '''
+    lo = np.searchsorted(store.dates, np.datetime64(pd.Timestamp(start)), side='left')
+    hi = np.searchsorted(store.dates, np.datetime64(pd.Timestamp(end)), side='right')
+    tic_lst = [tic for tic in tic_lst if tic in store.ticker_index]
+    cols = [store.ticker_index[tic] for tic in tic_lst]
+    stock_price = pd.DataFrame(np.asarray(store.prices[lo:hi])[:, cols],
+                               index=pd.DatetimeIndex(store.dates[lo:hi], name='DlyCalDt'),
+                               columns=pd.Index(tic_lst, name='Ticker'))
+    return stock_price
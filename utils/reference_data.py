@@ -0,0 +1,113 @@
+import os
+from functools import lru_cache
+import pandas as pd
+
+import logging
+logging.getLogger('yfinance').setLevel(logging.CRITICAL)
+
+import yfinance as yf
+
+# market index and 13-week treasury bill yield used for the market return and risk free rate
+MARKET_TICKERS = ['^GSPC', '^IRX']
+# GICS sector funds used as the benchmark grouping
+SECTOR_FUNDS = ['XLE', 'XLB', 'XLI', 'XLY', 'XLP', 'XLV', 'XLF', 'SMH', 'XTL', 'XLU', 'IYR']
+
+# the evaluation window of the last quarter (2023Q4) runs into 2024
+REFERENCE_START = '2014-01-01'
+REFERENCE_END = '2024-04-01'
+REFERENCE_PATH = 'data/reference_prices.parquet'
+
+
+def download_reference_prices(tickers, start=REFERENCE_START, end=REFERENCE_END):
+    '''Download the daily close prices of the tickers with a single yahoo finance request
+
+    ** Inputs **
+    tickers: list -> list of tickers
+    start: datetime -> start date
+    end: datetime -> end date (exclusive)
+
+    ** Returns **
+    prices: DataFrame -> close prices, one column per ticker
+    '''
+    prices = yf.download(list(tickers), start=start, end=end, progress=False)['Close']
+    if isinstance(prices, pd.Series):
+        prices = prices.to_frame(tickers[0])
+    prices.index = pd.to_datetime(prices.index)
+    return prices
+
+def build_reference_cache(tickers=MARKET_TICKERS + SECTOR_FUNDS, start=REFERENCE_START,
+                          end=REFERENCE_END, path=REFERENCE_PATH):
+    '''Download the full history of the reference series once and store it on disk.
+    Stock tickers can be added to the cache as well, to replace the per-ticker downloads
+    of get_stock_price.
+
+    ** Inputs **
+    tickers: list -> list of tickers
+    start: datetime -> start date
+    end: datetime -> end date (exclusive)
+    path: str -> parquet file of the cache
+
+    ** Returns **
+    prices: DataFrame -> close prices, one column per ticker
+    '''
+    prices = download_reference_prices(tickers, start, end)
+    if os.path.exists(path):
+        # keep the series already in the cache that were not downloaded again
+        cached = pd.read_parquet(path)
+        prices = cached.drop(columns=prices.columns, errors='ignore').join(prices, how='outer')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    prices.sort_index().to_parquet(path)
+    load_reference_cache.cache_clear()
+    return prices
+
+@lru_cache(maxsize=None)
+def load_reference_cache(path=REFERENCE_PATH):
+    '''Load the reference data cache, once per process
+
+    ** Inputs **
+    path: str -> parquet file of the cache
+
+    ** Returns **
+    prices: DataFrame -> close prices, one column per ticker
+    '''
+    prices = pd.read_parquet(path)
+    prices.index = pd.to_datetime(prices.index)
+    return prices.sort_index()
+
+def has_reference_cache(path=REFERENCE_PATH):
+    '''Whether the reference data cache exists on disk
+    '''
+    return os.path.exists(path)
+
+def get_reference_prices(tickers, start, end, path=REFERENCE_PATH):
+    '''Get the close prices of the tickers between start and end from the cache, without network access.
+    The window follows yf.download: start inclusive, end exclusive.
+
+    ** Inputs **
+    tickers: list -> list of tickers, all must be in the cache
+    start: datetime -> start date
+    end: datetime -> end date (exclusive)
+    path: str -> parquet file of the cache
+
+    ** Returns **
+    prices: DataFrame -> close prices, one column per ticker, days without any price dropped
+    '''
+    prices = load_reference_cache(path)
+    missing = [tic for tic in tickers if tic not in prices.columns]
+    if missing:
+        raise KeyError(f'{missing} not in the reference data cache {path}, add them with build_reference_cache')
+    prices = prices.loc[(prices.index >= pd.Timestamp(start)) & (prices.index < pd.Timestamp(end)), list(tickers)]
+    return prices.dropna(how='all')
+
+def get_sector_prices(start, end, path=REFERENCE_PATH):
+    '''Get the close prices of the GICS sector funds between start and end (exclusive)
+
+    ** Inputs **
+    start: datetime -> start date
+    end: datetime -> end date (exclusive)
+    path: str -> parquet file of the cache
+
+    ** Returns **
+    sector_df: DataFrame -> close prices, one column per sector fund
+    '''
+    return get_reference_prices(SECTOR_FUNDS, start, end, path)
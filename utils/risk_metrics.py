@@ -0,0 +1,233 @@
+import numpy as np
+import pandas as pd
+
+import warnings
+
+from scipy.stats import shapiro
+
+
+def stack_returns(returns_lst, mkt_returns_lst=None):
+    '''Stack the per-quarter group returns into one NaN-padded (quarter, day, group) tensor.
+    Within each quarter the group and market returns are aligned on the union of their dates,
+    as pandas does when subtracting the market return from a group return.
+
+    ** Inputs **
+    returns_lst: list -> per-quarter DataFrame of daily group returns (days x groups)
+    mkt_returns_lst: list -> per-quarter Series of daily market returns
+
+    ** Returns **
+    returns: np.ndarray -> (n_quarters, n_days, n_groups) daily returns, NaN where missing
+    market_returns: np.ndarray -> (n_quarters, n_days) daily market returns, None if mkt_returns_lst is None
+    group_names: list -> per-quarter list of the group names
+    '''
+    dates_lst = []
+    for i, returns in enumerate(returns_lst):
+        dates = returns.index
+        if mkt_returns_lst is not None:
+            dates = dates.union(mkt_returns_lst[i].index)
+        dates_lst.append(dates)
+
+    n_days = max((len(dates) for dates in dates_lst), default=0)
+    n_groups = max((returns.shape[1] for returns in returns_lst), default=0)
+    stacked = np.full((len(returns_lst), n_days, n_groups), np.nan)
+    market_returns = np.full((len(returns_lst), n_days), np.nan) if mkt_returns_lst is not None else None
+
+    for i, (returns, dates) in enumerate(zip(returns_lst, dates_lst)):
+        stacked[i, :len(dates), :returns.shape[1]] = returns.reindex(dates).to_numpy(dtype=np.float64)
+        if mkt_returns_lst is not None:
+            market_returns[i, :len(dates)] = mkt_returns_lst[i].reindex(dates).to_numpy(dtype=np.float64)
+
+    group_names = [list(returns.columns) for returns in returns_lst]
+    return stacked, market_returns, group_names
+
+def _mean_std(x, axis=1):
+    # NaN-aware mean and sample standard deviation (ddof=1, as pandas)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(x, axis=axis), np.nanstd(x, axis=axis, ddof=1)
+
+def _var_cvar(x, alpha, axis=1):
+    # historical value at risk (linear quantile, as pandas) and the mean of the returns below it
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        var = np.nanquantile(x, alpha, axis=axis)
+        tail = np.where(x <= np.expand_dims(var, axis), x, np.nan)
+        cvar = np.nanmean(tail, axis=axis)
+    return var, cvar
+
+def _frac_greater(values, threshold):
+    # share of the non-missing values of each quarter above the threshold
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ((values > threshold) & valid).sum(axis=1) / valid.sum(axis=1)
+
+def get_shapiro_pvalues(returns):
+    '''Shapiro-Wilk normality p-value of each (quarter, group) series
+
+    ** Inputs **
+    returns: np.ndarray -> (n_quarters, n_days, n_groups) daily returns, NaN where missing
+
+    ** Returns **
+    pvalues: np.ndarray -> (n_quarters, n_groups) p-values, NaN for series shorter than 3 days
+    '''
+    pvalues = np.full((returns.shape[0], returns.shape[2]), np.nan)
+    n_obs = (~np.isnan(returns)).sum(axis=1)
+    # shapiro has no batched form, only the series long enough to be tested are looped over
+    for q, g in zip(*np.nonzero(n_obs >= 3)):
+        series = returns[q, :, g]
+        pvalues[q, g] = shapiro(series[~np.isnan(series)]).pvalue
+    return pvalues
+
+def compute_metric_arrays(returns, market_returns, risk_free_rate, alpha=0.05):
+    '''Compute the Sharpe ratio, information ratio and historical VaR/CVaR of every series of the
+    return tensor, and the market baselines, as arrays. The leading axis can be quarters or
+    random draws of a quarter's groups.
+
+    ** Inputs **
+    returns: np.ndarray -> (n, n_days, n_groups) daily group returns, NaN where missing
+    market_returns: np.ndarray -> (n, n_days) daily market returns aligned with returns
+    risk_free_rate: array-like -> (n,) quarterly risk free rate
+
+    ** Returns **
+    metrics: dict -> 'sharpe_ratio', 'info_ratio', 'var', 'cvar' and 'has_data' of shape (n, n_groups),
+        'market_sharpe_ratio', 'market_var' and 'market_cvar' of shape (n,)
+    '''
+    returns = np.asarray(returns, dtype=np.float64)
+    market_returns = np.asarray(market_returns, dtype=np.float64)
+    risk_free_rate = np.broadcast_to(np.asarray(risk_free_rate, dtype=np.float64).reshape(-1), (returns.shape[0],))
+    has_data = (~np.isnan(returns)).any(axis=1)
+
+    excess_mean, excess_std = _mean_std(returns - risk_free_rate[:, None, None])
+    active_mean, active_std = _mean_std(returns - market_returns[:, :, None])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = excess_mean / excess_std
+        info_ratio = active_mean / active_std
+    var, cvar = _var_cvar(returns, alpha)
+
+    mkt_mean, mkt_std = _mean_std(market_returns)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        market_sharpe = (mkt_mean - risk_free_rate) / mkt_std
+    market_var, market_cvar = _var_cvar(market_returns, alpha)
+
+    return {'sharpe_ratio': np.where(has_data, sharpe, np.nan),
+            'info_ratio': np.where(has_data, info_ratio, np.nan),
+            'var': var,
+            'cvar': cvar,
+            'has_data': has_data,
+            'risk_free_rate': risk_free_rate,
+            'market_sharpe_ratio': market_sharpe,
+            'market_var': market_var,
+            'market_cvar': market_cvar}
+
+def compute_risk_metrics(returns, market_returns, risk_free_rate, mask=None, quarters=None,
+                         group_names=None, alpha=0.05, ir_threshold=0.03, normality_level=0.01,
+                         normality=True):
+    '''Compute the Sharpe ratio, information ratio, historical VaR/CVaR and normality of all
+    groups of all quarters, and the market baselines, in vectorized passes over the return tensor.
+
+    ** Inputs **
+    returns: np.ndarray -> (n_quarters, n_days, n_groups) daily group returns, NaN where missing
+    market_returns: np.ndarray -> (n_quarters, n_days) daily market returns aligned with returns
+    risk_free_rate: array-like -> (n_quarters,) quarterly risk free rate
+    mask: np.ndarray -> optional boolean mask of returns, False entries are ignored
+    quarters: list -> label of each quarter, 0..n_quarters-1 if None
+    group_names: list -> per-quarter list of the group names, group index if None
+    alpha: float -> VaR/CVaR level
+    ir_threshold: float -> information ratio threshold
+    normality_level: float -> Shapiro-Wilk significance level for the non-normal counts
+    normality: bool -> if False, skip the Shapiro-Wilk tests
+
+    ** Returns **
+    group_metrics: DataFrame -> one row per (quarter, group) with the metrics and the comparisons to the market
+    quarter_metrics: DataFrame -> one row per quarter with the market baselines and the shares of groups beating them
+    '''
+    returns = np.asarray(returns, dtype=np.float64)
+    if mask is not None:
+        returns = np.where(mask, returns, np.nan)
+    n_quarters, _, n_groups = returns.shape
+    if quarters is None:
+        quarters = list(range(n_quarters))
+
+    metrics = compute_metric_arrays(returns, market_returns, risk_free_rate, alpha)
+    sharpe, info_ratio = metrics['sharpe_ratio'], metrics['info_ratio']
+    var, cvar, has_data = metrics['var'], metrics['cvar'], metrics['has_data']
+    risk_free_rate = metrics['risk_free_rate']
+    market_sharpe, market_var, market_cvar = metrics['market_sharpe_ratio'], metrics['market_var'], metrics['market_cvar']
+
+    pvalues = get_shapiro_pvalues(returns) if normality else np.full((n_quarters, n_groups), np.nan)
+
+    q_idx, g_idx = np.nonzero(has_data)
+    if group_names is None:
+        names = g_idx
+    else:
+        names = [group_names[q][g] for q, g in zip(q_idx, g_idx)]
+    group_metrics = pd.DataFrame({
+        'quarter': [quarters[q] for q in q_idx],
+        'group': names,
+        'sharpe_ratio': sharpe[q_idx, g_idx],
+        'info_ratio': info_ratio[q_idx, g_idx],
+        'var': var[q_idx, g_idx],
+        'cvar': cvar[q_idx, g_idx],
+        'shapiro_p': pvalues[q_idx, g_idx],
+    })
+    group_metrics['sharpe_gt_market'] = group_metrics['sharpe_ratio'].to_numpy() > market_sharpe[q_idx]
+    group_metrics['var_gt_market'] = group_metrics['var'].to_numpy() > market_var[q_idx]
+    group_metrics['cvar_gt_market'] = group_metrics['cvar'].to_numpy() > market_cvar[q_idx]
+    group_metrics['info_gt_threshold'] = group_metrics['info_ratio'].to_numpy() > ir_threshold
+    group_metrics['non_normal'] = group_metrics['shapiro_p'].to_numpy() < normality_level
+
+    quarter_metrics = pd.DataFrame({
+        'quarter': quarters,
+        'n_groups': has_data.sum(axis=1),
+        'risk_free_rate': risk_free_rate,
+        'market_sharpe_ratio': market_sharpe,
+        'market_var': market_var,
+        'market_cvar': market_cvar,
+        'frac_sharpe_gt_market': _frac_greater(sharpe, market_sharpe[:, None]),
+        'frac_info_gt_threshold': _frac_greater(info_ratio, ir_threshold),
+        'frac_var_gt_market': _frac_greater(var, market_var[:, None]),
+        'frac_cvar_gt_market': _frac_greater(cvar, market_cvar[:, None]),
+        'n_non_normal': (pvalues < normality_level).sum(axis=1),
+    })
+    return group_metrics, quarter_metrics
+
+def summarize_metric_arrays(metrics, ir_threshold=0.03):
+    '''Reduce the metric arrays of compute_metric_arrays to one statistic per leading index
+
+    ** Inputs **
+    metrics: dict -> output of compute_metric_arrays
+    ir_threshold: float -> information ratio threshold
+
+    ** Returns **
+    summary: dict -> (n,) arrays of the mean Sharpe ratio, mean information ratio and the shares of
+        groups beating the market Sharpe ratio, VaR, CVaR and the information ratio threshold
+    '''
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean_sharpe = np.nanmean(metrics['sharpe_ratio'], axis=1)
+        mean_info_ratio = np.nanmean(metrics['info_ratio'], axis=1)
+    return {'mean_sharpe_ratio': mean_sharpe,
+            'mean_info_ratio': mean_info_ratio,
+            'frac_sharpe_gt_market': _frac_greater(metrics['sharpe_ratio'], metrics['market_sharpe_ratio'][:, None]),
+            'frac_info_gt_threshold': _frac_greater(metrics['info_ratio'], ir_threshold),
+            'frac_var_gt_market': _frac_greater(metrics['var'], metrics['market_var'][:, None]),
+            'frac_cvar_gt_market': _frac_greater(metrics['cvar'], metrics['market_cvar'][:, None])}
+
+def evaluate_returns(returns_lst, mkt_returns_lst, risk_free_rate_lst, quarters=None, **kwargs):
+    '''Stack the per-quarter returns and compute all risk metrics in a single call.
+    Works for the HDP topic groups as well as for the GICS sector fund returns.
+
+    ** Inputs **
+    returns_lst: list -> per-quarter DataFrame of daily group returns (days x groups)
+    mkt_returns_lst: list -> per-quarter Series of daily market returns
+    risk_free_rate_lst: list -> per-quarter risk free rate
+    quarters: list -> label of each quarter
+    kwargs: keyword arguments of compute_risk_metrics
+
+    ** Returns **
+    group_metrics: DataFrame -> one row per (quarter, group)
+    quarter_metrics: DataFrame -> one row per quarter
+    '''
+    returns, market_returns, group_names = stack_returns(returns_lst, mkt_returns_lst)
+    return compute_risk_metrics(returns, market_returns, risk_free_rate_lst,
+                                quarters=quarters, group_names=group_names, **kwargs)
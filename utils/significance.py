@@ -0,0 +1,182 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from utils.evaluation import (get_start_end_date, get_stock_price_from_csv, get_topic_membership,
+                              get_group_price_from_membership, get_mktrf_rf)
+from utils.risk_metrics import compute_metric_arrays, summarize_metric_arrays
+
+# statistics compared between the observed grouping and the random partitions
+STATISTICS = ['mean_sharpe_ratio', 'mean_info_ratio', 'frac_sharpe_gt_market',
+              'frac_info_gt_threshold', 'frac_var_gt_market', 'frac_cvar_gt_market']
+
+
+def group_prices_to_returns(group_prices):
+    '''Daily returns of equally weighted group prices, as group_price.dropna(axis=1).pct_change()
+
+    ** Inputs **
+    group_prices: np.ndarray -> (n, n_days, n_groups) group prices
+
+    ** Returns **
+    returns: np.ndarray -> (n, n_days, n_groups) returns, first day and groups with a missing price are NaN
+    '''
+    returns = np.full(group_prices.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns[:, 1:, :] = group_prices[:, 1:, :] / group_prices[:, :-1, :] - 1
+    # groups with any missing price are dropped in the evaluation
+    incomplete = np.isnan(group_prices).any(axis=1)
+    returns[np.broadcast_to(incomplete[:, None, :], returns.shape)] = np.nan
+    return returns
+
+def random_partition_group_prices(prices, sizes, n_draws, rng):
+    '''Equally weighted group prices of random ticker partitions with a fixed group-size profile.
+    All draws are evaluated at once: after permuting the tickers each group is a contiguous slice,
+    so the group sums are a single reduceat over the permuted price columns.
+
+    ** Inputs **
+    prices: np.ndarray -> (n_days, n_tickers) stock prices, NaN where missing
+    sizes: np.ndarray -> number of tickers of each group
+    n_draws: int -> number of random partitions
+    rng: np.random.Generator -> random generator
+
+    ** Returns **
+    group_prices: np.ndarray -> (n_draws, n_days, n_groups) group prices
+    '''
+    valid = ~np.isnan(prices)
+    filled = np.where(valid, prices, 0.0)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    perms = np.argsort(rng.random((n_draws, prices.shape[1])), axis=1)[:, :int(np.sum(sizes))]
+
+    # (n_days, n_draws, n_members) -> (n_days, n_draws, n_groups)
+    price_sum = np.add.reduceat(filled[:, perms], starts, axis=2)
+    member_count = np.add.reduceat(valid[:, perms].astype(np.float64), starts, axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        group_prices = price_sum / member_count
+    return group_prices.transpose(1, 0, 2)
+
+def _align_returns(returns, stock_index, dates):
+    # place returns computed on the stock trading days onto the union of stock and market dates
+    aligned = np.full((returns.shape[0], len(dates), returns.shape[2]), np.nan)
+    aligned[:, dates.get_indexer(stock_index), :] = returns
+    return aligned
+
+def _null_statistics(args):
+    prices, sizes, n_draws, seed, stock_index, dates, market_returns, risk_free_rate, alpha, ir_threshold = args
+    rng = np.random.default_rng(seed)
+    returns = group_prices_to_returns(random_partition_group_prices(prices, sizes, n_draws, rng))
+    returns = _align_returns(returns, stock_index, dates)
+    market = np.broadcast_to(market_returns, (n_draws, len(dates)))
+    metrics = compute_metric_arrays(returns, market, np.full(n_draws, risk_free_rate), alpha)
+    return summarize_metric_arrays(metrics, ir_threshold)
+
+def _observed_statistics(group_prices, stock_index, dates, market_returns, risk_free_rate, alpha, ir_threshold):
+    returns = group_prices_to_returns(group_prices[None, :, :])
+    returns = _align_returns(returns, stock_index, dates)
+    metrics = compute_metric_arrays(returns, market_returns[None, :], [risk_free_rate], alpha)
+    return {stat: value[0] for stat, value in summarize_metric_arrays(metrics, ir_threshold).items()}
+
+def significance_test_quarter(earnings_call_df, n_draws=1000, group_col='topic_allocation',
+                              benchmark_col='gsector', alpha=0.05, ir_threshold=0.03, seed=1234,
+                              executor=None, chunk_size=250):
+    '''Compare a quarter's topic groups (and the GICS sectors) against random ticker partitions
+    with the same group-size profile, evaluated on the next quarter's prices.
+    The observed groups are built as in eval_pipeline.evaluate_quarter, so a company with calls in
+    several groups is a member of each of them, and the random partitions shuffle these memberships.
+
+    ** Inputs **
+    earnings_call_df: DataFrame -> QnA transcript of a quarter with 'tic', 'doc_quarter' and the group columns
+    n_draws: int -> number of random partitions
+    group_col: str -> column of the tested grouping
+    benchmark_col: str -> column of the benchmark grouping, None to skip it
+    alpha: float -> VaR/CVaR level
+    ir_threshold: float -> information ratio threshold
+    seed: int -> seed of the random partitions
+    executor: concurrent.futures.Executor -> optional pool to draw the partitions in parallel
+    chunk_size: int -> number of draws per task
+
+    ** Returns **
+    result: DataFrame -> one row per (grouping, statistic) with the observed value, null mean/std and p-value
+    null_stats: dict -> grouping -> statistic -> (n_draws,) null distribution
+    '''
+    quarter = earnings_call_df['doc_quarter'].iloc[0]
+    start_date, end_date = get_start_end_date(earnings_call_df)
+    tic_list = earnings_call_df['tic'].unique().tolist()
+    stock_price = get_stock_price_from_csv(tic_list, start_date, end_date)
+    market_return, risk_free_rate = get_mktrf_rf(start_date, end_date + pd.DateOffset(days=1))
+    dates = stock_price.index.union(market_return.index)
+    market_returns = market_return.reindex(dates).to_numpy(dtype=np.float64)
+    prices = stock_price.to_numpy(dtype=np.float64)
+
+    groupings = [group_col] + ([benchmark_col] if benchmark_col in earnings_call_df.columns else [])
+    rows, null_stats = [], {}
+    for grouping_index, grouping in enumerate(groupings):
+        # every (ticker, group) pair of the calls, the membership of the reported evaluation;
+        # select before renaming, the frame already has a 'topic_allocation' column
+        allocation = earnings_call_df.dropna(subset=[grouping])[['tic', grouping]]
+        allocation = allocation.rename(columns={grouping: 'topic_allocation'})
+        membership, _ = get_topic_membership(allocation, stock_price.columns)
+        sizes = np.asarray(membership.sum(axis=0)).ravel().astype(int)
+        membership = membership[:, sizes > 0]
+        sizes = sizes[sizes > 0]
+        if len(sizes) == 0:
+            continue
+
+        group_prices = get_group_price_from_membership(membership, stock_price).to_numpy()
+        observed = _observed_statistics(group_prices, stock_price.index, dates, market_returns,
+                                        risk_free_rate, alpha, ir_threshold)
+        # the random partitions shuffle the memberships of this grouping: one price column per
+        # (ticker, group) pair, so a ticker in two groups is also drawn twice
+        member_prices = prices[:, membership.nonzero()[0]]
+
+        chunks = [min(chunk_size, n_draws - i) for i in range(0, n_draws, chunk_size)]
+        # an independent stream per quarter and grouping
+        seeds = np.random.SeedSequence([seed, pd.Period(quarter, freq='Q').ordinal, grouping_index]).spawn(len(chunks))
+        tasks = [(member_prices, sizes, n, s, stock_price.index, dates, market_returns, risk_free_rate,
+                  alpha, ir_threshold) for n, s in zip(chunks, seeds)]
+        parts = list(executor.map(_null_statistics, tasks)) if executor is not None else list(map(_null_statistics, tasks))
+        null = {stat: np.concatenate([part[stat] for part in parts]) for stat in STATISTICS}
+        null_stats[grouping] = null
+
+        for stat in STATISTICS:
+            values = null[stat][~np.isnan(null[stat])]
+            rows.append({'quarter': quarter,
+                         'grouping': grouping,
+                         'statistic': stat,
+                         'observed': observed[stat],
+                         'null_mean': values.mean() if len(values) else np.nan,
+                         'null_std': values.std(ddof=1) if len(values) > 1 else np.nan,
+                         # one-sided: share of random partitions doing at least as well
+                         'p_value': ((1 + (values >= observed[stat]).sum()) / (1 + len(values))
+                                     if not np.isnan(observed[stat]) else np.nan),
+                         'n_draws': len(values)})
+    return pd.DataFrame(rows), null_stats
+
+def run_significance_tests(earnings_call_qt_list, n_draws=1000, n_jobs=None, skip_last=True, **kwargs):
+    '''Run the random partition significance test for every quarter, drawing on a process pool
+
+    ** Inputs **
+    earnings_call_qt_list: list -> list of QnA transcript with inferred topics, one per quarter
+    n_draws: int -> number of random partitions per quarter
+    n_jobs: int -> number of worker processes, all cores if None
+    skip_last: bool -> skip the last quarter, whose next-quarter prices are not in the sample
+    kwargs: keyword arguments of significance_test_quarter
+
+    ** Returns **
+    results: DataFrame -> one row per (quarter, grouping, statistic)
+    null_stats: dict -> quarter -> grouping -> statistic -> null distribution
+    '''
+    if skip_last:
+        earnings_call_qt_list = earnings_call_qt_list[:-1]
+    results, null_stats = [], {}
+    with ProcessPoolExecutor(n_jobs) as executor:
+        for earnings_call_df in tqdm(earnings_call_qt_list):
+            if len(earnings_call_df) == 0:
+                continue
+            result, null = significance_test_quarter(earnings_call_df, n_draws=n_draws,
+                                                     executor=executor, **kwargs)
+            results.append(result)
+            null_stats[earnings_call_df['doc_quarter'].iloc[0]] = null
+    if not results:
+        return pd.DataFrame(), null_stats
+    return pd.concat(results, ignore_index=True), null_stats
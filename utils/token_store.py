@@ -0,0 +1,135 @@
+import os
+import json
+from collections import namedtuple
+import numpy as np
+from tqdm import tqdm
+
+# integer-encoded corpus:
+# vocab (np.ndarray of str): global vocabulary, token id -> word
+# offsets (np.ndarray of int64): document i spans ids[offsets[i]:offsets[i+1]]
+# ids (np.ndarray of uint32): token ids of all documents, concatenated
+TokenStore = namedtuple('TokenStore', ['vocab', 'offsets', 'ids'])
+
+VOCAB_FILE = 'vocab.json'
+OFFSETS_FILE = 'offsets.npy'
+IDS_FILE = 'ids.u32'
+
+
+def build_token_store(tokens, store_dir, vocab=None):
+    """
+    Encode the tokens of each document into a CSR-style integer corpus on disk
+    Args:
+        tokens (iterable): list of tokens for each document, may be a generator
+        store_dir (str): directory to write the token store
+        vocab (list): initial vocabulary, e.g. of an existing store, new words are appended
+    Returns:
+        store (TokenStore): the memory-mapped token store
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    word2id = {word: i for i, word in enumerate(vocab)} if vocab is not None else {}
+    offsets = [0]
+
+    with open(os.path.join(store_dir, IDS_FILE), 'wb') as f:
+        for doc in tqdm(tokens):
+            doc_ids = np.fromiter((word2id.setdefault(word, len(word2id)) for word in doc),
+                                  dtype=np.uint32, count=len(doc))
+            f.write(doc_ids.tobytes())
+            offsets.append(offsets[-1] + len(doc_ids))
+
+    np.save(os.path.join(store_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(store_dir, VOCAB_FILE), 'w') as f:
+        json.dump(list(word2id), f)
+    return load_token_store(store_dir)
+
+def token_store_from_df(df, store_dir, column='qna tokens'):
+    """
+    Build a token store from the tokenized column of the transcript dataframe
+    Args:
+        df (pd.DataFrame): QnA transcript of earnings call with tokenized text
+        store_dir (str): directory to write the token store
+        column (str): column holding the list of tokens
+    Returns:
+        store (TokenStore): the memory-mapped token store, row i is the i-th row of df
+    """
+    return build_token_store(df[column], store_dir)
+
+def load_token_store(store_dir, mmap=True):
+    """
+    Load a token store written by build_token_store
+    Args:
+        store_dir (str): directory of the token store
+        mmap (bool): if True, memory-map the token ids instead of reading them
+    Returns:
+        store (TokenStore): the token store
+    """
+    with open(os.path.join(store_dir, VOCAB_FILE)) as f:
+        vocab = np.array(json.load(f), dtype=object)
+    offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode='r' if mmap else None)
+
+    ids_path = os.path.join(store_dir, IDS_FILE)
+    if offsets[-1] == 0:
+        ids = np.empty(0, dtype=np.uint32)
+    elif mmap:
+        ids = np.memmap(ids_path, dtype=np.uint32, mode='r')
+    else:
+        ids = np.fromfile(ids_path, dtype=np.uint32)
+    return TokenStore(vocab, offsets, ids)
+
+def get_doc_ids(store, i):
+    """
+    Get the token ids of a document
+    Args:
+        store (TokenStore): the token store
+        i (int): position of the document
+    Returns:
+        doc_ids (np.ndarray): uint32 token ids
+    """
+    return store.ids[store.offsets[i]:store.offsets[i + 1]]
+
+def get_doc_tokens(store, i):
+    """
+    Get the tokens of a document
+    Args:
+        store (TokenStore): the token store
+        i (int): position of the document
+    Returns:
+        doc (list): list of tokens, the strings are shared with the vocabulary
+    """
+    return store.vocab[get_doc_ids(store, i)].tolist()
+
+def iter_docs(store, idx=None):
+    """
+    Iterate over the tokens of the documents
+    Args:
+        store (TokenStore): the token store
+        idx (iterable): positions of the documents, all documents if None
+    Yields:
+        doc (list): list of tokens
+    """
+    if idx is None:
+        idx = range(len(store.offsets) - 1)
+    for i in idx:
+        yield get_doc_tokens(store, i)
+
+def get_num_docs(store):
+    """
+    Number of documents in the token store
+    """
+    return len(store.offsets) - 1
+
+def get_doc_lengths(store):
+    """
+    Number of tokens of each document
+    """
+    return np.diff(store.offsets)
+
+def get_quarter_positions(df, quarter):
+    """
+    Positions of the documents of a quarter, aligned with the token store built from df
+    Args:
+        df (pd.DataFrame): QnA transcript of earnings call with 'doc_quarter'
+        quarter (pd.Period): quarter of interest
+    Returns:
+        idx (np.ndarray): row positions of the quarter in df
+    """
+    return np.flatnonzero((df['doc_quarter'] == quarter).to_numpy())
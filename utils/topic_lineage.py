@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from scipy.optimize import linear_sum_assignment
+
+
+def get_shared_vocab(hdp_model_lst):
+    '''Union of the vocabularies of the quarterly models
+
+    ** Inputs **
+    hdp_model_lst: list -> list of trained HDP models (tomotopy.HDPModel)
+
+    ** Returns **
+    word_index: dict -> word -> column of the shared vocabulary space
+    '''
+    word_index = {}
+    for hdp in hdp_model_lst:
+        for word in hdp.used_vocabs:
+            word_index.setdefault(word, len(word_index))
+    return word_index
+
+def get_topic_word_matrix(hdp, word_index):
+    '''Full word distribution of each live topic, in the shared vocabulary space
+
+    ** Inputs **
+    hdp: obj -> HDPModel trained model
+    word_index: dict -> word -> column of the shared vocabulary space (see get_shared_vocab)
+
+    ** Returns **
+    topic_word: np.ndarray -> (n_live_topics, n_words) topic-word distributions
+    live_topics: list -> topic id of each row, in the order used by topic_allocation
+    '''
+    live_topics = [k for k in range(hdp.k) if hdp.is_live_topic(k)]
+    cols = np.fromiter((word_index[word] for word in hdp.used_vocabs), dtype=np.int64, count=len(hdp.used_vocabs))
+    topic_word = np.zeros((len(live_topics), len(word_index)))
+    if live_topics:
+        topic_word[:, cols] = np.stack([hdp.get_topic_word_dist(k) for k in live_topics])
+    return topic_word, live_topics
+
+def get_topic_similarity(topic_word_a, topic_word_b):
+    '''Cosine similarity between all topics of two quarters
+
+    ** Inputs **
+    topic_word_a: np.ndarray -> (n_a, n_words) topic-word distributions
+    topic_word_b: np.ndarray -> (n_b, n_words) topic-word distributions
+
+    ** Returns **
+    similarity: np.ndarray -> (n_a, n_b) cosine similarity
+    '''
+    norm_a = np.linalg.norm(topic_word_a, axis=1, keepdims=True)
+    norm_b = np.linalg.norm(topic_word_b, axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        similarity = (topic_word_a / norm_a) @ (topic_word_b / norm_b).T
+    return np.nan_to_num(similarity)
+
+def build_topic_lineage(hdp_model_lst, quarter_lst, match_threshold=0.3, link_threshold=0.2):
+    '''Align the topics of consecutive quarters and follow them as lineages across all quarters.
+    Topics are matched one-to-one by maximizing the total cosine similarity (Hungarian algorithm);
+    a match continues a lineage. Unmatched topics start a new lineage ('birth', or 'split' if
+    they are close to a previous topic), and unmatched previous topics end theirs ('death',
+    or 'merge' if they are close to a continuing topic).
+
+    ** Inputs **
+    hdp_model_lst: list -> list of trained HDP models (tomotopy.HDPModel), in chronological order
+    quarter_lst: list -> quarter of each model
+    match_threshold: float -> minimum similarity for a one-to-one match to continue a lineage
+    link_threshold: float -> minimum similarity to record a split or merge instead of a birth or death
+
+    ** Returns **
+    lineage_df: DataFrame -> one row per (quarter, topic) with 'live_index' (the topic_allocation value)
+        and 'lineage_id'
+    events_df: DataFrame -> one row per birth, continuation, split, merge and death
+    '''
+    word_index = get_shared_vocab(hdp_model_lst)
+    assignments, events = [], []
+    prev_word, prev_topics, prev_lineage, prev_quarter = None, [], [], None
+    n_lineages = 0
+
+    for quarter, hdp in tqdm(zip(quarter_lst, hdp_model_lst), total=len(hdp_model_lst)):
+        topic_word, live_topics = get_topic_word_matrix(hdp, word_index)
+        lineage = [None] * len(live_topics)
+
+        if prev_word is not None and len(prev_topics) and len(live_topics):
+            similarity = get_topic_similarity(prev_word, topic_word)
+            rows, cols = linear_sum_assignment(-similarity)
+            matched = similarity[rows, cols] >= match_threshold
+            for i, j in zip(rows[matched], cols[matched]):
+                lineage[j] = prev_lineage[i]
+                events.append({'quarter': quarter, 'event': 'continuation', 'lineage_id': lineage[j],
+                               'topic_id': live_topics[j], 'related_lineage_id': prev_lineage[i],
+                               'similarity': similarity[i, j]})
+            matched_prev = set(rows[matched])
+        else:
+            similarity, matched_prev = None, set()
+
+        for j, topic_id in enumerate(live_topics):
+            if lineage[j] is not None:
+                continue
+            lineage[j] = n_lineages
+            n_lineages += 1
+            event, parent, sim = 'birth', None, np.nan
+            if similarity is not None and similarity.shape[0]:
+                i = int(np.argmax(similarity[:, j]))
+                if similarity[i, j] >= link_threshold:
+                    event, parent, sim = 'split', prev_lineage[i], similarity[i, j]
+            events.append({'quarter': quarter, 'event': event, 'lineage_id': lineage[j],
+                           'topic_id': topic_id, 'related_lineage_id': parent, 'similarity': sim})
+
+        for i, topic_id in enumerate(prev_topics):
+            if i in matched_prev:
+                continue
+            event, target, sim = 'death', None, np.nan
+            if similarity is not None and similarity.shape[1]:
+                j = int(np.argmax(similarity[i]))
+                if similarity[i, j] >= link_threshold:
+                    event, target, sim = 'merge', lineage[j], similarity[i, j]
+            events.append({'quarter': quarter, 'event': event, 'lineage_id': prev_lineage[i],
+                           'topic_id': topic_id, 'related_lineage_id': target, 'similarity': sim,
+                           'from_quarter': prev_quarter})
+
+        for live_index, topic_id in enumerate(live_topics):
+            assignments.append({'quarter': quarter, 'topic_id': topic_id,
+                                'live_index': live_index, 'lineage_id': lineage[live_index]})
+        prev_word, prev_topics, prev_lineage, prev_quarter = topic_word, live_topics, lineage, quarter
+
+    lineage_df = pd.DataFrame(assignments, columns=['quarter', 'topic_id', 'live_index', 'lineage_id'])
+    events_df = pd.DataFrame(events, columns=['quarter', 'event', 'lineage_id', 'topic_id',
+                                              'related_lineage_id', 'similarity', 'from_quarter'])
+    return lineage_df, events_df
+
+def get_lineage_lookup(lineage_df, by='topic_id'):
+    '''Lookup from (quarter, topic) to lineage id
+
+    ** Inputs **
+    lineage_df: DataFrame -> output of build_topic_lineage
+    by: str -> 'topic_id' for the tomotopy topic id, 'live_index' for the topic_allocation value
+
+    ** Returns **
+    lookup: dict -> (quarter, topic) -> lineage id
+    '''
+    return dict(zip(zip(lineage_df['quarter'], lineage_df[by]), lineage_df['lineage_id']))
+
+def add_topic_lineage(earnings_call_qt_list, lineage_df):
+    '''Add the lineage id of the allocated topic to each quarter's transcripts,
+    making the topic allocation comparable across quarters
+
+    ** Inputs **
+    earnings_call_qt_list: list -> list of QnA transcript with inferred topics, one per quarter
+    lineage_df: DataFrame -> output of build_topic_lineage
+
+    ** Returns **
+    earnings_call_qt_list: list -> the transcripts with a 'topic_lineage' column
+    '''
+    lookup = get_lineage_lookup(lineage_df, by='live_index')
+    for earnings_call_df in earnings_call_qt_list:
+        earnings_call_df['topic_lineage'] = [lookup.get((quarter, topic))
+                                             for quarter, topic in zip(earnings_call_df['doc_quarter'],
+                                                                       earnings_call_df['topic_allocation'])]
+    return earnings_call_qt_list
@@ -6,6 +6,7 @@ import seaborn as sns
 import pickle
 from tqdm import tqdm
 import datetime
+from scipy import sparse
 
 import warnings
 warnings.simplefilter(action="ignore", category=[SettingWithCopyWarning, DeprecationWarning])
@@ -15,58 +16,132 @@ pyLDAvis.enable_notebook()
 
 import tomotopy as tp
 
-from hdp_training import get_hdp_topics
+from utils.hdp_training import get_hdp_topics
+from utils.model_registry import get_model_topics
 
 
 def get_top_n_topic_wrds(hdp_model_lst, n):
-    # for each hdp models, get the top 10 words for each topic
+    # for each hdp models, get the top n words for each topic, or the full vocabulary if n is None
     top_words = []
     for _, hdp in enumerate(hdp_model_lst):
-        top_words.append(get_hdp_topics(hdp, top_n=n))
+        top_n = len(hdp.used_vocabs) if n is None else n
+        top_words.append(get_hdp_topics(hdp, top_n=top_n))
     return top_words
 
-def merge_top_wrds_by_qtr(top_words):
-    total_top_wrds_by_qt = []
-    for i in range(len(top_words)):
-        qt_top_wrds = []
-        for word_scr_lst in top_words[i].values():
-            for wrd, _ in word_scr_lst:
-                qt_top_wrds.append(wrd)
-        total_top_wrds_by_qt.append(qt_top_wrds)
-    return total_top_wrds_by_qt
-
-def dfdfd(top_words):
-    total_top_words = []
-    for num_periods in range(len(top_words)):
-        for _, value in top_words[num_periods].items():
-            for words in value:
-                total_top_words.append(words[0])
-
-    total_top_words = set(total_top_words)
-    total_top_words = list(total_top_words)
-    return total_top_words
-
-def dfsdafsd(total_top_wrds_by_qt, total_top_words, quarter_lst):
-    # for each list in total_top_wrds_by_qt, get the count of the words in the list that appears in total_top_words
-    # and add as a column to a new dataframe
-    word_count_df = pd.DataFrame()
-    for i in range(len(total_top_wrds_by_qt)):
-        word_count = []
-        for word in total_top_words:
-            word_count.append(total_top_wrds_by_qt[i].count(word))
-        word_count_df[quarter_lst[i]] = word_count
-    word_count_df.index = total_top_words
-    return word_count_df
-
-# for each row in word_count_df, remove the rows with more than half of the values as 0
-trimmed_word_count_df = word_count_df.loc[(word_count_df!=0).sum(axis=1) > 10]
-trimmed_word_count_df.to_csv('data/quarterly_trimmed_word_count.csv')
-
-# sum the columns of word_count_df based on the year of the column
-yrly_word_count_df = word_count_df.copy()
-yrly_word_count_df.columns = word_count_df.columns.to_timestamp().to_period('Y')
-# groupby columns and sum
-yrly_word_count_df = yrly_word_count_df.transpose().groupby(level=0).sum().transpose()
-
-trim_yrly_word_count_df = yrly_word_count_df.loc[(yrly_word_count_df!=0).sum(axis=1) > 3]
-trim_yrly_word_count_df.to_csv('data/yearly_trimmed_word_count.csv')
+def get_registry_top_wrds(quarter_lst, n, model_dir='hdp_models'):
+    # same as get_top_n_topic_wrds, read from the model registry's sidecar indexes instead of loaded models
+    return [get_model_topics(quarter, top_n=n, model_dir=model_dir) for quarter in quarter_lst]
+
+def get_word_quarter_matrix(top_words, weighted=False):
+    '''Build the sparse word-by-quarter count matrix of the topic top words in a single pass
+
+    ** Inputs **
+    top_words: list -> per quarter, the topics dict of get_hdp_topics
+    weighted: bool -> if True, sum the topic-word probabilities instead of counting the words
+
+    ** Returns **
+    word_count: scipy.sparse.csr_matrix -> (n_words, n_quarters) number of topics of the quarter
+        with the word in their top words (or the summed probabilities)
+    vocab: list -> word of each row
+    '''
+    word_index = {}
+    rows, cols, data = [], [], []
+    for j, topics in enumerate(top_words):
+        for word_scr_lst in topics.values():
+            for wrd, scr in word_scr_lst:
+                rows.append(word_index.setdefault(wrd, len(word_index)))
+                cols.append(j)
+                data.append(scr if weighted else 1)
+    # duplicate (word, quarter) entries are summed by the conversion
+    word_count = sparse.coo_matrix((np.asarray(data, dtype=np.float64 if weighted else np.int64), (rows, cols)),
+                                   shape=(len(word_index), len(top_words))).tocsr()
+    return word_count, list(word_index)
+
+def get_yearly_rollup(word_count, quarter_lst):
+    '''Sum the quarterly columns of the word count matrix by year
+
+    ** Inputs **
+    word_count: scipy.sparse matrix -> (n_words, n_quarters) word count matrix
+    quarter_lst: list -> quarter (pd.Period) of each column
+
+    ** Returns **
+    yrly_word_count: scipy.sparse.csr_matrix -> (n_words, n_years) word count matrix
+    year_lst: list -> year (pd.Period) of each column
+    '''
+    years = pd.PeriodIndex(quarter_lst).asfreq('Y')
+    year_lst = sorted(set(years))
+    year_index = {year: i for i, year in enumerate(year_lst)}
+    # (n_quarters, n_years) indicator of the year of each quarter
+    to_year = sparse.csr_matrix((np.ones(len(years), dtype=word_count.dtype),
+                                 (np.arange(len(years)), [year_index[year] for year in years])),
+                                shape=(len(years), len(year_lst)))
+    return (word_count @ to_year).tocsr(), year_lst
+
+def trim_word_count(word_count, vocab, min_periods):
+    '''Keep the words that appear in more than min_periods periods
+
+    ** Inputs **
+    word_count: scipy.sparse matrix -> (n_words, n_periods) word count matrix
+    vocab: list -> word of each row
+    min_periods: int -> the words must have a non-zero count in more than this many periods
+
+    ** Returns **
+    trimmed_word_count: scipy.sparse.csr_matrix -> word count matrix of the kept words
+    trimmed_vocab: list -> word of each kept row
+    '''
+    word_count = word_count.tocsr()
+    word_count.eliminate_zeros()
+    keep = np.flatnonzero(word_count.getnnz(axis=1) > min_periods)
+    return word_count[keep], [vocab[i] for i in keep]
+
+def word_count_to_df(word_count, vocab, periods):
+    '''Convert the word count matrix to a dataframe with words as index and periods as columns
+
+    ** Inputs **
+    word_count: scipy.sparse matrix -> (n_words, n_periods) word count matrix
+    vocab: list -> word of each row
+    periods: list -> period of each column
+
+    ** Returns **
+    word_count_df: DataFrame -> word count table
+    '''
+    return pd.DataFrame(word_count.toarray(), index=vocab, columns=pd.Index(periods))
+
+def get_trend_tables(hdp_model_lst, quarter_lst, top_n=10, weighted=False,
+                     min_quarters=10, min_years=3, top_words=None, model_dir=None):
+    '''Get the quarterly and yearly trimmed word count tables of the topic top words
+
+    ** Inputs **
+    hdp_model_lst: list -> list of trained HDP models (tomotopy.HDPModel), unused if model_dir is given
+    quarter_lst: list -> quarter (pd.Period) of each model
+    top_n: int -> number of top words per topic, None for the full vocabulary
+    weighted: bool -> if True, sum the topic-word probabilities instead of counting the words
+    min_quarters: int -> keep the words appearing in more than this many quarters
+    min_years: int -> keep the words appearing in more than this many years
+    top_words: list -> precomputed topics dicts per quarter, get_hdp_topics is called if None
+    model_dir: str -> read the top words from the model registry of this directory instead of hdp_model_lst
+
+    ** Returns **
+    trimmed_word_count_df: DataFrame -> quarterly word count table
+    trim_yrly_word_count_df: DataFrame -> yearly word count table
+    '''
+    if top_words is None and model_dir is not None:
+        top_words = get_registry_top_wrds(quarter_lst, top_n, model_dir)
+    elif top_words is None:
+        top_words = get_top_n_topic_wrds(hdp_model_lst, top_n)
+    word_count, vocab = get_word_quarter_matrix(top_words, weighted)
+
+    trimmed_word_count, trimmed_vocab = trim_word_count(word_count, vocab, min_quarters)
+    trimmed_word_count_df = word_count_to_df(trimmed_word_count, trimmed_vocab, quarter_lst)
+
+    yrly_word_count, year_lst = get_yearly_rollup(word_count, quarter_lst)
+    trim_yrly_word_count, trim_yrly_vocab = trim_word_count(yrly_word_count, vocab, min_years)
+    trim_yrly_word_count_df = word_count_to_df(trim_yrly_word_count, trim_yrly_vocab, year_lst)
+    return trimmed_word_count_df, trim_yrly_word_count_df
+
+def save_trend_tables(trimmed_word_count_df, trim_yrly_word_count_df,
+                      quarterly_path='data/quarterly_trimmed_word_count.csv',
+                      yearly_path='data/yearly_trimmed_word_count.csv'):
+    # save the trimmed quarterly and yearly word count tables
+    trimmed_word_count_df.to_csv(quarterly_path)
+    trim_yrly_word_count_df.to_csv(yearly_path)
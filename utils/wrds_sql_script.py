@@ -1,6 +1,8 @@
 # Run this script on WRDS cloud to download data from WRDS
-import wrds
+import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 def delete_duplicates(df):
     '''
@@ -11,62 +13,149 @@ def delete_duplicates(df):
     df = df.drop_duplicates(subset=['gvkey', 'mostimportantdateutc', 'componenttext'])
     return df
 
+def get_quarter_bounds(year, quarter):
+    '''
+    First day of the quarter and of the next quarter
+    Input:  year: int, quarter: int (1-4)
+    Output: start: str, end: str (ISO dates, end exclusive)
+    '''
+    start = pd.Period(year=year, quarter=quarter, freq='Q')
+    return start.start_time.strftime('%Y-%m-%d'), (start + 1).start_time.strftime('%Y-%m-%d')
 
-if __name__ == "__main__":
-    # Assuming that you have a WRDS account and generated a pgpass on WRDS cloud
-    db = wrds.Connection()
+def build_transcript_query(year, quarter, dialect='postgresql'):
+    '''
+    Query of the S&P 500 earnings call QnA of a quarter, deduplicated and merged per call in SQL
+    Input:  year: int, quarter: int (1-4)
+            dialect: str, 'postgresql' (WRDS) or 'sqlite' (local stand-in with the same schema)
+    Output: sql_query: str, one row per (gvkey, mostimportantdateutc) with the merged componenttext
+    '''
+    start, end = get_quarter_bounds(year, quarter)
+    # same company selection as the yearly extraction: a link without end date is kept whatever its start
+    snp500_query = f'''SELECT b.gvkey \
+                        FROM (SELECT * FROM crsp.dsp500list \
+                                    WHERE start<='{year}-01-01' \
+                                        and ending>='{year}-12-31' \
+                            ) as a \
+                        LEFT JOIN (SELECT * FROM crsp.ccmxpf_lnkhist \
+                                    WHERE (linkdt<='{year}-01-01' \
+                                        and linkenddt>='{year}-12-31') or linkenddt is NULL \
+                                    ) as b \
+                        ON a.permno=b.lpermno and b.linktype in ('LU','LC') and b.linkprim in ('P','C')'''
 
-    years = range(2014, 2024)
-    for year in years:
-        snp500_query = f'''SELECT b.gvkey \
-                            FROM (SELECT * FROM crsp.dsp500list \
-                                        WHERE start<=make_date({year}, 1, 1) \
-                                            and ending>=make_date({year},12,31)
-                                ) as a \
-                            LEFT JOIN (SELECT * FROM crsp.ccmxpf_lnkhist \
-                                        WHERE linkdt<=make_date({year}, 1, 1) \
-                                            and (linkenddt>=make_date({year},12,31)) or linkenddt is NULL
-                                        ) as b \
-                            ON a.permno=b.lpermno and b.linktype in ('LU','LC') and b.linkprim in ('P','C')'''
+    # keep the first occurrence of each (gvkey, date, text), as delete_duplicates did
+    query_select = '''SELECT j.gvkey, a.mostimportantdateutc, a.transcriptid, b.transcriptcomponentid, c.componenttext, \
+                        ROW_NUMBER() OVER (PARTITION BY j.gvkey, a.mostimportantdateutc, c.componenttext \
+                                           ORDER BY a.transcriptid, b.transcriptcomponentid) as rn'''
+    query_from1 = f'''FROM (SELECT * FROM ciq.wrds_transcript_detail \
+                                    WHERE keydeveventtypeid = 48 \
+                                        and transcriptpresentationtypeid=5 \
+                                        and mostimportantdateutc >= '{start}' \
+                                        and mostimportantdateutc < '{end}' \
+                            ) as a, \
+                        (SELECT * FROM ciq.wrds_transcript_person \
+                            WHERE transcriptcomponenttypeid=3 \
+                                    or transcriptcomponenttypeid=4 \
+                        ) as b, \
+                        ciq.ciqtranscriptcomponent as c,'''
+    query_from2 =   '(' + snp500_query + ')' + 'as j, ciq_common.wrds_gvkey as k'
+    query_where = '''WHERE a.companyid=k.companyid \
+                            and k.gvkey=j.gvkey \
+                            and a.transcriptid = b.transcriptid \
+                            and b.transcriptid = c.transcriptid \
+                            and b.transcriptcomponenttypeid = c.transcriptcomponenttypeid'''
+    components = ' '.join([query_select, query_from1, query_from2, query_where])
+
+    # merge the componenttext of each call in transcript/component order
+    if dialect == 'postgresql':
+        return f'''SELECT gvkey, mostimportantdateutc, \
+                        string_agg(componenttext, ' ' ORDER BY transcriptid, transcriptcomponentid) as componenttext \
+                    FROM ({components}) as t \
+                    WHERE rn = 1 \
+                    GROUP BY gvkey, mostimportantdateutc \
+                    ORDER BY gvkey, mostimportantdateutc'''
+    elif dialect == 'sqlite':
+        return f'''SELECT gvkey, mostimportantdateutc, group_concat(componenttext, ' ') as componenttext \
+                    FROM (SELECT * FROM ({components}) as t \
+                            WHERE rn = 1 \
+                            ORDER BY gvkey, mostimportantdateutc, transcriptid, transcriptcomponentid) as s \
+                    GROUP BY gvkey, mostimportantdateutc \
+                    ORDER BY gvkey, mostimportantdateutc'''
+    raise ValueError(f'Unsupported dialect: {dialect}')
+
+def stream_query(con, sql_query, chunksize=1000):
+    '''
+    Stream the query result in chunks, with a server-side cursor where the connection supports it
+    Input:  con: SQLAlchemy connection (e.g. wrds.Connection().connection) or DB-API connection (sqlite3)
+            sql_query: str
+            chunksize: int, number of rows per chunk
+    Output: iterator of pandas dataframes
+    '''
+    if hasattr(con, 'execution_options'):
+        con = con.execution_options(stream_results=True)
+    return pd.read_sql_query(sql_query, con, chunksize=chunksize)
 
+def write_parquet_partition(chunks, out_dir, year, quarter):
+    '''
+    Write the chunks of a quarter to out_dir/year={year}/quarter={quarter}/part-0.parquet
+    Input:  chunks: iterable of pandas dataframes
+            out_dir: str, root of the partitioned dataset
+            year: int, quarter: int
+    Output: n_rows: int, number of rows written
+    '''
+    path = os.path.join(out_dir, f'year={year}', f'quarter={quarter}', 'part-0.parquet')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    writer, n_rows = None, 0
+    try:
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            chunk['gvkey'] = chunk['gvkey'].astype(str)
+            chunk['mostimportantdateutc'] = pd.to_datetime(chunk['mostimportantdateutc'])
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path + '.tmp', table.schema)
+            writer.write_table(table.cast(writer.schema))
+            n_rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        os.replace(path + '.tmp', path)
+    elif os.path.exists(path):
+        # the quarter came back empty, drop the partition of an earlier extraction
+        os.remove(path)
+    return n_rows
 
-        query_select = '''SELECT j.gvkey, a.mostimportantdateutc, a.headline, b.transcriptcomponenttypeid, b.transcriptcomponenttypename, c.componenttext'''
-        query_from1 = f'''FROM (SELECT * FROM ciq.wrds_transcript_detail \
-                                        WHERE keydeveventtypeid = 48 \
-                                            and transcriptpresentationtypeid=5 \
-                                            and date_part('year', mostimportantdateutc) = {year} \
-                                ) as a, \
-                            (SELECT * FROM ciq.wrds_transcript_person \
-                                WHERE transcriptcomponenttypeid=3 \
-                                        or transcriptcomponenttypeid=4 \
-                            ) as b, \
-                            ciq.ciqtranscriptcomponent as c,'''
-        query_from2 =   '(' + snp500_query + ')' + 'as j, ciq_common.wrds_gvkey as k'
-        query_where = '''WHERE a.companyid=k.companyid \
-                                and k.gvkey=j.gvkey \
-                                and a.transcriptid = b.transcriptid \
-                                and b.transcriptid = c.transcriptid \
-                                and b.transcriptcomponenttypeid = c.transcriptcomponenttypeid'''
-        query_orderby = '''ORDER BY a.transcriptid, b.transcriptcomponentid, a.companyid'''
+def extract_transcripts(con, years, out_dir, dialect='postgresql', chunksize=1000):
+    '''
+    Extract the merged QnA transcripts quarter by quarter into a partitioned parquet dataset,
+    holding at most one chunk in memory
+    Input:  con: database connection (see stream_query)
+            years: iterable of int
+            out_dir: str, root of the partitioned dataset
+            dialect: str, 'postgresql' or 'sqlite'
+            chunksize: int, number of rows per chunk
+    Output: n_rows: dict, (year, quarter) -> number of rows written
+    '''
+    n_rows = {}
+    for year in years:
+        for quarter in range(1, 5):
+            print(f'querying {year}Q{quarter}...')
+            sql_query = build_transcript_query(year, quarter, dialect)
+            n_rows[(year, quarter)] = write_parquet_partition(stream_query(con, sql_query, chunksize),
+                                                              out_dir, year, quarter)
+            print(f'{year}Q{quarter} saved! ({n_rows[(year, quarter)]} calls)')
+    return n_rows
 
-        sql_query = ' '.join([query_select, query_from1, query_from2, query_where, query_orderby])
 
-        print(f'querying {year}...')
-        snp500_transcripts = db.raw_sql(sql_query)
-        snp500_transcripts = delete_duplicates(snp500_transcripts)
-        snp500_transcripts.to_csv(f'/home/[groupname]/[username]/data/sp500_cc_transcripts_{year}.csv', index=False)
-        print(f'{year} saved!')
+if __name__ == "__main__":
+    import wrds
 
-    db.close()
+    # Assuming that you have a WRDS account and generated a pgpass on WRDS cloud
+    db = wrds.Connection()
 
-    print('Concatenating all data...')
-    base_year = pd.read_csv('/home/[groupname]/[username]/data/sp500_cc_transcripts_2014.csv')
-    for year in years[1:]:
-        yearly_data = pd.read_csv(f'/home/[groupname]/[username]/data/sp500_cc_transcripts_{year}.csv')
-        base_year = pd.concat([base_year, yearly_data], axis=0)
-        print(f'{year} concatenated!')
+    extract_transcripts(db.connection, range(2014, 2024),
+                        '/home/[groupname]/[username]/data/sp500_cc_transcripts_2014_2023')
 
-    print('Grouping by gvkey and mostimportantdateutc to merge the componenttext...')
-    base_year = base_year.groupby(['gvkey', 'mostimportantdateutc'])['componenttext'].apply(lambda x: ' '.join(x)).reset_index()
-    base_year.to_csv('/home/[groupname]/[username]/data/sp500_cc_transcripts_2014_2023.csv', index=False)
-    print('All data saved!')
\ No newline at end of file
+    db.close()
+    print('All data saved!')
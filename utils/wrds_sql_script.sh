@@ -2,7 +2,7 @@
 #$ -cwd
 #$ -o wrds_sql_script.out -e wrds_sql_script.err
 #$ -pe onenode 1
-#$ -l m_mem_free=32G
+#$ -l m_mem_free=4G
 
 # this file is used to run the wrds_sql_script.py file in the WRDS Cloud HPC cluster
 python3 wrds_sql_script.py
\ No newline at end of file